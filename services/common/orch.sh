@@ -21,6 +21,7 @@ usage() {
     echo "Commands:"
     echo "  checkout <uuid> [file]     Checkout a resource by UUID"
     echo "  release <uuid>             Release a resource by UUID"
+    echo "  lease <uuid>               Renew the lease on a checked out resource"
     echo "  status <uuid>              Get resource status"
     echo "  validate <uuid>            Validate resource access"
     echo "  health                     Check service health"
@@ -247,6 +248,20 @@ function main() {
                 exit 1
             fi
             ;;
+        lease)
+            if [ -z "$uuid" ]; then
+                echo -e "${RED}Error:${NC} lease command requires <uuid>"
+                usage
+            fi
+            validate_uuid "$uuid"
+            echo -e "${BLUE}Renewing lease on resource:${NC} $uuid"
+            if make_request "POST" "${ORCH_SERVICE_URL}/api/v2/resource/${uuid}/lease" ""; then
+                echo -e "${GREEN}✓${NC} Lease renewed successfully"
+            else
+                echo -e "${RED}✗${NC} Failed to renew lease"
+                exit 1
+            fi
+            ;;
         status)
             if [ -z "$uuid" ]; then
                 echo -e "${RED}Error:${NC} status command requires <uuid>"
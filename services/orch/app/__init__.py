@@ -4,30 +4,52 @@ Orch Service - Resource Management System
 Main application package
 """
 
+import os
+import fcntl
 import logging
 from os import getenv
+from pathlib import Path
 
 from flask import Flask
 
 from .common.ca_certificate_manager import CACertificateManager
 from .common.checkout_manager import CheckoutManager
 from .common.container_client import ContainerClient
-from .common.database import DatabaseManager
+from .common.mapping_cache import MappingCache
+from .common.mapping_watcher import MappingWatcher
+from .common.provisioner import Provisioner
 from .common.resource_manager import ResourceManager
+from .common.storage import open_storage
 
 def create_app():
     """Create and configure the Flask application"""
     app = Flask(__name__)
 
     # Initialize components
-    app.db_manager = DatabaseManager()
-    app.ca_manager = CACertificateManager()
+    app.db_manager = open_storage()
+    app.ca_manager = CACertificateManager(db_manager=app.db_manager)
     app.resource_manager = ResourceManager(app.db_manager, app.ca_manager)
     app.container_client = ContainerClient()
-    app.checkout_manager = CheckoutManager(app.db_manager, app.resource_manager, app.container_client)
+    app.mapping_cache = MappingCache(app.db_manager, float(getenv('ORCH_MAPPING_CACHE_CHECK', '1')))
+    app.checkout_manager = CheckoutManager(app.db_manager, app.resource_manager, app.container_client,
+                                           app.mapping_cache)
 
-    # Load resource mappings
-    app.resource_manager.load_resource_mappings()
+    # Load resource mappings; the watcher re-applies them on change
+    mapping_file = getenv('ORCH_MAPPING_FILE', '/app/resource_mapping.yaml')
+    app.resource_manager.load_resource_mappings(mapping_file)
+    app.mapping_cache.invalidate()
+    app.mapping_watcher = MappingWatcher(app.resource_manager, app.mapping_cache, mapping_file,
+                                         float(getenv('ORCH_MAPPING_POLL_INTERVAL', '2')))
+
+    app.provisioner = Provisioner(app.db_manager, app.resource_manager,
+                                  int(getenv('ORCH_PROVISION_PARALLELISM', '4')),
+                                  int(getenv('ORCH_PROVISION_WORKER_SCALE', '0')))
+
+    # Under gunicorn the master only builds the app to fork it; the
+    # post_fork hook starts the background threads in each worker instead
+    if getenv('ORCH_POST_FORK_SERVICES', 'false').lower() not in ('1', 'true', 'yes'):
+        start_shared_services(app)
+        start_worker_services(app)
 
     # Register blueprints
     #from .v1 import bp as v1_bp
@@ -38,11 +60,88 @@ def create_app():
 
     return app
 
+def start_shared_services(app):
+    """
+    Start the background work that only needs to run once for all workers.
+    These threads belong to the first worker to take the background lock;
+    if it exits, the lock is freed and its replacement takes over.
+    """
+    if not _claim_background_lock(app.resource_manager.singleflight.lock_dir):
+        logging.info("Shared background services are running in another process")
+        return False
+
+    # Every worker follows container events, but only this one releases
+    # the checkouts of containers that died
+    app.checkout_manager.release_on_container_events()
+
+    # Re-apply the resource mappings whenever the file changes
+    if getenv('ORCH_MAPPING_WATCH', 'true').lower() in ('1', 'true', 'yes'):
+        app.mapping_watcher.start()
+
+    # Create every mapped resource in the background before containers ask
+    if getenv('ORCH_PROVISION_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes'):
+        app.provisioner.start()
+
+    # A low-frequency dead container sweep as a safety net for events,
+    # and expiry of lapsed leases
+    app.checkout_manager.start_background_cleanup(float(getenv('ORCH_CLEANUP_INTERVAL', '1800')))
+    app.checkout_manager.start_lease_sweep(float(getenv('ORCH_LEASE_SWEEP_INTERVAL', '30')))
+
+    # Re-check recorded Koji host registrations against the hub
+    app.resource_manager.start_koji_host_verification(float(getenv('ORCH_KOJI_HOST_VERIFY_INTERVAL', '600')))
+    return True
+
+def start_worker_services(app):
+    """
+    Start the background threads every serving process needs for itself.
+    Threads don't survive a fork, so gunicorn's post_fork hook calls this
+    in each worker; all three also restart on first use.
+    """
+    # Follow container events so dead owners are released immediately
+    app.container_client.index.start()
+
+    # Seed this process's principal existence cache
+    app.resource_manager.seed_principal_cache()
+
+    # Generate certificate keys ahead of the requests that need them
+    if app.ca_manager.key_pool:
+        app.ca_manager.key_pool.start()
+
+_background_lock_fd = None
+
+def _claim_background_lock(lock_dir: Path) -> bool:
+    """Take the background lock for the life of this process, if no other process has it"""
+    global _background_lock_fd
+    if _background_lock_fd is not None:
+        return True
+
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_dir / 'background.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _background_lock_fd = fd
+    return True
+
 log_level = getenv('ORCH_LOG_LEVEL', 'INFO').upper()
 logging.basicConfig(level=getattr(logging, log_level))
 
 logging.info(f"Starting Orch Service with log level: {log_level}")
 
-app = create_app()
+_app = None
+
+def __getattr__(name):
+    """
+    Build the package-level app (gunicorn's app:app) on first access, so
+    importing the package - as app.py does - doesn't build a second one
+    """
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # The end.
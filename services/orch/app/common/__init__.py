@@ -3,15 +3,25 @@
 Common modules for the Orch service
 """
 
+from .storage import StorageBackend, open_storage
 from .database import DatabaseManager
+from .mapping_cache import MappingCache
+from .mapping_watcher import MappingWatcher
+from .singleflight import Singleflight
+from .kadmin_pool import KadminPool
+from .principal_cache import PrincipalCache
 from .resource_manager import ResourceManager
 from .container_client import ContainerClient
+from .container_snapshot import ContainerSnapshot
 from .checkout_manager import CheckoutManager
+from .provisioner import Provisioner
 from .validators import ResourceValidator, SecurityValidator, RequestValidator
 from .error_handlers import ErrorHandler, ErrorResponse, ErrorLogger
 
 __all__ = [
-    'DatabaseManager', 'ResourceManager', 'ContainerClient', 'CheckoutManager',
+    'StorageBackend', 'open_storage', 'DatabaseManager', 'MappingCache', 'MappingWatcher',
+    'Singleflight', 'KadminPool', 'PrincipalCache', 'ResourceManager', 'ContainerClient',
+    'ContainerSnapshot', 'CheckoutManager', 'Provisioner',
     'ResourceValidator', 'SecurityValidator', 'RequestValidator',
     'ErrorHandler', 'ErrorResponse', 'ErrorLogger'
 ]
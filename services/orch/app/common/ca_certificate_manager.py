@@ -5,22 +5,55 @@ Handles CA certificate creation, management, and certificate signing
 """
 
 import os
+import copy
 import logging
+import threading
 import subprocess
-import tempfile
 from pathlib import Path
+from datetime import datetime
 from typing import Optional, Tuple
 from urllib.parse import quote_plus as urlquote
 
+from .singleflight import Singleflight
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from .cert_issuer import CertificateIssuer
+    from .key_pool import KeyPool
+except ImportError:
+    # without python3-cryptography, fall back to the openssl CLI
+    CertificateIssuer = None
+
 logger = logging.getLogger("ca_certificate_manager")
 
-class CACertificateManager:
-    """Manages CA certificate creation and certificate signing"""
+# Key algorithms by name, as openssl genpkey/req -newkey arguments
+OPENSSL_KEY_ALGORITHMS = {
+    'ecdsa-p256': ['EC', '-pkeyopt', 'ec_paramgen_curve:P-256'],
+    'ecdsa-p384': ['EC', '-pkeyopt', 'ec_paramgen_curve:P-384'],
+    'ed25519': ['ED25519'],
+    'rsa2048': ['RSA', '-pkeyopt', 'rsa_keygen_bits:2048'],
+    'rsa3072': ['RSA', '-pkeyopt', 'rsa_keygen_bits:3072'],
+    'rsa4096': ['RSA', '-pkeyopt', 'rsa_keygen_bits:4096'],
+}
 
-    def __init__(self):
+class CACertificateManager:
+    """
+    Manages CA certificate creation and certificate signing. Certificates
+    are issued in-process by a CertificateIssuer when the cryptography
+    library is available, and by the openssl CLI otherwise.
+
+    With a storage backend, serials come from an atomic counter in the
+    database and every issued certificate is recorded in its certificate
+    ledger, so workers sign without waiting on each other. Without one,
+    both paths keep the openssl CA database (serial, index.txt and a copy
+    of each certificate) up to date instead.
+    """
+
+    def __init__(self, data_dir: Path = Path('/mnt/data'), db_manager=None):
         # Directory configuration
-        self.ca_dir = Path('/mnt/data/ca')
-        self.certs_dir = Path('/mnt/data/certs')
+        self.ca_dir = Path(data_dir) / 'ca'
+        self.certs_dir = Path(data_dir) / 'certs'
         self.ca_dir.mkdir(parents=True, exist_ok=True)
         self.certs_dir.mkdir(parents=True, exist_ok=True)
 
@@ -29,6 +62,19 @@ class CACertificateManager:
         self.ca_cert_path = self.ca_dir / 'ca.crt'
         self.ca_config_path = self.ca_dir / 'ca.conf'
 
+        # gunicorn workers share the CA directory
+        self.singleflight = Singleflight(self.ca_dir.parent / 'locks')
+
+        # Serial allocation and the certificate ledger; database serials
+        # carry on from the openssl serial file of an existing CA
+        self.db_manager = db_manager
+        self.serial_floor = self._read_serial_file()
+
+        # get_ca_info, parsed again only when the CA certificate changes
+        self._ca_info_lock = threading.Lock()
+        self._ca_info = None
+        self._ca_info_signature = None
+
         # Certificate configuration
         self.cert_country = os.getenv('CERT_COUNTRY', 'US')
         self.cert_state = os.getenv('CERT_STATE', 'NC')
@@ -42,6 +88,22 @@ class CACertificateManager:
         self.ca_cn = os.getenv('CA_CN', 'koji-box-ca')
         self.ca_email = os.getenv('CA_EMAIL', 'admin@koji.box')
 
+        # Issued certificate keys, unless a mapping asks for another
+        # algorithm, generated ahead of time by the key pool
+        self.key_algorithm = os.getenv('ORCH_KEY_ALGORITHM', 'rsa2048')
+        if self.key_algorithm not in OPENSSL_KEY_ALGORITHMS:
+            raise ValueError(f"Unknown key algorithm: {self.key_algorithm}")
+        pool_algorithms = os.getenv('ORCH_KEY_POOL_ALGORITHMS', self.key_algorithm)
+
+        self.issuer = None
+        self.key_pool = None
+        if CertificateIssuer:
+            self.issuer = CertificateIssuer(self.ca_key_path, self.ca_cert_path)
+            self.key_pool = KeyPool(Path(data_dir) / 'keypool', int(os.getenv('ORCH_KEY_POOL_SIZE', '8')),
+                                    [name.strip() for name in pool_algorithms.split(',') if name.strip()])
+        else:
+            logger.warning("cryptography is not installed, issuing certificates with the openssl CLI")
+
     def _create_ca_config(self) -> bool:
         """Create OpenSSL configuration file for CA"""
         try:
@@ -167,44 +229,81 @@ keyUsage = critical, digitalSignature, cRLSign, keyCertSign
                 logger.info("CA certificate already exists")
                 return self.ca_key_path, self.ca_cert_path
 
-            # Create CA configuration if it doesn't exist
-            if not self.ca_config_path.exists():
-                if not self._create_ca_config():
-                    return None, None
+            with self.singleflight.lock('ca'):
+                # another worker may have created it while we waited
+                if self.ca_key_path.exists() and self.ca_cert_path.exists():
+                    return self.ca_key_path, self.ca_cert_path
+                return self._create_ca_certificate()
 
-            # Create CA private key
-            key_cmd = [
-                'openssl', 'genrsa', '-out', str(self.ca_key_path), '2048'
-            ]
-            result = subprocess.run(key_cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                logger.error(f"Failed to create CA private key: {result.stderr}")
-                return None, None
+        except Exception as e:
+            logger.error(f"Error creating CA certificate: {e}")
+            return None, None
 
-            # Create self-signed CA certificate
-            cert_cmd = [
-                'openssl', 'req', '-new', '-x509', '-days', str(self.ca_cert_days),
-                '-key', str(self.ca_key_path),
-                '-out', str(self.ca_cert_path),
-                '-config', str(self.ca_config_path),
-                '-subj', f"/C={self.cert_country}/ST={self.cert_state}/L={self.cert_location}/O={self.cert_org}/OU={self.cert_org_unit}/CN={self.ca_cn}/emailAddress={self.ca_email}"
-            ]
+    def _create_ca_certificate(self) -> Tuple[Optional[Path], Optional[Path]]:
+        # Create CA configuration if it doesn't exist
+        if not self.ca_config_path.exists():
+            if not self._create_ca_config():
+                return None, None
 
-            result = subprocess.run(cert_cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                logger.error(f"Failed to create CA certificate: {result.stderr}")
+        # build under temporary names; the certificate appears last
+        key_tmp = self._tmp_path(self.ca_key_path)
+        cert_tmp = self._tmp_path(self.ca_cert_path)
+        try:
+            if self.issuer:
+                subject = CertificateIssuer.name([
+                    (NameOID.COUNTRY_NAME, self.cert_country),
+                    (NameOID.STATE_OR_PROVINCE_NAME, self.cert_state),
+                    (NameOID.LOCALITY_NAME, self.cert_location),
+                    (NameOID.ORGANIZATION_NAME, self.cert_org),
+                    (NameOID.ORGANIZATIONAL_UNIT_NAME, self.cert_org_unit),
+                    (NameOID.COMMON_NAME, self.ca_cn),
+                    (NameOID.EMAIL_ADDRESS, self.ca_email),
+                ])
+                self.issuer.create_ca(subject, self.ca_cert_days, key_tmp, cert_tmp)
+            elif not self._create_ca_certificate_openssl(key_tmp, cert_tmp):
                 return None, None
 
             # Set appropriate permissions
-            self.ca_key_path.chmod(0o600)  # More restrictive for CA key
-            self.ca_cert_path.chmod(0o644)
+            key_tmp.chmod(0o600)  # More restrictive for CA key
+            cert_tmp.chmod(0o644)
+            os.replace(key_tmp, self.ca_key_path)
+            os.replace(cert_tmp, self.ca_cert_path)
 
             logger.info(f"Created CA certificate at {self.ca_cert_path} and key at {self.ca_key_path}")
             return self.ca_key_path, self.ca_cert_path
+        finally:
+            key_tmp.unlink(missing_ok=True)
+            cert_tmp.unlink(missing_ok=True)
+
+    def _create_ca_certificate_openssl(self, key_tmp: Path, cert_tmp: Path) -> bool:
+        # Create CA private key
+        key_cmd = [
+            'openssl', 'genrsa', '-out', str(key_tmp), '2048'
+        ]
+        result = subprocess.run(key_cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.error(f"Failed to create CA private key: {result.stderr}")
+            return False
 
-        except Exception as e:
-            logger.error(f"Error creating CA certificate: {e}")
-            return None, None
+        # Create self-signed CA certificate
+        cert_cmd = [
+            'openssl', 'req', '-new', '-x509', '-days', str(self.ca_cert_days),
+            '-key', str(key_tmp),
+            '-out', str(cert_tmp),
+            '-config', str(self.ca_config_path),
+            '-subj', f"/C={self.cert_country}/ST={self.cert_state}/L={self.cert_location}/O={self.cert_org}/OU={self.cert_org_unit}/CN={self.ca_cn}/emailAddress={self.ca_email}"
+        ]
+
+        result = subprocess.run(cert_cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.error(f"Failed to create CA certificate: {result.stderr}")
+            return False
+        return True
+
+    @staticmethod
+    def _tmp_path(path: Path) -> Path:
+        """A private name to build path under before renaming it into place"""
+        return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
 
     def get_ca_certificate(self) -> Optional[Path]:
         """Get CA certificate path, creating it if it doesn't exist"""
@@ -221,37 +320,179 @@ keyUsage = critical, digitalSignature, cRLSign, keyCertSign
             logger.error(f"Error getting CA certificate: {e}")
             return None
 
-    def create_certificate_signed_by_ca(self, cn: str) -> Tuple[Optional[Path], Optional[Path]]:
-        """Create a certificate signed by the CA"""
+    def create_certificate_signed_by_ca(self, cn: str,
+                                        key_algorithm: str = None) -> Tuple[Optional[Path], Optional[Path]]:
+        """
+        Create a certificate signed by the CA, with a key_algorithm key (default ORCH_KEY_ALGORITHM)
+        An existing certificate is reused, unless key_algorithm was asked for
+        explicitly and the ledger shows the existing key is of another algorithm.
+        """
         try:
+            requested = key_algorithm
+            key_algorithm = key_algorithm or self.key_algorithm
+            if key_algorithm not in OPENSSL_KEY_ALGORITHMS:
+                logger.error(f"Unknown key algorithm {key_algorithm} for {cn}")
+                return None, None
+
             safe_cn = urlquote(cn)
             key_path = self.certs_dir / f"{safe_cn}.key"
             crt_path = self.certs_dir / f"{safe_cn}.crt"
-            csr_path = self.certs_dir / f"{safe_cn}.csr"
 
-            if key_path.exists() and crt_path.exists():
+            if key_path.exists() and crt_path.exists() and not self._needs_reissue(cn, requested):
                 logger.info(f"Certificate already exists for {cn}")
                 return key_path, crt_path
 
+            # a cert and a key mapping with the same CN share one build
+            return self.singleflight.do(f"cert:{cn}", lambda: self._create_certificate_signed_by_ca(
+                cn, key_path, crt_path, key_algorithm, requested))
+
+        except Exception as e:
+            logger.error(f"Error creating CA-signed certificate for {cn}: {e}")
+            return None, None
+
+    def _create_certificate_signed_by_ca(self, cn: str, key_path: Path, crt_path: Path, key_algorithm: str,
+                                         requested: str = None) -> Tuple[Optional[Path], Optional[Path]]:
+        try:
+            # another worker may have created (or reissued) it while we waited
+            if key_path.exists() and crt_path.exists():
+                if not self._needs_reissue(cn, requested):
+                    return key_path, crt_path
+                logger.warning(f"Certificate for {cn} has a different key algorithm than the "
+                               f"{requested} its mapping asks for, reissuing it")
+
             # Ensure CA exists
             ca_cert_path = self.get_ca_certificate()
             if not ca_cert_path:
                 logger.error("CA certificate not available")
                 return None, None
 
+            # build under temporary names; readers that find both files
+            # never see a half-written pair, since the certificate appears last
+            key_tmp = self._tmp_path(key_path)
+            crt_tmp = self._tmp_path(crt_path)
+            try:
+                if self.issuer:
+                    self._issue_certificate(cn, key_tmp, crt_tmp, key_algorithm)
+                elif not self._issue_certificate_openssl(cn, key_tmp, crt_tmp, key_algorithm):
+                    return None, None
+
+                # Set appropriate permissions
+                key_tmp.chmod(0o644)
+                crt_tmp.chmod(0o644)
+                os.replace(key_tmp, key_path)
+                os.replace(crt_tmp, crt_path)
+            finally:
+                # Clean up anything left by a failed step
+                for path in (key_tmp, crt_tmp):
+                    path.unlink(missing_ok=True)
+
+            logger.info(f"Created CA-signed certificate for {cn} at {crt_path} and key at {key_path}")
+            return key_path, crt_path
+
+        except Exception as e:
+            logger.error(f"Error creating CA-signed certificate for {cn}: {e}")
+            return None, None
+
+    def _needs_reissue(self, cn: str, requested: Optional[str]) -> bool:
+        """
+        True if a mapping explicitly asked for a key algorithm that the
+        current certificate for cn, as recorded in the ledger, wasn't issued
+        with. Without a ledger entry the existing certificate is kept.
+        """
+        if requested is None or not self.db_manager:
+            return False
+        current = [entry for entry in self.db_manager.get_certificates(cn) if entry['status'] == 'valid']
+        return bool(current) and current[-1]['key_algorithm'] != requested
+
+    def _read_serial_file(self) -> int:
+        try:
+            return int((self.ca_dir / 'serial').read_text().strip() or '1000', 16)
+        except FileNotFoundError:
+            return 0x1000
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable CA serial file: {e}")
+            return 0x1000
+
+    def _allocate_serial(self) -> int:
+        serial = self.db_manager.allocate_certificate_serial(self.serial_floor)
+        if serial is None:
+            raise RuntimeError("Could not allocate a certificate serial")
+        return serial
+
+    def _record_in_ledger(self, serial: int, cn: str, fingerprint: str, key_algorithm: str,
+                          not_before: datetime, not_after: datetime):
+        """Record an issued certificate in the database; it isn't published if this fails"""
+        if not self.db_manager.record_certificate(serial, cn, fingerprint, key_algorithm,
+                                                  not_before.strftime('%Y-%m-%d %H:%M:%S'),
+                                                  not_after.strftime('%Y-%m-%d %H:%M:%S')):
+            raise RuntimeError(f"Could not record certificate {serial:X} for {cn}")
+
+    @staticmethod
+    def _serial_hex(serial: int) -> str:
+        """A serial as openssl writes it, in an even number of hex digits"""
+        serial_hex = f"{serial:X}"
+        return serial_hex.zfill(len(serial_hex) + len(serial_hex) % 2)
+
+    def _issue_certificate(self, cn: str, key_tmp: Path, crt_tmp: Path, key_algorithm: str):
+        """Sign a server_cert for cn in-process, with a pooled key when one is ready"""
+        key = self.key_pool.take(key_algorithm)
+        if key is None:
+            key = self.issuer.generate_key(key_algorithm)
+        # policy_strict keeps C, ST, O and OU from the request, and drops L
+        subject = CertificateIssuer.name([
+            (NameOID.COUNTRY_NAME, self.cert_country),
+            (NameOID.STATE_OR_PROVINCE_NAME, self.cert_state),
+            (NameOID.ORGANIZATION_NAME, self.cert_org),
+            (NameOID.ORGANIZATIONAL_UNIT_NAME, self.cert_org_unit),
+            (NameOID.COMMON_NAME, cn),
+        ])
+
+        if self.db_manager:
+            cert = self.issuer.issue(subject, key.public_key(), self._allocate_serial(), self.cert_days)
+            self._record_in_ledger(cert.serial_number, cn, CertificateIssuer.fingerprint(cert), key_algorithm,
+                                   cert.not_valid_before_utc, cert.not_valid_after_utc)
+        else:
+            with self.singleflight.lock('ca:database'):
+                serial = self._next_serial()
+                cert = self.issuer.issue(subject, key.public_key(), serial, self.cert_days)
+                self._record_certificate(cert)
+
+        CertificateIssuer.write_key(key, key_tmp)
+        CertificateIssuer.write_certificate(cert, crt_tmp)
+
+    def _next_serial(self) -> int:
+        """Take the next serial from the openssl serial file; the caller holds ca:database"""
+        serial_path = self.ca_dir / 'serial'
+        serial = int(serial_path.read_text().strip() or '1000', 16)
+        serial_tmp = self._tmp_path(serial_path)
+        serial_tmp.write_text(f"{self._serial_hex(serial + 1)}\n")
+        os.replace(serial_tmp, serial_path)
+        return serial
+
+    def _record_certificate(self, cert):
+        """Add an issued certificate to index.txt and new_certs_dir, as openssl ca does"""
+        serial_hex = self._serial_hex(cert.serial_number)
+        expires = cert.not_valid_after_utc.strftime('%y%m%d%H%M%SZ')
+        with open(self.ca_dir / 'index.txt', 'a') as f:
+            f.write(f"V\t{expires}\t\t{serial_hex}\tunknown\t{CertificateIssuer.openssl_dn(cert.subject)}\n")
+        CertificateIssuer.write_certificate(cert, self.ca_dir / f"{serial_hex}.pem")
+
+    def _issue_certificate_openssl(self, cn: str, key_tmp: Path, crt_tmp: Path, key_algorithm: str) -> bool:
+        csr_tmp = self._tmp_path(self.certs_dir / f"{urlquote(cn)}.csr")
+        try:
             # Create private key for the certificate
             key_cmd = [
-                'openssl', 'genrsa', '-out', str(key_path), '2048'
+                'openssl', 'genpkey', '-algorithm', *OPENSSL_KEY_ALGORITHMS[key_algorithm], '-out', str(key_tmp)
             ]
             result = subprocess.run(key_cmd, capture_output=True, text=True, timeout=30)
             if result.returncode != 0:
                 logger.error(f"Failed to create private key for {cn}: {result.stderr}")
-                return None, None
+                return False
 
             # Create certificate signing request
             csr_cmd = [
-                'openssl', 'req', '-new', '-key', str(key_path),
-                '-out', str(csr_path),
+                'openssl', 'req', '-new', '-key', str(key_tmp),
+                '-out', str(csr_tmp),
                 '-config', str(self.ca_config_path),
                 '-subj', f"/C={self.cert_country}/ST={self.cert_state}/L={self.cert_location}/O={self.cert_org}/OU={self.cert_org_unit}/CN={cn}"
             ]
@@ -259,66 +500,101 @@ keyUsage = critical, digitalSignature, cRLSign, keyCertSign
             result = subprocess.run(csr_cmd, capture_output=True, text=True, timeout=30)
             if result.returncode != 0:
                 logger.error(f"Failed to create CSR for {cn}: {result.stderr}")
-                return None, None
+                return False
 
-            # Sign the certificate with CA
+            # Sign the certificate with CA; openssl ca rewrites the serial
+            # file and index.txt, so one signing at a time, using the
+            # database serial when there is a ledger
             sign_cmd = [
                 'openssl', 'ca', '-batch', '-config', str(self.ca_config_path),
-                '-in', str(csr_path),
-                '-out', str(crt_path),
+                '-in', str(csr_tmp),
+                '-out', str(crt_tmp),
                 '-days', str(self.cert_days),
                 '-extensions', 'server_cert'
             ]
 
-            result = subprocess.run(sign_cmd, capture_output=True, text=True, timeout=30)
+            serial = None
+            with self.singleflight.lock('ca:database'):
+                if self.db_manager:
+                    serial = self._allocate_serial()
+                    (self.ca_dir / 'serial').write_text(f"{self._serial_hex(serial)}\n")
+                result = subprocess.run(sign_cmd, capture_output=True, text=True, timeout=30)
             if result.returncode != 0:
                 logger.error(f"Failed to sign certificate for {cn}: {result.stderr}")
-                return None, None
+                return False
 
-            # Set appropriate permissions
-            key_path.chmod(0o644)
-            crt_path.chmod(0o644)
-
-            # Clean up CSR file
-            csr_path.unlink(missing_ok=True)
+            if serial is not None:
+                return self._record_in_ledger_openssl(serial, cn, crt_tmp, key_algorithm)
+            return True
+        finally:
+            csr_tmp.unlink(missing_ok=True)
+
+    def _record_in_ledger_openssl(self, serial: int, cn: str, crt_tmp: Path, key_algorithm: str) -> bool:
+        info_cmd = [
+            'openssl', 'x509', '-in', str(crt_tmp), '-noout',
+            '-fingerprint', '-sha256', '-startdate', '-enddate'
+        ]
+        result = subprocess.run(info_cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logger.error(f"Failed to read certificate for {cn}: {result.stderr}")
+            return False
 
-            logger.info(f"Created CA-signed certificate for {cn} at {crt_path} and key at {key_path}")
-            return key_path, crt_path
-
-        except Exception as e:
-            logger.error(f"Error creating CA-signed certificate for {cn}: {e}")
-            return None, None
+        # sha256 Fingerprint=AB:..., notBefore=Oct 16 12:00:00 2026 GMT, notAfter=...
+        fields = dict(line.split('=', 1) for line in result.stdout.splitlines() if '=' in line)
+        fingerprint = next(value for name, value in fields.items() if name.endswith('Fingerprint'))
+        self._record_in_ledger(serial, cn, fingerprint.replace(':', '').lower(), key_algorithm,
+                               datetime.strptime(fields['notBefore'], '%b %d %H:%M:%S %Y GMT'),
+                               datetime.strptime(fields['notAfter'], '%b %d %H:%M:%S %Y GMT'))
+        return True
 
     def ca_exists(self) -> bool:
         """Check if CA certificate and key exist"""
         return self.ca_key_path.exists() and self.ca_cert_path.exists()
 
     def get_ca_info(self) -> dict:
-        """Get information about the CA certificate"""
+        """Get information about the CA certificate, cached by the certificate file's inode and mtime"""
         try:
             if not self.ca_exists():
                 return {'exists': False}
 
-            # Get certificate information
-            info_cmd = [
-                'openssl', 'x509', '-in', str(self.ca_cert_path),
-                '-text', '-noout'
-            ]
-            result = subprocess.run(info_cmd, capture_output=True, text=True, timeout=30)
-
-            if result.returncode != 0:
-                logger.error(f"Failed to get CA info: {result.stderr}")
-                return {'exists': True, 'error': 'Failed to read certificate'}
-
-            return {
-                'exists': True,
-                'cert_path': str(self.ca_cert_path),
-                'key_path': str(self.ca_key_path),
-                'cert_info': result.stdout
-            }
+            stat = self.ca_cert_path.stat()
+            signature = (stat.st_ino, stat.st_mtime_ns)
+            with self._ca_info_lock:
+                if self._ca_info is None or self._ca_info_signature != signature:
+                    info = self._read_ca_info()
+                    if 'error' in info:
+                        return info
+                    self._ca_info = info
+                    self._ca_info_signature = signature
+                # callers may annotate the result; keep the cached copy intact
+                return copy.deepcopy(self._ca_info)
 
         except Exception as e:
             logger.error(f"Error getting CA info: {e}")
             return {'exists': True, 'error': str(e)}
 
+    def _read_ca_info(self) -> dict:
+        info = {
+            'exists': True,
+            'cert_path': str(self.ca_cert_path),
+            'key_path': str(self.ca_key_path)
+        }
+
+        if CertificateIssuer:
+            cert = x509.load_pem_x509_certificate(self.ca_cert_path.read_bytes())
+            return {**info, **CertificateIssuer.describe(cert)}
+
+        # Without cryptography, the openssl text dump is all there is
+        info_cmd = [
+            'openssl', 'x509', '-in', str(self.ca_cert_path),
+            '-text', '-noout'
+        ]
+        result = subprocess.run(info_cmd, capture_output=True, text=True, timeout=30)
+
+        if result.returncode != 0:
+            logger.error(f"Failed to get CA info: {result.stderr}")
+            return {'exists': True, 'error': 'Failed to read certificate'}
+
+        return {**info, 'cert_info': result.stdout}
+
 # The end.
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+In-process certificate issuance for the Orch service
+Builds and signs certificates with the cryptography library instead of openssl
+"""
+
+import os
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID, ObjectIdentifier
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+
+logger = logging.getLogger("cert_issuer")
+
+# Netscape extensions carried over from the openssl CA profiles
+NS_CERT_TYPE = ObjectIdentifier('2.16.840.1.113730.1.1')
+NS_COMMENT = ObjectIdentifier('2.16.840.1.113730.1.13')
+NS_CERT_TYPE_BITS = {'client': 0x80, 'server': 0x40, 'email': 0x20}
+
+def _ns_cert_type(*types: str) -> bytes:
+    """DER BIT STRING for nsCertType (client, server, email)"""
+    value = 0
+    for cert_type in types:
+        value |= NS_CERT_TYPE_BITS[cert_type]
+    unused = (value & -value).bit_length() - 1
+    return bytes([0x03, 0x02, unused, value])
+
+def _ns_comment(comment: str) -> bytes:
+    """DER IA5String for nsComment"""
+    return bytes([0x16, len(comment)]) + comment.encode('ascii')
+
+def _ns_cert_type_names(der: bytes) -> List[str]:
+    """The types set in an nsCertType BIT STRING"""
+    return [cert_type for cert_type, bit in NS_CERT_TYPE_BITS.items() if len(der) > 3 and der[3] & bit]
+
+# Short attribute names, as openssl prints them
+SHORT_NAMES = {
+    NameOID.COUNTRY_NAME: 'C',
+    NameOID.STATE_OR_PROVINCE_NAME: 'ST',
+    NameOID.LOCALITY_NAME: 'L',
+    NameOID.ORGANIZATION_NAME: 'O',
+    NameOID.ORGANIZATIONAL_UNIT_NAME: 'OU',
+    NameOID.COMMON_NAME: 'CN',
+    NameOID.EMAIL_ADDRESS: 'emailAddress',
+}
+
+KEY_USAGES = ('digital_signature', 'content_commitment', 'key_encipherment', 'data_encipherment',
+              'key_agreement', 'key_cert_sign', 'crl_sign')
+
+# Key algorithms by the names used in configuration and resource mappings
+KEY_ALGORITHMS = {
+    'ecdsa-p256': lambda: ec.generate_private_key(ec.SECP256R1()),
+    'ecdsa-p384': lambda: ec.generate_private_key(ec.SECP384R1()),
+    'ed25519': lambda: ed25519.Ed25519PrivateKey.generate(),
+    'rsa2048': lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    'rsa3072': lambda: rsa.generate_private_key(public_exponent=65537, key_size=3072),
+    'rsa4096': lambda: rsa.generate_private_key(public_exponent=65537, key_size=4096),
+}
+
+
+class CertificateIssuer:
+    """
+    Issues certificates from the orch CA without leaving the process. The
+    CA key and certificate are loaded once and kept in memory until the
+    files change; each certificate is built and signed directly, with no
+    CSR on disk. Subjects and extensions follow the openssl CA
+    configuration they replace: the v3_ca profile for the CA itself, and
+    server_cert and usr_cert for issued certificates, whose subject is cut
+    down to the fields policy_strict keeps. Issued keys may be any of
+    KEY_ALGORITHMS; keyEncipherment is only asserted for RSA keys, since
+    EC and EdDSA keys can't encrypt.
+    """
+
+    PROFILES = ('server_cert', 'usr_cert')
+
+    def __init__(self, ca_key_path: Path, ca_cert_path: Path):
+        self.ca_key_path = Path(ca_key_path)
+        self.ca_cert_path = Path(ca_cert_path)
+
+        self._lock = threading.Lock()
+        self._ca = None
+        self._ca_signature = None
+
+    @staticmethod
+    def generate_key(algorithm: str = 'rsa2048'):
+        """Generate a private key for a certificate"""
+        if algorithm not in KEY_ALGORITHMS:
+            raise ValueError(f"Unknown key algorithm: {algorithm}")
+        return KEY_ALGORITHMS[algorithm]()
+
+    @staticmethod
+    def load_key(data: bytes):
+        """Load a PEM private key this service wrote; OpenSSL's RSA consistency check costs as much as generating one"""
+        return serialization.load_pem_private_key(data, password=None, unsafe_skip_rsa_key_validation=True)
+
+    @staticmethod
+    def name(attributes: List[Tuple[ObjectIdentifier, str]]) -> x509.Name:
+        return x509.Name([x509.NameAttribute(oid, value) for oid, value in attributes if value])
+
+    def create_ca(self, subject: x509.Name, days: int, key_path: Path, cert_path: Path):
+        """Create a CA key and self-signed certificate (the v3_ca profile) at the given paths"""
+        key = self.generate_key()
+        public_key = key.public_key()
+        now = datetime.now(timezone.utc)
+
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(subject)
+            .public_key(public_key)
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(public_key), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .add_extension(x509.KeyUsage(
+                digital_signature=True, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=True, crl_sign=True,
+                encipher_only=False, decipher_only=False), critical=True)
+            .sign(key, hashes.SHA256())
+        )
+
+        self.write_key(key, key_path, 0o600)
+        self.write_certificate(cert, cert_path)
+
+    def issue(self, subject: x509.Name, public_key, serial: int, days: int,
+              profile: str = 'server_cert') -> x509.Certificate:
+        """Build and sign a certificate for public_key with the CA"""
+        if profile not in self.PROFILES:
+            raise ValueError(f"Unknown certificate profile: {profile}")
+
+        ca_key, ca_cert = self.load_ca()
+        ca_public_key = ca_cert.public_key()
+        key_encipherment = isinstance(public_key, rsa.RSAPublicKey)
+        now = datetime.now(timezone.utc)
+
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(subject)
+            .issuer_name(ca_cert.subject)
+            .public_key(public_key)
+            .serial_number(serial)
+            .not_valid_before(now)
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+        )
+
+        if profile == 'server_cert':
+            builder = (
+                builder
+                .add_extension(x509.UnrecognizedExtension(NS_CERT_TYPE, _ns_cert_type('server')), critical=False)
+                .add_extension(x509.UnrecognizedExtension(
+                    NS_COMMENT, _ns_comment('OpenSSL Generated Server Certificate')), critical=False)
+                # keyid,issuer:always
+                .add_extension(x509.AuthorityKeyIdentifier(
+                    key_identifier=x509.SubjectKeyIdentifier.from_public_key(ca_public_key).digest,
+                    authority_cert_issuer=[x509.DirectoryName(ca_cert.issuer)],
+                    authority_cert_serial_number=ca_cert.serial_number), critical=False)
+                .add_extension(x509.KeyUsage(
+                    digital_signature=True, content_commitment=False, key_encipherment=key_encipherment,
+                    data_encipherment=False, key_agreement=False, key_cert_sign=False, crl_sign=False,
+                    encipher_only=False, decipher_only=False), critical=True)
+                .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+            )
+        else:
+            builder = (
+                builder
+                .add_extension(x509.UnrecognizedExtension(
+                    NS_CERT_TYPE, _ns_cert_type('client', 'email')), critical=False)
+                .add_extension(x509.UnrecognizedExtension(
+                    NS_COMMENT, _ns_comment('OpenSSL Generated Certificate')), critical=False)
+                .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_public_key), critical=False)
+                .add_extension(x509.KeyUsage(
+                    digital_signature=True, content_commitment=True, key_encipherment=key_encipherment,
+                    data_encipherment=False, key_agreement=False, key_cert_sign=False, crl_sign=False,
+                    encipher_only=False, decipher_only=False), critical=True)
+                .add_extension(x509.ExtendedKeyUsage([
+                    ExtendedKeyUsageOID.CLIENT_AUTH, ExtendedKeyUsageOID.EMAIL_PROTECTION]), critical=False)
+            )
+
+        return builder.sign(ca_key, hashes.SHA256())
+
+    def load_ca(self):
+        """The CA key and certificate, read from disk only when the files change"""
+        signature = tuple((stat.st_ino, stat.st_mtime_ns)
+                          for stat in (self.ca_key_path.stat(), self.ca_cert_path.stat()))
+        with self._lock:
+            if self._ca is None or self._ca_signature != signature:
+                ca_key = self.load_key(self.ca_key_path.read_bytes())
+                ca_cert = x509.load_pem_x509_certificate(self.ca_cert_path.read_bytes())
+                self._ca = (ca_key, ca_cert)
+                self._ca_signature = signature
+                logger.info(f"Loaded CA {ca_cert.subject.rfc4514_string()}")
+            return self._ca
+
+    @staticmethod
+    def key_bytes(key) -> bytes:
+        """An unencrypted PKCS#8 PEM private key"""
+        return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                 serialization.NoEncryption())
+
+    @staticmethod
+    def write_key(key, path: Path, mode: int = 0o644):
+        CertificateIssuer._write(path, CertificateIssuer.key_bytes(key), mode)
+
+    @staticmethod
+    def write_certificate(cert: x509.Certificate, path: Path, mode: int = 0o644):
+        CertificateIssuer._write(path, cert.public_bytes(serialization.Encoding.PEM), mode)
+
+    @staticmethod
+    def _write(path: Path, data: bytes, mode: int):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, mode)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.chmod(path, mode)
+
+    @staticmethod
+    def fingerprint(cert: x509.Certificate) -> str:
+        """SHA-256 fingerprint of a certificate, as lowercase hex"""
+        return cert.fingerprint(hashes.SHA256()).hex()
+
+    @staticmethod
+    def openssl_dn(name: x509.Name) -> str:
+        """A name in the /C=../CN=.. form openssl writes to index.txt"""
+        return ''.join(f"/{SHORT_NAMES.get(attr.oid, attr.oid.dotted_string)}={attr.value}" for attr in name)
+
+    @staticmethod
+    def describe(cert: x509.Certificate) -> Dict:
+        """The fields of a certificate as JSON-ready values, in place of openssl x509 -text"""
+        return {
+            'version': cert.version.value + 1,
+            'subject': CertificateIssuer._describe_name(cert.subject),
+            'issuer': CertificateIssuer._describe_name(cert.issuer),
+            'serial': f"{cert.serial_number:X}",
+            'not_before': cert.not_valid_before_utc.strftime('%Y-%m-%d %H:%M:%S'),
+            'not_after': cert.not_valid_after_utc.strftime('%Y-%m-%d %H:%M:%S'),
+            'signature_algorithm': cert.signature_algorithm_oid._name,
+            'public_key': CertificateIssuer._describe_public_key(cert.public_key()),
+            'fingerprints': {
+                'sha1': cert.fingerprint(hashes.SHA1()).hex(),
+                'sha256': cert.fingerprint(hashes.SHA256()).hex(),
+            },
+            'extensions': [{
+                'oid': ext.oid.dotted_string,
+                'name': {NS_CERT_TYPE: 'nsCertType', NS_COMMENT: 'nsComment'}.get(ext.oid, ext.oid._name),
+                'critical': ext.critical,
+                'value': CertificateIssuer._describe_extension(ext.value),
+            } for ext in cert.extensions],
+        }
+
+    @staticmethod
+    def _describe_public_key(public_key) -> Dict:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            return {'algorithm': 'RSA', 'size': public_key.key_size}
+        if isinstance(public_key, ec.EllipticCurvePublicKey):
+            return {'algorithm': 'EC', 'size': public_key.key_size, 'curve': public_key.curve.name}
+        if isinstance(public_key, ed25519.Ed25519PublicKey):
+            return {'algorithm': 'Ed25519', 'size': 256}
+        return {'algorithm': type(public_key).__name__, 'size': getattr(public_key, 'key_size', None)}
+
+    @staticmethod
+    def _describe_name(name: x509.Name) -> Dict:
+        return {
+            'dn': name.rfc4514_string({NameOID.EMAIL_ADDRESS: 'emailAddress'}),
+            'attributes': {SHORT_NAMES.get(attr.oid, attr.oid.dotted_string): attr.value for attr in name},
+        }
+
+    @staticmethod
+    def _describe_extension(value):
+        if isinstance(value, x509.BasicConstraints):
+            return {'ca': value.ca, 'path_length': value.path_length}
+        if isinstance(value, x509.KeyUsage):
+            usages = [usage for usage in KEY_USAGES if getattr(value, usage)]
+            if value.key_agreement:
+                usages += [usage for usage in ('encipher_only', 'decipher_only') if getattr(value, usage)]
+            return usages
+        if isinstance(value, x509.ExtendedKeyUsage):
+            return [oid._name for oid in value]
+        if isinstance(value, x509.SubjectKeyIdentifier):
+            return value.digest.hex()
+        if isinstance(value, x509.AuthorityKeyIdentifier):
+            return {
+                'key_identifier': value.key_identifier.hex() if value.key_identifier else None,
+                'issuer': [CertificateIssuer._describe_name(name.value)['dn']
+                           if isinstance(name, x509.DirectoryName) else str(name.value)
+                           for name in value.authority_cert_issuer or []],
+                'serial': (f"{value.authority_cert_serial_number:X}"
+                           if value.authority_cert_serial_number is not None else None),
+            }
+        if isinstance(value, x509.SubjectAlternativeName):
+            return [str(name.value) for name in value]
+        if isinstance(value, x509.UnrecognizedExtension):
+            if value.oid == NS_CERT_TYPE:
+                return _ns_cert_type_names(value.value)
+            if value.oid == NS_COMMENT:
+                return value.value[2:].decode('ascii', 'replace')
+            return value.value.hex()
+        return str(value)
+
+
+# The end.
@@ -4,23 +4,93 @@ Checkout Manager for the Orch service
 Handles complex resource checkout logic with security validation
 """
 
+import os
+import time
 import logging
+import threading
 from typing import Optional, Dict, Tuple
 from pathlib import Path
 
-from .database import DatabaseManager
+from .storage import StorageBackend
 from .resource_manager import ResourceManager
 from .container_client import ContainerClient
+from .mapping_cache import MappingCache
 
 logger = logging.getLogger("checkout_manager")
 
 class CheckoutManager:
     """Manages resource checkout operations with security validation"""
 
-    def __init__(self, db_manager: DatabaseManager, resource_manager: ResourceManager, container_client: ContainerClient):
+    # container events after which the container can no longer hold resources
+    RELEASE_ACTIONS = {'die', 'remove'}
+
+    def __init__(self, db_manager: StorageBackend, resource_manager: ResourceManager, container_client: ContainerClient,
+                 mapping_cache: MappingCache = None):
         self.db = db_manager
         self.resource_manager = resource_manager
         self.container_client = container_client
+        self.mappings = mapping_cache or MappingCache(db_manager)
+
+        # Optional leases: checkouts expire unless renewed, and while a lease
+        # is live its owner is trusted without asking the container API
+        self.lease_ttl = int(os.getenv('ORCH_LEASE_TTL', '0'))
+
+    def release_on_container_events(self):
+        """
+        Release checkouts as soon as their owner goes away. Every worker
+        follows the events stream, so this is only enabled in the one
+        process that runs the shared background services.
+        """
+        self.container_client.index.add_listener(self._on_container_event)
+
+    def _on_container_event(self, action: str, container_id: Optional[str]):
+        """Release checkouts held by a container that died or was removed"""
+        if action in self.RELEASE_ACTIONS and container_id:
+            released = self.db.release_container(container_id)
+            if released > 0:
+                logger.info(f"Container {container_id} {action}: released {released} checkout(s)")
+
+    def start_background_cleanup(self, interval: float) -> Optional[threading.Thread]:
+        """
+        Start the periodic dead container sweep. Checkouts are normally
+        released from container events, so this is only a safety net for
+        events missed while the stream was down.
+        """
+        if interval <= 0:
+            logger.info("Background cleanup disabled")
+            return None
+
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    cleaned = self.cleanup_dead_containers()
+                    if cleaned > 0:
+                        logger.info(f"Background cleanup: removed {cleaned} dead container checkouts")
+                except Exception as e:
+                    logger.error(f"Error in background cleanup: {e}")
+
+        thread = threading.Thread(target=sweep, name="background-cleanup", daemon=True)
+        thread.start()
+        return thread
+
+    def start_lease_sweep(self, interval: float) -> Optional[threading.Thread]:
+        """Start the periodic release of checkouts whose lease has lapsed"""
+        if self.lease_ttl <= 0 or interval <= 0:
+            logger.info("Lease expiry sweep disabled")
+            return None
+
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.db.expire_leases()
+                except Exception as e:
+                    logger.error(f"Error in lease expiry sweep: {e}")
+
+        thread = threading.Thread(target=sweep, name="lease-sweep", daemon=True)
+        thread.start()
+        return thread
 
     def checkout_resource(self, uuid: str, client_ip: str) -> Tuple[bool, Optional[Path], Optional[str]]:
         """
@@ -36,11 +106,11 @@ class CheckoutManager:
             container_id = container.id
 
             # Step 2: Verify container is running
-            if not self.container_client.is_container_running(container_id):
+            if not container.running:
                 return False, None, "Requesting container is not running"
 
             # Step 3: Get resource mapping
-            mapping = self.db.get_resource_mapping(uuid)
+            mapping = self.mappings.get(uuid)
             if not mapping:
                 return False, None, "Resource not found"
 
@@ -52,32 +122,41 @@ class CheckoutManager:
                 container_client=self.container_client
             )
 
-            # Step 5: Check current checkout status for this specific resource
-            status = self.db.get_resource_status(uuid, actual_resource_name)
-            if status and status['checked_out']:
-                # Check if previous owner is still alive
-                if self.container_client.is_container_running(status['container_id']):
-                    return False, None, "Resource already checked out to another container"
-                else:
-                    # Previous owner is dead, clean up
-                    logger.info(f"Cleaning up dead container checkout for {uuid} ({actual_resource_name})")
-                    self.db.release_resource(uuid, status['container_id'])
-
-            # Step 6: Checkout the resource in database
-            if not self.db.checkout_resource(
+            # Step 5: Claim the resource in a single transaction. If another
+            # container holds it, take over only if that owner is dead.
+            claim = dict(
                 uuid=uuid,
                 container_id=container_id,
                 container_ip=client_ip,
                 resource_type=mapping['resource_type'],
                 actual_resource_name=actual_resource_name,
-            ):
-                return False, None, "Failed to checkout resource in database"
+                scale_index=container.scale_index,
+                lease_ttl=self.lease_ttl,
+            )
+            claimed, previous_owner, lease_active = self.db.claim_resource(**claim)
+
+            if not claimed:
+                if previous_owner is None:
+                    return False, None, "Failed to checkout resource in database"
+
+                # Step 6: Check if previous owner is still alive - a live lease
+                # settles it, otherwise ask the container API
+                if (previous_owner == container_id or lease_active
+                        or self.container_client.is_container_running(previous_owner)):
+                    return False, None, "Resource already checked out to another container"
+
+                logger.info(f"Cleaning up dead container checkout for {uuid} ({actual_resource_name})")
+                claimed, previous_owner, _ = self.db.claim_resource(**claim, takeover_from=previous_owner)
+                if not claimed:
+                    # someone else got there first
+                    return False, None, "Resource already checked out to another container"
 
             # Step 7: Create/get the actual resource
             try:
                 resource_path = self.resource_manager.get_or_create_resource(
                     resource_type=mapping['resource_type'],
                     actual_resource_name=actual_resource_name,
+                    key_algorithm=mapping.get('key_algorithm'),
                 )
 
                 if not resource_path:
@@ -105,12 +184,14 @@ class CheckoutManager:
         """
         try:
             # Step 1: Identify requesting container
-            container_id, _ = self.container_client.identify_container_by_ip(client_ip)
-            if not container_id:
+            container = self.container_client.get_container_by_ip(client_ip)
+            if not container:
                 return False, "Unable to identify requesting container"
 
+            container_id = container.id
+
             # Step 2: Verify container is running
-            if not self.container_client.is_container_running(container_id):
+            if not container.running:
                 return False, "Requesting container is not running"
 
             # Step 3: Release the resource
@@ -124,6 +205,32 @@ class CheckoutManager:
             logger.error(f"Error in release_resource for {uuid}: {e}")
             return False, f"Internal error: {str(e)}"
 
+    def renew_lease(self, uuid: str, client_ip: str) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        Renew the lease on a resource checked out to the requesting container
+        Returns: (success, expires_at, error_message)
+        """
+        if self.lease_ttl <= 0:
+            # without leases checkouts never expire, so there is nothing to renew
+            return False, None, "Leases are disabled (ORCH_LEASE_TTL is 0)"
+
+        try:
+            # Step 1: Identify requesting container
+            container = self.container_client.get_container_by_ip(client_ip)
+            if not container:
+                return False, None, "Unable to identify requesting container"
+
+            # Step 2: Extend the lease on its checkouts of this resource
+            renewed, expires_at = self.db.renew_lease(uuid, container.id, self.lease_ttl)
+            if not renewed:
+                return False, None, "Resource not checked out to this container"
+
+            return True, expires_at, None
+
+        except Exception as e:
+            logger.error(f"Error in renew_lease for {uuid}: {e}")
+            return False, None, f"Internal error: {str(e)}"
+
     def get_resource_status(self, uuid: str) -> Optional[Dict]:
         """Get detailed resource status including container validation"""
         try:
@@ -133,9 +240,9 @@ class CheckoutManager:
 
             # Add container validation if checked out
             if status['checked_out'] and status['container_id']:
-                container_info = self.container_client.get_container_info(status['container_id'])
-                status['container_info'] = container_info
-                status['container_running'] = self.container_client.is_container_running(status['container_id'])
+                snapshot = self.container_client.get_container_snapshot(status['container_id'])
+                status['container_info'] = snapshot.to_info() if snapshot else None
+                status['container_running'] = snapshot.running if snapshot else False
 
             return status
 
@@ -158,7 +265,7 @@ class CheckoutManager:
         """
         try:
             # Check if resource exists
-            mapping = self.db.get_resource_mapping(uuid)
+            mapping = self.mappings.get(uuid)
             if not mapping:
                 return False, "Resource not found"
 
@@ -177,15 +284,14 @@ class CheckoutManager:
                 return True, None  # Resource is available
 
             # Check if requesting container owns the resource
-            container_id, _ = self.container_client.identify_container_by_ip(client_ip)
-            if not container_id:
+            if not container:
                 return False, "Unable to identify requesting container"
 
-            if status['container_id'] == container_id:
+            if status['container_id'] == container.id:
                 return True, None  # Container owns the resource
 
             # Check if previous owner is still alive
-            if self.container_client.is_container_running(status['container_id']):
+            if status['lease_active'] or self.container_client.is_container_running(status['container_id']):
                 return False, "Resource checked out to another container"
             else:
                 # Previous owner is dead, resource can be accessed
@@ -4,20 +4,124 @@ Container client for Docker/Podman integration
 Handles container identification and metadata retrieval
 """
 
-import re
+import os
+import time
 import logging
+import ipaddress
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from typing import Optional, Dict, List, Tuple
 import podman
 
+from .container_index import ContainerIndex
+from .container_snapshot import ContainerSnapshot
+from .liveness_cache import LivenessCache
+
 logger = logging.getLogger("container_client")
 
 class ContainerClient:
     """Client for interacting with Docker/Podman containers"""
 
+    # container event action -> status recorded in the liveness cache; 'kill'
+    # is absent since non-fatal signals also send it
+    EVENT_STATUSES = {
+        'start': 'running',
+        'restart': 'running',
+        'unpause': 'running',
+        'pause': 'paused',
+        'die': 'exited',
+        'stop': 'exited',
+        'remove': None,
+    }
+
+    # events after which a previously unknown IP may now belong to a container
+    NEGATIVE_INVALIDATE_ACTIONS = {'resync', 'start', 'restart', 'unpause', 'connect'}
+
     def __init__(self, socket_path: str = "/var/run/docker.sock"):
         self.socket_path = socket_path
         self.client = None
         self._connect()
+        self.index = ContainerIndex(self)
+
+        # Parallel inspection for cold-path scans
+        self.scan_workers = int(os.getenv('ORCH_SCAN_WORKERS', '8'))
+        self.scan_timeout = float(os.getenv('ORCH_SCAN_TIMEOUT', '10'))
+        self._scan_pool = None
+        self._scan_pool_pid = None
+        self._scan_pool_lock = threading.Lock()
+
+        # Shared liveness snapshot, kept honest by container events
+        self.liveness = LivenessCache(self, ttl=float(os.getenv('ORCH_LIVENESS_TTL', '5')))
+        self.index.add_listener(self._on_container_event)
+
+        # Short-lived cache of IPs that matched no container
+        self.negative_ttl = float(os.getenv('ORCH_NEGATIVE_TTL', '10'))
+        self._unknown_ips: Dict[str, float] = {}
+        self._unknown_lock = threading.Lock()
+        self.identify_misses = 0
+        self.negative_cache_hits = 0
+
+        # gunicorn forks workers from a --preload master; give each worker
+        # its own API connections rather than sharing the master's sockets
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Reset per-process state in a forked child"""
+        self._scan_pool_lock = threading.Lock()
+        self._unknown_lock = threading.Lock()
+        if self.client is not None:
+            # no ping here: the parent just checked, and this runs in the fork
+            self.client = podman.PodmanClient(base_url=f"unix://{self.socket_path}")
+
+    def _on_container_event(self, action: str, container_id: Optional[str]):
+        """Apply container events to the liveness and negative caches"""
+        if action == 'resync':
+            self.liveness.invalidate()
+        elif action in self.EVENT_STATUSES:
+            self.liveness.mark(container_id, self.EVENT_STATUSES[action])
+
+        if action in self.NEGATIVE_INVALIDATE_ACTIONS:
+            self.clear_negative_cache()
+
+    def _is_known_miss(self, request_ip: str) -> bool:
+        """Check the negative cache for an IP that recently matched no container"""
+        with self._unknown_lock:
+            expires = self._unknown_ips.get(request_ip)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._unknown_ips[request_ip]
+                return False
+            self.negative_cache_hits += 1
+            return True
+
+    def _record_miss(self, request_ip: str):
+        """Count an identification miss and remember the IP for a while"""
+        with self._unknown_lock:
+            self.identify_misses += 1
+            if self.negative_ttl > 0:
+                now = time.monotonic()
+                if len(self._unknown_ips) >= 1024:
+                    self._unknown_ips = {ip: expires for ip, expires in self._unknown_ips.items()
+                                         if expires >= now}
+                self._unknown_ips[request_ip] = now + self.negative_ttl
+
+    def clear_negative_cache(self):
+        """Forget all unknown IPs"""
+        with self._unknown_lock:
+            self._unknown_ips.clear()
+
+    def get_identification_stats(self) -> Dict:
+        """Container identification counters for monitoring"""
+        with self._unknown_lock:
+            return {
+                'index_ready': self.index.is_ready(),
+                'indexed_containers': len(self.index.entries()),
+                'identify_misses': self.identify_misses,
+                'negative_cache_hits': self.negative_cache_hits,
+                'negative_cache_size': len(self._unknown_ips),
+            }
 
     def _connect(self):
         """Connect to Docker daemon"""
@@ -34,38 +138,54 @@ class ContainerClient:
         """Check if connected to Docker daemon"""
         return self.client is not None
 
-    def get_container_by_ip(self, request_ip: str) -> Optional[Dict]:
+    def get_container_by_ip(self, request_ip: str) -> Optional[ContainerSnapshot]:
         """
-        Identify container by IP address and return container
+        Identify container by IP address and return a snapshot of it
         Enhanced with multiple fallback methods and better error handling
         """
         if not self.is_connected():
             logger.error("Docker client not connected")
             return None
 
+        if self._is_known_miss(request_ip):
+            logger.debug(f"No container found for IP {request_ip} (negative cache)")
+            return None
+
+        # Fast path: the event-driven index answers without an API call
+        snapshot = self.index.lookup(request_ip)
+        if self.index.is_ready():
+            if snapshot is None:
+                logger.warning(f"No container found for IP {request_ip}")
+                self._record_miss(request_ip)
+            else:
+                logger.debug(f"Found container {snapshot.id} for IP {request_ip} (index)")
+            return snapshot
+
         try:
-            containers = self.client.containers.list()
-            logger.debug(f"Searching {len(containers)} containers for IP {request_ip}")
+            # Inspect every container once, then match in memory
+            snapshots = self.snapshot_all(stop_at_ip=request_ip)
+            logger.debug(f"Searching {len(snapshots)} containers for IP {request_ip}")
 
             # Method 1: Direct IP matching
-            for container in containers:
-                if self._check_container_ip(container, request_ip):
-                    logger.debug(f"Found container {container.id} for IP {request_ip} (direct match)")
-                    return container
+            for snapshot in snapshots:
+                if self._check_container_ip(snapshot, request_ip):
+                    logger.debug(f"Found container {snapshot.id} for IP {request_ip} (direct match)")
+                    return snapshot
 
             # Method 2: Check for containers with similar IPs (subnet matching)
-            for container in containers:
-                if self._check_container_ip_subnet(container, request_ip):
-                    logger.debug(f"Found container {container.id} for IP {request_ip} (subnet match)")
-                    return container
+            for snapshot in snapshots:
+                if self._check_container_ip_subnet(snapshot, request_ip):
+                    logger.debug(f"Found container {snapshot.id} for IP {request_ip} (subnet match)")
+                    return snapshot
 
             # Method 3: Check container labels for explicit IP mapping
-            for container in containers:
-                if self._check_container_ip_label(container, request_ip):
-                    logger.debug(f"Found container {container.id} for IP {request_ip} (label match)")
-                    return container
+            for snapshot in snapshots:
+                if self._check_container_ip_label(snapshot, request_ip):
+                    logger.debug(f"Found container {snapshot.id} for IP {request_ip} (label match)")
+                    return snapshot
 
             logger.warning(f"No container found for IP {request_ip}")
+            self._record_miss(request_ip)
             return None
 
         except Exception as e:
@@ -81,158 +201,155 @@ class ContainerClient:
 
         container = self.get_container_by_ip(request_ip)
         if container:
-            return container.id, self.get_scale_index(container)
+            return container.id, container.scale_index
         return None, None
 
+    def _get_scan_pool(self) -> ThreadPoolExecutor:
+        """Get the inspection pool for this process (pools don't survive a fork)"""
+        with self._scan_pool_lock:
+            if self._scan_pool is None or self._scan_pool_pid != os.getpid():
+                self._scan_pool = ThreadPoolExecutor(
+                    max_workers=self.scan_workers, thread_name_prefix="container-scan")
+                self._scan_pool_pid = os.getpid()
+            return self._scan_pool
+
+    def snapshot_all(self, stop_at_ip: str = None, timeout: Optional[float] = -1) -> List[ContainerSnapshot]:
+        """
+        Snapshot every running container, skipping any that fail to inspect
+        Inspections fan out over a bounded pool and are returned in listing order.
+
+        Args:
+            stop_at_ip: Return just the first container found with this exact IP
+            timeout: Deadline in seconds for the whole scan, None to wait for
+                     every container, or -1 for the configured default
+        """
+        if timeout == -1:
+            timeout = self.scan_timeout
+
+        containers = self.client.containers.list()
+
+        if self.scan_workers <= 1 or len(containers) <= 1:
+            snapshots = []
+            for container in containers:
+                snapshot = self.snapshot(container)
+                if snapshot:
+                    if stop_at_ip and stop_at_ip in snapshot.ips:
+                        return [snapshot]
+                    snapshots.append(snapshot)
+            return snapshots
+
+        pool = self._get_scan_pool()
+        futures = {pool.submit(self.snapshot, container): position
+                   for position, container in enumerate(containers)}
+        results = {}
 
-    def _check_container_ip(self, container, request_ip: str) -> bool:
-        """Check if container has the exact IP address"""
         try:
-            # logger.debug(f"Container: {container.attrs}")
-            inspect = container.inspect()
-            networks = inspect.get('NetworkSettings', {}).get('Networks', {})
-            # logger.debug(f"Networks: {networks}")
-            for network_name, network_info in networks.items():
-                container_ip = network_info.get('IPAddress')
-                # logger.info(f"Container IP: {container_ip}, Request IP: {request_ip}")
-                if container_ip == request_ip:
-                    return True
-            return False
-        except Exception as e:
-            logger.debug(f"Error checking container IP for {container.id}: {e}")
-            return False
+            for future in as_completed(futures, timeout=timeout):
+                snapshot = future.result()
+                if snapshot is None:
+                    continue
+                if stop_at_ip and stop_at_ip in snapshot.ips:
+                    return [snapshot]
+                results[futures[future]] = snapshot
+
+        except FuturesTimeout:
+            logger.warning(f"Container scan exceeded {timeout}s deadline, "
+                           f"inspected {len(results)} of {len(containers)} containers")
+
+        finally:
+            # drop anything still queued once we have an answer
+            for future in futures:
+                future.cancel()
+
+        return [results[position] for position in sorted(results)]
+
+    def _check_container_ip(self, snapshot: ContainerSnapshot, request_ip: str) -> bool:
+        """Check if container has the exact IP address"""
+        return request_ip in snapshot.ips
 
-    def _check_container_ip_subnet(self, container, request_ip: str) -> bool:
+    def _check_container_ip_subnet(self, snapshot: ContainerSnapshot, request_ip: str) -> bool:
         """Check if container IP is in the same subnet as request IP"""
         try:
-            import ipaddress
             request_net = ipaddress.ip_network(f"{request_ip}/24", strict=False)
-
-            inspect = container.inspect()
-            networks = inspect.get('NetworkSettings', {}).get('Networks', {})
-            for network_info in networks.values():
-                container_ip = network_info.get('IPAddress')
-                if container_ip and ipaddress.ip_address(container_ip) in request_net:
-                    return True
-            return False
+            return any(ipaddress.ip_address(ip) in request_net for ip in snapshot.ips)
         except Exception as e:
-            logger.debug(f"Error checking container subnet for {container.id}: {e}")
+            logger.debug(f"Error checking container subnet for {snapshot.id}: {e}")
             return False
 
-    def _check_container_ip_label(self, container, request_ip: str) -> bool:
+    def _check_container_ip_label(self, snapshot: ContainerSnapshot, request_ip: str) -> bool:
         """Check if container has explicit IP mapping in labels"""
-        try:
-            inspect = container.inspect()
-            labels = inspect.get('Labels', {})
-            if 'orch.client.ip' in labels and labels['orch.client.ip'] == request_ip:
-                return True
-            if 'orch.ip' in labels and labels['orch.ip'] == request_ip:
-                return True
-            return False
-        except Exception as e:
-            logger.debug(f"Error checking container IP label for {container.id}: {e}")
-            return False
+        return request_ip in snapshot.label_ips
 
     @staticmethod
     def get_scale_index(container) -> Optional[int]:
         """Extract scale index from container metadata"""
+        if isinstance(container, ContainerSnapshot):
+            return container.scale_index
+
         try:
-            # Method 1: Parse container name (e.g., koji-worker-3)
-            container_name = container.name
-            if match := re.search(r'koji-worker-(\d+)', container_name):
-                return int(match.group(1))
-
-            # Method 2: Check labels
-            inspect = container.inspect()
-            labels = inspect.get('Labels', {})
-            if 'scale_index' in labels:
-                return int(labels['scale_index'])
-            if 'orch.scale.index' in labels:
-                return int(labels['orch.scale.index'])
-            if "com.docker.compose.container-number" in labels:
-                return int(labels['com.docker.compose.container-number'])
-
-            # Method 3: Environment variables
-            inspect = container.inspect()
-            env_vars = inspect.get('Config', {}).get('Env', [])
-            for env_var in env_vars:
-                if env_var.startswith('SCALE_INDEX='):
-                    return int(env_var.split('=', 1)[1])
-
-            # Method 4: Check for any numeric suffix in name
-            if match := re.search(r'[-_](\d+)$', container_name):
-                return int(match.group(1))
-
-            logger.debug(f"No scale index found for container {container_name}")
+            return ContainerSnapshot.scale_index_from_inspect(container.name, container.inspect())
+        except Exception as e:
+            logger.error(f"Error extracting scale index from container {container.id}: {e}")
             return None
 
+    def snapshot(self, container) -> Optional[ContainerSnapshot]:
+        """
+        Build a snapshot for a container from a single inspect call
+        Returns None if the container cannot be inspected
+        """
+        try:
+            return ContainerSnapshot.from_container(container)
         except Exception as e:
-            logger.error(f"Error extracting scale index from container {container.id}: {e}")
+            logger.debug(f"Error inspecting container {container.id}: {e}")
             return None
 
-    def get_container_info(self, container_id: str) -> Optional[Dict]:
-        """Get detailed container information (excluding sensitive env vars)"""
+    def get_container_snapshot(self, container_id: str) -> Optional[ContainerSnapshot]:
+        """Get a snapshot of a container by ID or name"""
         if not self.is_connected():
             return None
 
         try:
-            container = self.client.containers.get(container_id)
-            inspect = container.inspect()
-            return {
-                'id': container.id,
-                'name': container.name,
-                'status': container.status,
-                'labels': inspect.get('Labels', {}),
-                'networks': inspect.get('NetworkSettings', {}).get('Networks', {})
-                # Note: 'env' field intentionally excluded to prevent sensitive data leakage
-            }
+            return ContainerSnapshot.from_container(self.client.containers.get(container_id))
         except Exception as e:
-            logger.error(f"Error getting container info for {container_id}: {e}")
+            logger.error(f"Error getting container {container_id}: {e}")
             return None
 
+    def get_container_info(self, container_id: str) -> Optional[Dict]:
+        """Get detailed container information (excluding sensitive env vars)"""
+        snapshot = self.get_container_snapshot(container_id)
+        return snapshot.to_info() if snapshot else None
+
     def is_container_running(self, container_id: str) -> bool:
-        """Check if container is running"""
+        """Check if container is running (served from the liveness cache)"""
         if not self.is_connected():
             return False
 
         try:
-            container = self.client.containers.get(container_id)
-            return container.status == 'running'
+            return self.liveness.is_running(container_id)
         except Exception as e:
             logger.error(f"Error checking container status {container_id}: {e}")
             return False
 
     def get_all_container_ids(self) -> List[str]:
         """Get list of all container IDs"""
+        return self.list_container_ids() or []
+
+    def list_container_ids(self) -> Optional[List[str]]:
+        """Get list of all container IDs, or None if they can't be listed"""
         if not self.is_connected():
-            return []
+            return None
 
         try:
             containers = self.client.containers.list()
             return [container.id for container in containers]
         except Exception as e:
             logger.error(f"Error getting container list: {e}")
-            return []
+            return None
 
     def get_container_by_name(self, name: str) -> Optional[Dict]:
         """Get container by name"""
-        if not self.is_connected():
-            return None
-
-        try:
-            container = self.client.containers.get(name)
-            inspect = container.inspect()
-            return {
-                'id': container.id,
-                'name': container.name,
-                'status': container.status,
-                'labels': inspect.get('Labels', {}),
-                'networks': inspect.get('NetworkSettings', {}).get('Networks', {}),
-                # 'env': inspect.get('Config', {}).get('Env', [])
-            }
-        except Exception as e:
-            logger.error(f"Error getting container by name {name}: {e}")
-            return None
+        snapshot = self.get_container_snapshot(name)
+        return snapshot.to_info() if snapshot else None
 
     def cleanup_dead_containers(self, db_manager) -> int:
         """Clean up database entries for containers that no longer exist"""
@@ -240,8 +357,13 @@ class ContainerClient:
             return 0
 
         try:
-            active_container_ids = self.get_all_container_ids()
-            return db_manager.cleanup_dead_containers(active_container_ids)
+            listed_at = datetime.utcnow()
+            active_container_ids = self.list_container_ids()
+            if active_container_ids is None:
+                # an unreachable daemon is not the same as no containers
+                logger.warning("Skipping dead container cleanup, container list unavailable")
+                return 0
+            return db_manager.cleanup_dead_containers(active_container_ids, checked_out_before=listed_at)
         except Exception as e:
             logger.error(f"Error cleaning up dead containers: {e}")
             return 0
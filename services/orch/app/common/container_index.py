@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Container index for the Orch service
+Keeps an in-memory IP to container map current from the Podman events stream
+"""
+
+import os
+import time
+import logging
+import ipaddress
+import threading
+from typing import Optional, Dict, List, Callable
+
+from .container_snapshot import ContainerSnapshot
+
+logger = logging.getLogger("container_index")
+
+class ContainerIndex:
+    """In-memory IP to container index maintained from Podman events"""
+
+    # container actions that change what we know about a container; 'kill'
+    # is sent for every signal, fatal or not, so we wait for the 'die'
+    REFRESH_ACTIONS = {'start', 'restart', 'unpause', 'connect', 'disconnect', 'rename'}
+    DROP_ACTIONS = {'die', 'stop', 'remove', 'cleanup'}
+
+    def __init__(self, container_client, reconnect_delay: float = 2.0):
+        self.container_client = container_client
+        self.reconnect_delay = reconnect_delay
+
+        self._lock = threading.RLock()
+        self._by_ip: Dict[str, str] = {}
+        self._by_label_ip: Dict[str, str] = {}
+        self._entries: Dict[str, ContainerSnapshot] = {}
+        self._ready = False
+
+        self._pid = None
+        self._thread = None
+        self._listeners: List[Callable[[str, Optional[str]], None]] = []
+
+        # the watcher thread may hold the lock when gunicorn forks
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Reset the lock in a forked child; the watcher restarts on next use"""
+        self._lock = threading.RLock()
+        self._ready = False
+
+    def add_listener(self, callback: Callable[[str, Optional[str]], None]):
+        """
+        Register a callback(action, container_id) for container and network events
+        A ('resync', None) call is made after every full resync, since
+        events may have been missed while the stream was down
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, action: str, container_id: Optional[str]):
+        for callback in self._listeners:
+            try:
+                callback(action, container_id)
+            except Exception as e:
+                logger.error(f"Error in container event listener for {action} {container_id}: {e}")
+
+    def start(self):
+        """Start the event watcher for this process if it isn't running"""
+        # gunicorn --preload forks after the app is created, and threads do
+        # not survive a fork, so every worker needs its own watcher
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+
+            self._pid = os.getpid()
+            self._ready = False
+            self._by_ip.clear()
+            self._by_label_ip.clear()
+            self._entries.clear()
+
+            self._thread = threading.Thread(
+                target=self._watch, name="container-index", daemon=True)
+            self._thread.start()
+
+    def is_ready(self) -> bool:
+        """True once the index has completed a full sync in this process"""
+        return self._pid == os.getpid() and self._ready
+
+    def lookup(self, request_ip: str) -> Optional[ContainerSnapshot]:
+        """
+        Return the indexed ContainerSnapshot for an IP, or None if unknown
+        Uses the same exact, subnet and label passes as a full scan
+        """
+        self.start()
+        with self._lock:
+            # Method 1: Direct IP matching
+            container_id = self._by_ip.get(request_ip)
+            if container_id:
+                return self._entries.get(container_id)
+
+            # Method 2: Subnet matching
+            try:
+                request_net = ipaddress.ip_network(f"{request_ip}/24", strict=False)
+                for ip, container_id in self._by_ip.items():
+                    if ipaddress.ip_address(ip) in request_net:
+                        return self._entries.get(container_id)
+            except ValueError as e:
+                logger.debug(f"Unable to subnet match {request_ip}: {e}")
+
+            # Method 3: Explicit IP mapping in labels
+            container_id = self._by_label_ip.get(request_ip)
+            if container_id:
+                return self._entries.get(container_id)
+
+            return None
+
+    def entries(self) -> List[ContainerSnapshot]:
+        """Return all indexed container snapshots"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def resync(self) -> int:
+        """Rebuild the whole index from a fresh container listing"""
+        snapshots = self.container_client.snapshot_all(timeout=None)
+
+        with self._lock:
+            self._entries = {}
+            self._by_ip = {}
+            self._by_label_ip = {}
+            for snapshot in snapshots:
+                self._add_locked(snapshot)
+            self._ready = True
+
+        logger.info(f"Container index synced: {len(snapshots)} containers, {len(self._by_ip)} addresses")
+        self._notify('resync', None)
+        return len(snapshots)
+
+    def refresh(self, container_id: str):
+        """Re-inspect a single container and update its index entry"""
+        try:
+            container = self.container_client.client.containers.get(container_id)
+            snapshot = self.container_client.snapshot(container)
+        except Exception as e:
+            logger.debug(f"Unable to refresh container {container_id}: {e}")
+            snapshot = None
+
+        if snapshot is None or not snapshot.running:
+            self.drop(container_id)
+            return
+
+        with self._lock:
+            self._remove_locked(container_id)
+            self._add_locked(snapshot)
+
+    def drop(self, container_id: str):
+        """Remove a container from the index"""
+        with self._lock:
+            self._remove_locked(container_id)
+
+    def _add_locked(self, snapshot: ContainerSnapshot):
+        self._entries[snapshot.id] = snapshot
+        for ip in snapshot.ips:
+            self._by_ip[ip] = snapshot.id
+        for ip in snapshot.label_ips:
+            self._by_label_ip[ip] = snapshot.id
+
+    def _remove_locked(self, container_id: str):
+        old = self._entries.pop(container_id, None)
+        if old:
+            for ip in old.ips:
+                if self._by_ip.get(ip) == container_id:
+                    del self._by_ip[ip]
+            for ip in old.label_ips:
+                if self._by_label_ip.get(ip) == container_id:
+                    del self._by_label_ip[ip]
+
+    def handle_event(self, event: Dict):
+        """Apply a single decoded Podman event to the index"""
+        event_type = event.get('Type') or event.get('type')
+        action = (event.get('Action') or event.get('status') or '').split(':', 1)[0]
+        actor = event.get('Actor') or {}
+        attributes = actor.get('Attributes') or {}
+
+        if event_type == 'network':
+            # network events carry the container in their attributes
+            container_id = attributes.get('container') or actor.get('ID')
+        elif event_type == 'container':
+            container_id = actor.get('ID') or event.get('id')
+        else:
+            return
+
+        if not container_id:
+            return
+
+        if action in self.DROP_ACTIONS:
+            logger.debug(f"Container index: {action} {container_id}")
+            self.drop(container_id)
+        elif action in self.REFRESH_ACTIONS:
+            logger.debug(f"Container index: {action} {container_id}")
+            self.refresh(container_id)
+
+        self._notify(action, container_id)
+
+    def _watch(self):
+        """Follow the events stream, resyncing on every (re)connect"""
+        while True:
+            try:
+                if not self.container_client.is_connected():
+                    self.container_client._connect()
+                    if not self.container_client.is_connected():
+                        raise ConnectionError("container client not connected")
+
+                # replay anything that happens while the resync is running
+                since = int(time.time())
+                self.resync()
+
+                events = self.container_client.client.events.list(
+                    since=since,
+                    decode=True,
+                    filters={'type': ['container', 'network']})
+
+                for event in events:
+                    self.handle_event(event)
+
+                logger.warning("Podman event stream ended, reconnecting")
+
+            except Exception as e:
+                logger.warning(f"Container index watcher error: {e}")
+
+            with self._lock:
+                self._ready = False
+            time.sleep(self.reconnect_delay)
+
+
+# The end.
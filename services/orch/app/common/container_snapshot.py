@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Container snapshot for the Orch service
+Immutable view of a container built from a single inspect call
+"""
+
+import re
+import logging
+from types import MappingProxyType
+from typing import Optional, Dict, Tuple
+
+logger = logging.getLogger("container_snapshot")
+
+class ContainerSnapshot:
+    """
+    Immutable container metadata captured from one inspect call, so a
+    request can consult IPs, labels and scale index without going back
+    to the container API
+    """
+
+    __slots__ = ('id', 'name', 'status', 'ips', 'label_ips', 'labels', 'networks', 'scale_index')
+
+    def __init__(self, id: str, name: str, status: str,
+                 ips: Tuple[str, ...] = (), label_ips: Tuple[str, ...] = (),
+                 labels: Dict = None, networks: Dict = None, scale_index: Optional[int] = None):
+        set_attr = super().__setattr__
+        set_attr('id', id)
+        set_attr('name', name)
+        set_attr('status', status)
+        set_attr('ips', tuple(ips))
+        set_attr('label_ips', tuple(label_ips))
+        set_attr('labels', MappingProxyType(dict(labels or {})))
+        set_attr('networks', MappingProxyType(dict(networks or {})))
+        set_attr('scale_index', scale_index)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"<ContainerSnapshot {self.name} {self.id[:12]} {self.status}>"
+
+    @property
+    def running(self) -> bool:
+        """True if the container was running when inspected"""
+        return self.status == 'running'
+
+    @classmethod
+    def from_inspect(cls, inspect: Dict, container_id: str = None, container_name: str = None) -> 'ContainerSnapshot':
+        """Build a snapshot from container inspect output"""
+        name = (inspect.get('Name') or container_name or '').lstrip('/')
+        labels = cls.inspect_labels(inspect)
+        networks = inspect.get('NetworkSettings', {}).get('Networks', {}) or {}
+        state = inspect.get('State', {})
+
+        try:
+            scale_index = cls.scale_index_from_inspect(name, inspect)
+        except ValueError as e:
+            logger.debug(f"Invalid scale index for container {name}: {e}")
+            scale_index = None
+
+        return cls(
+            id=inspect.get('Id') or container_id,
+            name=name,
+            status=state.get('Status') if isinstance(state, dict) else state,
+            ips=[info['IPAddress'] for info in networks.values() if info.get('IPAddress')],
+            label_ips=[labels[key] for key in ('orch.client.ip', 'orch.ip') if labels.get(key)],
+            labels=labels,
+            networks=networks,
+            scale_index=scale_index,
+        )
+
+    @classmethod
+    def from_container(cls, container) -> 'ContainerSnapshot':
+        """Build a snapshot from a podman container object (one inspect call)"""
+        return cls.from_inspect(container.inspect(), container.id, container.name)
+
+    def to_info(self) -> Dict:
+        """Container information as returned by the status endpoints"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'labels': dict(self.labels),
+            'networks': dict(self.networks)
+            # Note: 'env' field intentionally excluded to prevent sensitive data leakage
+        }
+
+    @staticmethod
+    def inspect_labels(inspect: Dict) -> Dict:
+        """Get labels from inspect output (top level for docker, Config for podman)"""
+        return inspect.get('Labels') or inspect.get('Config', {}).get('Labels') or {}
+
+    @staticmethod
+    def scale_index_from_inspect(container_name: str, inspect: Dict) -> Optional[int]:
+        """Extract scale index from a container name and its inspect output"""
+        # Method 1: Parse container name (e.g., koji-worker-3)
+        if match := re.search(r'koji-worker-(\d+)', container_name):
+            return int(match.group(1))
+
+        # Method 2: Check labels
+        labels = ContainerSnapshot.inspect_labels(inspect)
+        if 'scale_index' in labels:
+            return int(labels['scale_index'])
+        if 'orch.scale.index' in labels:
+            return int(labels['orch.scale.index'])
+        if "com.docker.compose.container-number" in labels:
+            return int(labels['com.docker.compose.container-number'])
+
+        # Method 3: Environment variables
+        env_vars = inspect.get('Config', {}).get('Env', []) or []
+        for env_var in env_vars:
+            if env_var.startswith('SCALE_INDEX='):
+                return int(env_var.split('=', 1)[1])
+
+        # Method 4: Check for any numeric suffix in name
+        if match := re.search(r'[-_](\d+)$', container_name):
+            return int(match.group(1))
+
+        logger.debug(f"No scale index found for container {container_name}")
+        return None
+
+
+# The end.
@@ -4,81 +4,259 @@ Database management for the Orch service
 Handles resource mappings, checkouts, and container tracking
 """
 
+import os
+import json
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional, Dict, List, Tuple
 from datetime import datetime
 
+from .storage import StorageBackend
+
 logger = logging.getLogger("database")
 
-class DatabaseManager:
+def _add_lease_column(cursor):
+    """Add expires_at, which databases created before schema_migrations may already have"""
+    cursor.execute("PRAGMA table_info(resource_checkouts)")
+    if 'expires_at' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE resource_checkouts ADD COLUMN expires_at TIMESTAMP DEFAULT NULL")
+
+def _add_key_algorithm_column(cursor):
+    """Add key_algorithm to resource_mappings"""
+    cursor.execute("PRAGMA table_info(resource_mappings)")
+    if 'key_algorithm' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE resource_mappings ADD COLUMN key_algorithm TEXT DEFAULT NULL")
+
+class DatabaseManager(StorageBackend):
     """Manages SQLite database for resource tracking"""
 
+    MIGRATIONS = [
+        (1, 'initial schema', [
+            # Resource mappings table - maps UUIDs to actual resources
+            """
+            CREATE TABLE IF NOT EXISTS resource_mappings (
+                uuid TEXT PRIMARY KEY,
+                resource_type TEXT NOT NULL,
+                actual_resource_name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # Resource aliases table - tracks multiple UUIDs for same resource
+            """
+            CREATE TABLE IF NOT EXISTS resource_aliases (
+                uuid TEXT PRIMARY KEY,
+                canonical_uuid TEXT NOT NULL,
+                FOREIGN KEY (canonical_uuid) REFERENCES resource_mappings(uuid)
+            )
+            """,
+            # Resource checkouts table - tracks who has checked out what
+            """
+            CREATE TABLE IF NOT EXISTS resource_checkouts (
+                uuid TEXT NOT NULL,
+                actual_resource_name TEXT NOT NULL,
+                container_id TEXT NOT NULL,
+                container_ip TEXT NOT NULL,
+                checked_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                resource_type TEXT NOT NULL,
+                scale_index INTEGER DEFAULT NULL,
+                PRIMARY KEY (uuid, actual_resource_name),
+                FOREIGN KEY (uuid) REFERENCES resource_mappings(uuid)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_container_id ON resource_checkouts(container_id)",
+            "CREATE INDEX IF NOT EXISTS idx_container_ip ON resource_checkouts(container_ip)",
+            "CREATE INDEX IF NOT EXISTS idx_checked_out_at ON resource_checkouts(checked_out_at)",
+            "CREATE INDEX IF NOT EXISTS idx_resource_type ON resource_mappings(resource_type)",
+        ]),
+        (2, 'mappings generation', [
+            # Orch state table - small named counters shared by all workers
+            """
+            CREATE TABLE IF NOT EXISTS orch_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            "INSERT OR IGNORE INTO orch_state (key, value) VALUES ('mappings_generation', 0)",
+        ]),
+        (3, 'checkout leases', [
+            _add_lease_column,
+            "CREATE INDEX IF NOT EXISTS idx_expires_at ON resource_checkouts(expires_at)",
+        ]),
+        (4, 'covering indexes for checkout lookups', [
+            # release_resource: WHERE uuid = ? AND container_id = ?
+            """
+            CREATE INDEX IF NOT EXISTS idx_checkouts_uuid_container
+            ON resource_checkouts(uuid, container_id, actual_resource_name)
+            """,
+            # get_resource_status and claim_resource: WHERE uuid = ? [AND actual_resource_name = ?]
+            """
+            CREATE INDEX IF NOT EXISTS idx_checkouts_status
+            ON resource_checkouts(uuid, actual_resource_name, container_id, container_ip,
+                                  checked_out_at, scale_index, expires_at)
+            """,
+            # get_resource_mapping and the mapping cache: WHERE uuid = ?
+            """
+            CREATE INDEX IF NOT EXISTS idx_mappings_lookup
+            ON resource_mappings(uuid, resource_type, actual_resource_name, description)
+            """,
+        ]),
+        (5, 'provisioning tasks', [
+            # Provisioning tasks table - progress of the startup provisioning run
+            """
+            CREATE TABLE IF NOT EXISTS provisioning_tasks (
+                task TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                depends_on TEXT NOT NULL DEFAULT '[]',
+                state TEXT NOT NULL,
+                error TEXT,
+                started_at TIMESTAMP DEFAULT NULL,
+                finished_at TIMESTAMP DEFAULT NULL
+            )
+            """,
+        ]),
+        (6, 'koji host registrations', [
+            # Koji hosts table - workers registered by manage-koji-host.sh
+            """
+            CREATE TABLE IF NOT EXISTS koji_hosts (
+                worker_name TEXT PRIMARY KEY,
+                principal TEXT NOT NULL,
+                arch TEXT NOT NULL,
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                verified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_koji_hosts_verified_at ON koji_hosts(verified_at)",
+        ]),
+        (7, 'mapping key algorithms', [
+            _add_key_algorithm_column,
+            # keep get_resource_mapping and the mapping cache covered
+            "DROP INDEX IF EXISTS idx_mappings_lookup",
+            """
+            CREATE INDEX IF NOT EXISTS idx_mappings_lookup
+            ON resource_mappings(uuid, resource_type, actual_resource_name, description, key_algorithm)
+            """,
+        ]),
+        (8, 'certificate ledger', [
+            # Certificates table - every certificate the CA issued
+            """
+            CREATE TABLE IF NOT EXISTS certificates (
+                serial INTEGER PRIMARY KEY,
+                cn TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                key_algorithm TEXT,
+                not_before TIMESTAMP NOT NULL,
+                not_after TIMESTAMP NOT NULL,
+                status TEXT NOT NULL DEFAULT 'valid',
+                issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_certificates_cn ON certificates(cn, status)",
+            # the next serial, continuing from the openssl serial file when there is one
+            "INSERT OR IGNORE INTO orch_state (key, value) VALUES ('certificate_serial', 0)",
+        ]),
+        (9, 'drop redundant lookup indexes', [
+            # the primary key already serves get_resource_status and
+            # claim_resource, and resource_mappings is small enough that
+            # its primary key lookup needs no covering index
+            "DROP INDEX IF EXISTS idx_checkouts_status",
+            "DROP INDEX IF EXISTS idx_mappings_lookup",
+        ]),
+    ]
+
     def __init__(self, db_path: str = "/mnt/data/orch.db"):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self.init_database()
 
-    def init_database(self):
-        """Initialize database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        # Connection tuning
+        self.busy_timeout = int(os.getenv('ORCH_DB_BUSY_TIMEOUT', '5000'))
+        self.statement_cache_size = int(os.getenv('ORCH_DB_STATEMENT_CACHE', '128'))
+        self._local = threading.local()
 
-            # Resource mappings table - maps UUIDs to actual resources
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS resource_mappings (
-                    uuid TEXT PRIMARY KEY,
-                    resource_type TEXT NOT NULL,
-                    actual_resource_name TEXT NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Resource aliases table - tracks multiple UUIDs for same resource
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS resource_aliases (
-                    uuid TEXT PRIMARY KEY,
-                    canonical_uuid TEXT NOT NULL,
-                    FOREIGN KEY (canonical_uuid) REFERENCES resource_mappings(uuid)
-                )
-            """)
+        self.init_database()
 
-            # Resource checkouts table - tracks who has checked out what
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS resource_checkouts (
-                    uuid TEXT NOT NULL,
-                    actual_resource_name TEXT NOT NULL,
-                    container_id TEXT NOT NULL,
-                    container_ip TEXT NOT NULL,
-                    checked_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    resource_type TEXT NOT NULL,
-                    scale_index INTEGER DEFAULT NULL,
-                    PRIMARY KEY (uuid, actual_resource_name),
-                    FOREIGN KEY (uuid) REFERENCES resource_mappings(uuid)
-                )
-            """)
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Get this thread's persistent connection, opening it on first use.
+        Used as a context manager it commits on success and rolls back on
+        error, but stays open for the next call.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        # never reuse a connection inherited across a fork
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000,
+            cached_statements=self.statement_cache_size)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False):
+        """
+        Run a block in an explicit transaction on this thread's connection.
+        An immediate transaction takes the write lock up front, so a
+        read-then-write sequence cannot race another worker.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
 
-            # Create indexes for performance
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_container_id ON resource_checkouts(container_id)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_container_ip ON resource_checkouts(container_ip)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_checked_out_at ON resource_checkouts(checked_out_at)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_resource_type ON resource_mappings(resource_type)")
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
 
-            conn.commit()
-            logger.info("Database initialized successfully")
+    def init_database(self):
+        """Initialize the database by applying any pending schema migrations"""
+        # workers starting together queue on the write lock, and each finds
+        # the migrations already applied by the first
+        with self._transaction(immediate=True) as conn:
+            self._apply_migrations(conn.cursor())
+        logger.info("Database initialized successfully")
+
+    def get_schema_version(self) -> Optional[int]:
+        """Get the latest applied migration version, or None if it can't be read"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MAX(version) FROM schema_migrations")
+                return cursor.fetchone()[0] or 0
+        except Exception as e:
+            logger.error(f"Failed to get schema version: {e}")
+            return None
 
-    def add_resource_mapping(self, uuid: str, resource_type: str, actual_resource_name: str, description: str = None) -> bool:
+    def add_resource_mapping(self, uuid: str, resource_type: str, actual_resource_name: str,
+                             description: str = None, key_algorithm: str = None) -> bool:
         """Add a new resource mapping"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR REPLACE INTO resource_mappings
-                    (uuid, resource_type, actual_resource_name, description)
-                    VALUES (?, ?, ?, ?)
-                """, (uuid, resource_type, actual_resource_name, description))
+                    (uuid, resource_type, actual_resource_name, description, key_algorithm)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (uuid, resource_type, actual_resource_name, description, key_algorithm))
+                self._bump_mappings_generation(cursor)
                 conn.commit()
                 logger.info(f"Added resource mapping: {uuid} -> {actual_resource_name}")
                 return True
@@ -86,13 +264,122 @@ class DatabaseManager:
             logger.error(f"Failed to add resource mapping {uuid}: {e}")
             return False
 
+    def sync_resource_mappings(self, mappings: Dict[str, Dict]) -> Optional[Dict[str, List[str]]]:
+        """
+        Make resource_mappings match the given mappings in one transaction
+        Only the difference against the current table is written, so an
+        unchanged file costs one SELECT.
+
+        Args:
+            mappings: uuid -> {'resource_type', 'actual_resource_name', 'description', 'key_algorithm'}
+
+        Returns: {'added': [...], 'changed': [...], 'removed': [...]} uuids, or None on failure
+        """
+        try:
+            with self._transaction(immediate=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                    FROM resource_mappings
+                """)
+                current = {row[0]: row[1:] for row in cursor.fetchall()}
+
+                wanted = {
+                    uuid: (mapping['resource_type'], mapping['actual_resource_name'], mapping.get('description'),
+                           mapping.get('key_algorithm'))
+                    for uuid, mapping in mappings.items()
+                }
+                added = [uuid for uuid in wanted if uuid not in current]
+                changed = [uuid for uuid in wanted if uuid in current and current[uuid] != wanted[uuid]]
+                removed = [uuid for uuid in current if uuid not in wanted]
+
+                if added:
+                    cursor.executemany("""
+                        INSERT INTO resource_mappings
+                        (uuid, resource_type, actual_resource_name, description, key_algorithm)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, [(uuid, *wanted[uuid]) for uuid in added])
+
+                if changed:
+                    cursor.executemany("""
+                        UPDATE resource_mappings
+                        SET resource_type = ?, actual_resource_name = ?, description = ?, key_algorithm = ?
+                        WHERE uuid = ?
+                    """, [(*wanted[uuid], uuid) for uuid in changed])
+
+                if removed:
+                    # checkouts and aliases of a removed mapping can never be used again
+                    removed_rows = [(uuid,) for uuid in removed]
+                    cursor.executemany("DELETE FROM resource_checkouts WHERE uuid = ?", removed_rows)
+                    cursor.executemany("DELETE FROM resource_aliases WHERE uuid = ? OR canonical_uuid = ?",
+                                       [(uuid, uuid) for uuid in removed])
+                    cursor.executemany("DELETE FROM resource_mappings WHERE uuid = ?", removed_rows)
+
+                if added or changed or removed:
+                    self._bump_mappings_generation(cursor)
+
+            return {'added': added, 'changed': changed, 'removed': removed}
+        except Exception as e:
+            logger.error(f"Failed to sync resource mappings: {e}")
+            return None
+
+    def _bump_mappings_generation(self, cursor):
+        """Advance the mappings generation so every worker's mapping cache reloads"""
+        cursor.execute("""
+            UPDATE orch_state SET value = value + 1 WHERE key = 'mappings_generation'
+        """)
+
+    def get_mappings_generation(self) -> Optional[int]:
+        """Get the current mappings generation, or None if it can't be read"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT value FROM orch_state WHERE key = 'mappings_generation'
+                """)
+                row = cursor.fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Failed to get mappings generation: {e}")
+            return None
+
+    def load_mappings_snapshot(self) -> Tuple[int, List[Dict]]:
+        """
+        Read the mappings generation and every mapping in one read
+        transaction, so the rows always match the generation.
+        Raises on failure rather than returning an empty list.
+        """
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT value FROM orch_state WHERE key = 'mappings_generation'
+            """)
+            row = cursor.fetchone()
+            generation = row[0] if row else 0
+
+            cursor.execute("""
+                SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                FROM resource_mappings ORDER BY created_at
+            """)
+            mappings = [
+                {
+                    'uuid': row[0],
+                    'resource_type': row[1],
+                    'actual_resource_name': row[2],
+                    'description': row[3],
+                    'key_algorithm': row[4]
+                }
+                for row in cursor.fetchall()
+            ]
+            return generation, mappings
+
     def get_resource_mapping(self, uuid: str) -> Optional[Dict]:
         """Get resource mapping by UUID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT uuid, resource_type, actual_resource_name, description
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
                     FROM resource_mappings WHERE uuid = ?
                 """, (uuid,))
                 row = cursor.fetchone()
@@ -101,49 +388,72 @@ class DatabaseManager:
                         'uuid': row[0],
                         'resource_type': row[1],
                         'actual_resource_name': row[2],
-                        'description': row[3]
+                        'description': row[3],
+                        'key_algorithm': row[4]
                     }
                 return None
         except Exception as e:
             logger.error(f"Failed to get resource mapping {uuid}: {e}")
             return None
 
-    def checkout_resource(self, uuid: str, container_id: str, container_ip: str,
-                         resource_type: str, actual_resource_name: str, scale_index: int = None) -> bool:
-        """Checkout a resource to a container using composite key (uuid, actual_resource_name)"""
+    def claim_resource(self, uuid: str, container_id: str, container_ip: str,
+                       resource_type: str, actual_resource_name: str, scale_index: int = None,
+                       takeover_from: str = None, lease_ttl: int = None) -> Tuple[bool, Optional[str], bool]:
+        """
+        Atomically claim a resource (uuid, actual_resource_name) for a container.
+        The claim succeeds if the resource is free, or if it is currently held
+        by takeover_from (an owner the caller has found to be dead).
+        With a lease_ttl the checkout expires unless renewed.
+        Returns: (claimed, previous_owner, previous_lease_active)
+        """
+        lease = f"+{int(lease_ttl)} seconds" if lease_ttl and lease_ttl > 0 else None
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction(immediate=True) as conn:
                 cursor = conn.cursor()
 
-                # Check if this specific resource (uuid + actual_resource_name) is already checked out
                 cursor.execute("""
-                    SELECT container_id FROM resource_checkouts
+                    SELECT container_id, expires_at > CURRENT_TIMESTAMP FROM resource_checkouts
                     WHERE uuid = ? AND actual_resource_name = ?
                 """, (uuid, actual_resource_name))
                 existing = cursor.fetchone()
+                previous_owner = existing[0] if existing else None
+                lease_active = bool(existing[1]) if existing else False
 
-                if existing:
-                    logger.warning(f"Resource {uuid} ({actual_resource_name}) already checked out to {existing[0]}")
-                    return False
-
-                # Checkout the resource
+                # Insert, or take over only from the expected owner
                 cursor.execute("""
                     INSERT INTO resource_checkouts
-                    (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index))
-
-                conn.commit()
+                    (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index,
+                     expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))
+                    ON CONFLICT (uuid, actual_resource_name) DO UPDATE SET
+                        container_id = excluded.container_id,
+                        container_ip = excluded.container_ip,
+                        resource_type = excluded.resource_type,
+                        scale_index = excluded.scale_index,
+                        expires_at = excluded.expires_at,
+                        checked_out_at = CURRENT_TIMESTAMP
+                    WHERE resource_checkouts.container_id = ?
+                """, (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index,
+                      lease, takeover_from))
+                claimed = cursor.rowcount == 1
+
+            if claimed and previous_owner:
+                logger.info(f"Checked out resource {uuid} ({actual_resource_name}) to container {container_id}, "
+                            f"taken over from {previous_owner}")
+            elif claimed:
                 logger.info(f"Checked out resource {uuid} ({actual_resource_name}) to container {container_id}")
-                return True
+            else:
+                logger.warning(f"Resource {uuid} ({actual_resource_name}) already checked out to {previous_owner}")
+
+            return claimed, previous_owner, lease_active
         except Exception as e:
             logger.error(f"Failed to checkout resource {uuid} ({actual_resource_name}): {e}")
-            return False
+            return False, None, False
 
     def release_resource(self, uuid: str, container_id: str) -> bool:
         """Release a resource from a container using composite key"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
 
                 # Find all resources for this UUID and container combination
@@ -178,7 +488,7 @@ class DatabaseManager:
     def get_resource_status(self, uuid: str, actual_resource_name: str = None) -> Optional[Dict]:
         """Get current status of a resource, optionally for a specific actual_resource_name"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
 
                 # Get resource mapping
@@ -194,7 +504,8 @@ class DatabaseManager:
                 # Get checkout status - if actual_resource_name specified, check for that specific resource
                 if actual_resource_name:
                     cursor.execute("""
-                        SELECT container_id, container_ip, checked_out_at, scale_index
+                        SELECT container_id, container_ip, checked_out_at, scale_index,
+                               expires_at, expires_at > CURRENT_TIMESTAMP
                         FROM resource_checkouts WHERE uuid = ? AND actual_resource_name = ?
                     """, (uuid, actual_resource_name))
                     checkout = cursor.fetchone()
@@ -208,12 +519,15 @@ class DatabaseManager:
                         'container_id': checkout[0] if checkout else None,
                         'container_ip': checkout[1] if checkout else None,
                         'checked_out_at': checkout[2] if checkout else None,
-                        'scale_index': checkout[3] if checkout else None
+                        'scale_index': checkout[3] if checkout else None,
+                        'expires_at': checkout[4] if checkout else None,
+                        'lease_active': bool(checkout[5]) if checkout else False
                     }
                 else:
                     # For backward compatibility, get first checkout if any exist
                     cursor.execute("""
-                        SELECT container_id, container_ip, checked_out_at, scale_index, actual_resource_name
+                        SELECT container_id, container_ip, checked_out_at, scale_index, actual_resource_name,
+                               expires_at, expires_at > CURRENT_TIMESTAMP
                         FROM resource_checkouts WHERE uuid = ? LIMIT 1
                     """, (uuid,))
                     checkout = cursor.fetchone()
@@ -227,32 +541,131 @@ class DatabaseManager:
                         'container_id': checkout[0] if checkout else None,
                         'container_ip': checkout[1] if checkout else None,
                         'checked_out_at': checkout[2] if checkout else None,
-                        'scale_index': checkout[3] if checkout else None
+                        'scale_index': checkout[3] if checkout else None,
+                        'expires_at': checkout[5] if checkout else None,
+                        'lease_active': bool(checkout[6]) if checkout else False
                     }
         except Exception as e:
             logger.error(f"Failed to get resource status {uuid}: {e}")
             return None
 
-    def cleanup_dead_containers(self, active_container_ids: List[str]) -> int:
-        """Clean up checkouts for containers that no longer exist"""
+    def renew_lease(self, uuid: str, container_id: str, lease_ttl: int = None) -> Tuple[int, Optional[str]]:
+        """
+        Extend the lease on every resource with this UUID held by a container
+        A lease_ttl of None or 0 turns the checkouts into non-expiring ones.
+        Returns: (renewed_count, expires_at)
+        """
+        lease = f"+{int(lease_ttl)} seconds" if lease_ttl and lease_ttl > 0 else None
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE resource_checkouts SET expires_at = datetime('now', ?)
+                    WHERE uuid = ? AND container_id = ?
+                    RETURNING expires_at
+                """, (lease, uuid, container_id))
+                rows = cursor.fetchall()
+                conn.commit()
 
-                # Find checkouts for dead containers
-                placeholders = ','.join('?' * len(active_container_ids))
-                cursor.execute(f"""
-                    DELETE FROM resource_checkouts
-                    WHERE container_id NOT IN ({placeholders})
-                """, active_container_ids)
+                expires_at = rows[0][0] if rows else None
+                if rows:
+                    logger.debug(f"Renewed lease on {uuid} for container {container_id} until {expires_at}")
+
+                return len(rows), expires_at
+        except Exception as e:
+            logger.error(f"Failed to renew lease on {uuid} for container {container_id}: {e}")
+            return 0, None
+
+    def expire_leases(self) -> int:
+        """Release every checkout whose lease has lapsed (a range scan on idx_expires_at)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM resource_checkouts WHERE expires_at <= CURRENT_TIMESTAMP
+                """)
 
-                cleaned = cursor.rowcount
+                expired = cursor.rowcount
                 conn.commit()
 
-                if cleaned > 0:
-                    logger.info(f"Cleaned up {cleaned} checkouts for dead containers")
+                if expired > 0:
+                    logger.info(f"Released {expired} checkout(s) with lapsed leases")
 
-                return cleaned
+                return expired
+        except Exception as e:
+            logger.error(f"Failed to expire leases: {e}")
+            return 0
+
+    def release_container(self, container_id: str) -> int:
+        """Release every resource checked out to a container"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM resource_checkouts WHERE container_id = ?
+                """, (container_id,))
+
+                released = cursor.rowcount
+                conn.commit()
+
+                if released > 0:
+                    logger.info(f"Released {released} checkout(s) held by container {container_id}")
+
+                return released
+        except Exception as e:
+            logger.error(f"Failed to release checkouts for container {container_id}: {e}")
+            return 0
+
+    def cleanup_dead_containers(self, active_container_ids: List[str], checked_out_before: datetime = None,
+                                batch_size: int = 500) -> int:
+        """
+        Clean up checkouts for containers that no longer exist
+        The distinct owners in resource_checkouts are compared against the
+        live containers in memory, and the dead owners' checkouts are deleted
+        through the container_id index in batches, one short transaction each.
+        The win is the common sweep where nothing died; a mass die-off costs
+        a little more than one big DELETE, since row deletion dominates and
+        each batch commits separately to keep the write lock short.
+
+        Args:
+            active_container_ids: Every live container (an empty list means none are alive)
+            checked_out_before: Only clean checkouts older than this (UTC), so a
+                                container that started after the listing keeps its claim
+            batch_size: Dead containers released per transaction
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT DISTINCT container_id FROM resource_checkouts")
+                owners = {row[0] for row in cursor.fetchall()}
+
+            dead = sorted(owners.difference(active_container_ids))
+            if not dead:
+                return 0
+
+            # each batch is bound as one JSON array parameter, so there is
+            # no per-container placeholder and no variable limit to hit
+            query = """
+                DELETE FROM resource_checkouts
+                WHERE container_id IN (SELECT value FROM json_each(?))
+            """
+            params = ()
+            if checked_out_before is not None:
+                query += " AND checked_out_at < ?"
+                params = (checked_out_before.strftime('%Y-%m-%d %H:%M:%S'),)
+
+            cleaned = 0
+            for start in range(0, len(dead), batch_size):
+                batch = json.dumps(dead[start:start + batch_size])
+                with self._transaction(immediate=True) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(query, (batch, *params))
+                    cleaned += cursor.rowcount
+
+            if cleaned > 0:
+                logger.info(f"Cleaned up {cleaned} checkouts for {len(dead)} dead containers")
+
+            return cleaned
         except Exception as e:
             logger.error(f"Failed to cleanup dead containers: {e}")
             return 0
@@ -260,10 +673,10 @@ class DatabaseManager:
     def get_all_mappings(self) -> List[Dict]:
         """Get all resource mappings"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT uuid, resource_type, actual_resource_name, description
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
                     FROM resource_mappings ORDER BY created_at
                 """)
                 rows = cursor.fetchall()
@@ -272,7 +685,8 @@ class DatabaseManager:
                         'uuid': row[0],
                         'resource_type': row[1],
                         'actual_resource_name': row[2],
-                        'description': row[3]
+                        'description': row[3],
+                        'key_algorithm': row[4]
                     }
                     for row in rows
                 ]
@@ -280,5 +694,210 @@ class DatabaseManager:
             logger.error(f"Failed to get all mappings: {e}")
             return []
 
+    def start_provisioning_run(self, tasks: List[Dict]) -> bool:
+        """Replace the recorded provisioning tasks with a new run's, all pending"""
+        try:
+            with self._transaction(immediate=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM provisioning_tasks")
+                cursor.executemany("""
+                    INSERT INTO provisioning_tasks (task, kind, resource, depends_on, state)
+                    VALUES (?, ?, ?, ?, 'pending')
+                """, [(task['task'], task['kind'], task['resource'], json.dumps(task['depends_on']))
+                      for task in tasks])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start provisioning run: {e}")
+            return False
+
+    def update_provisioning_task(self, task: str, state: str, error: str = None) -> bool:
+        """Record a provisioning task moving to running, done, failed or skipped"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE provisioning_tasks SET
+                        state = ?,
+                        error = ?,
+                        started_at = CASE WHEN ? = 'running' THEN CURRENT_TIMESTAMP ELSE started_at END,
+                        finished_at = CASE WHEN ? = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+                    WHERE task = ?
+                """, (state, error, state, state, task))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to update provisioning task {task}: {e}")
+            return False
+
+    def get_provisioning_tasks(self) -> List[Dict]:
+        """Get every task of the latest provisioning run"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT task, kind, resource, depends_on, state, error, started_at, finished_at
+                    FROM provisioning_tasks ORDER BY rowid
+                """)
+                return [
+                    {
+                        'task': row[0],
+                        'kind': row[1],
+                        'resource': row[2],
+                        'depends_on': json.loads(row[3]),
+                        'state': row[4],
+                        'error': row[5],
+                        'started_at': row[6],
+                        'finished_at': row[7]
+                    }
+                    for row in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Failed to get provisioning tasks: {e}")
+            return []
+
+    def record_koji_host(self, worker_name: str, principal: str, arch: str) -> bool:
+        """Record a successful Koji host registration"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO koji_hosts (worker_name, principal, arch) VALUES (?, ?, ?)
+                    ON CONFLICT (worker_name) DO UPDATE SET
+                        principal = excluded.principal,
+                        arch = excluded.arch,
+                        registered_at = CURRENT_TIMESTAMP,
+                        verified_at = CURRENT_TIMESTAMP
+                """, (worker_name, principal, arch))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to record Koji host {worker_name}: {e}")
+            return False
+
+    def get_koji_host(self, worker_name: str) -> Optional[Dict]:
+        """Get the recorded registration of a Koji host"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT worker_name, principal, arch, registered_at, verified_at
+                    FROM koji_hosts WHERE worker_name = ?
+                """, (worker_name,))
+                row = cursor.fetchone()
+                return self._koji_host(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get Koji host {worker_name}: {e}")
+            return None
+
+    def get_koji_hosts(self) -> List[Dict]:
+        """Get every recorded Koji host registration, least recently verified first"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT worker_name, principal, arch, registered_at, verified_at
+                    FROM koji_hosts ORDER BY verified_at, worker_name
+                """)
+                return [self._koji_host(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get Koji hosts: {e}")
+            return []
+
+    @staticmethod
+    def _koji_host(row) -> Dict:
+        return {
+            'worker_name': row[0],
+            'principal': row[1],
+            'arch': row[2],
+            'registered_at': row[3],
+            'verified_at': row[4]
+        }
+
+    def mark_koji_host_verified(self, worker_name: str) -> bool:
+        """Note that a Koji host registration was just confirmed"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE koji_hosts SET verified_at = CURRENT_TIMESTAMP WHERE worker_name = ?
+                """, (worker_name,))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to mark Koji host {worker_name} verified: {e}")
+            return False
+
+    def forget_koji_host(self, worker_name: str) -> bool:
+        """Drop a Koji host registration so the next checkout registers it again"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM koji_hosts WHERE worker_name = ?", (worker_name,))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to forget Koji host {worker_name}: {e}")
+            return False
+
+    def allocate_certificate_serial(self, floor: int = 0) -> Optional[int]:
+        """Atomically take the next certificate serial, no lower than floor, or None on failure"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE orch_state SET value = MAX(value + 1, ?)
+                    WHERE key = 'certificate_serial' RETURNING value
+                """, (floor,))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Failed to allocate a certificate serial: {e}")
+            return None
+
+    def record_certificate(self, serial: int, cn: str, fingerprint: str, key_algorithm: str,
+                           not_before: str, not_after: str) -> bool:
+        """Add an issued certificate to the ledger, superseding earlier certificates for its CN"""
+        try:
+            with self._transaction(immediate=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE certificates SET status = 'superseded'
+                    WHERE cn = ? AND status = 'valid' AND serial < ?
+                """, (cn, serial))
+                cursor.execute("""
+                    INSERT INTO certificates (serial, cn, fingerprint, key_algorithm, not_before, not_after)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (serial, cn, fingerprint, key_algorithm, not_before, not_after))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to record certificate {serial:X} for {cn}: {e}")
+            return False
+
+    def get_certificates(self, cn: str = None) -> List[Dict]:
+        """Get ledger entries, optionally for one CN, by serial"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                query = """
+                    SELECT serial, cn, fingerprint, key_algorithm, not_before, not_after, status, issued_at
+                    FROM certificates
+                """
+                if cn is None:
+                    cursor.execute(query + " ORDER BY serial")
+                else:
+                    cursor.execute(query + " WHERE cn = ? ORDER BY serial", (cn,))
+                return [self._certificate(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get certificates: {e}")
+            return []
+
+    @staticmethod
+    def _certificate(row) -> Dict:
+        return {
+            'serial': row[0],
+            'cn': row[1],
+            'fingerprint': row[2],
+            'key_algorithm': row[3],
+            'not_before': row[4],
+            'not_after': row[5],
+            'status': row[6],
+            'issued_at': row[7]
+        }
+
 
 # The end.
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Kadmin session pool for the Orch service
+Keeps authenticated interactive kadmin processes open between operations
+"""
+
+import os
+import re
+import pty
+import time
+import select
+import logging
+import termios
+import threading
+import subprocess
+from typing import Optional, Dict, List
+
+logger = logging.getLogger("kadmin_pool")
+
+class KadminSession:
+    """
+    One interactive kadmin process on a pseudo-terminal. kadmin only
+    authenticates once, when it starts; each query after that is a single
+    kadmind round trip. The end of a query's output is found by following
+    it with an unknown request, which kadmin rejects locally without
+    contacting the server.
+    """
+
+    PROMPTS = re.compile(r'^(kadmin:  )+', re.MULTILINE)
+
+    def __init__(self, command: List[str], timeout: float = 30.0):
+        self.timeout = timeout
+        self.started_at = time.monotonic()
+        self.queries = 0
+        self.pid = os.getpid()
+
+        master, slave = pty.openpty()
+        try:
+            # queries are not echoed back into their own output
+            attrs = termios.tcgetattr(slave)
+            attrs[3] &= ~termios.ECHO
+            termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+            self.proc = subprocess.Popen(command, stdin=slave, stdout=slave, stderr=slave,
+                                         env={**os.environ, 'TERM': 'dumb'},
+                                         close_fds=True, start_new_session=True)
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        self.fd = master
+
+        # authentication happens before the first prompt; the first
+        # sentinel coming back means the session is ready
+        if self.execute(None) is None:
+            self.close()
+            raise RuntimeError(f"kadmin session did not start: {' '.join(command[:1])}")
+
+    def is_alive(self) -> bool:
+        return self.fd is not None and self.proc.poll() is None
+
+    def execute(self, query: Optional[str]) -> Optional[str]:
+        """Run one query and return its combined output, or None if the session failed"""
+        if not self.is_alive():
+            return None
+
+        self.queries += 1
+        marker = f"orch-sentinel-{self.queries}"
+        self._drain()
+
+        lines = f"{query}\n{marker}\n" if query is not None else f"{marker}\n"
+        try:
+            os.write(self.fd, lines.encode())
+        except OSError as e:
+            logger.warning(f"kadmin session {self.proc.pid} write failed: {e}")
+            self.close()
+            return None
+
+        output = self._read_until(f'Unknown request "{marker}"')
+        if output is None:
+            self.close()
+        return output
+
+    def _drain(self):
+        """Discard the prompt left over from the previous query"""
+        while self.fd is not None and select.select([self.fd], [], [], 0)[0]:
+            try:
+                if not os.read(self.fd, 4096):
+                    return
+            except OSError:
+                return
+
+    def _read_until(self, terminator: str) -> Optional[str]:
+        deadline = time.monotonic() + self.timeout
+        data = b''
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"kadmin session {self.proc.pid} timed out after {self.timeout}s")
+                return None
+
+            if not select.select([self.fd], [], [], remaining)[0]:
+                continue
+            try:
+                chunk = os.read(self.fd, 4096)
+            except OSError:
+                # EIO once kadmin has exited and the terminal is gone
+                chunk = b''
+            if not chunk:
+                logger.warning(f"kadmin session {self.proc.pid} exited: "
+                               f"{data.decode(errors='replace').strip()[-200:]}")
+                return None
+
+            data += chunk
+            text = data.decode(errors='replace').replace('\r', '')
+            index = text.find(terminator)
+            if index >= 0:
+                # everything before the line carrying the terminator, minus prompts
+                output = text[:text.rfind('\n', 0, index) + 1]
+                return self.PROMPTS.sub('', output)
+
+    def close(self):
+        """Quit kadmin and release the terminal"""
+        if self.fd is None:
+            return
+        try:
+            if self.proc.poll() is None:
+                os.write(self.fd, b"quit\n")
+                try:
+                    self.proc.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    self.proc.kill()
+                    self.proc.wait(timeout=1)
+        except Exception as e:
+            logger.debug(f"Error closing kadmin session {self.proc.pid}: {e}")
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def abandon(self):
+        """Forget a session inherited across a fork without touching the parent's process"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class KadminPool:
+    """
+    Hands out long-lived kadmin sessions so a principal checkout doesn't pay
+    a process start and a password authentication for every query. Sessions
+    are spawned on demand up to the pool size, checked before reuse,
+    replaced once they reach their maximum age (their service ticket is
+    only good for so long), and respawned when they die. A query that hits
+    a broken session is retried once on a fresh one.
+
+    With a pool size of 0, or if no session can be started, each query
+    runs in a one-shot `kadmin -q` process as before.
+    """
+
+    # output meaning the session itself is unusable, not that the query failed
+    SESSION_ERRORS = ('Ticket expired', 'Communication failure', 'GSS-API (or Kerberos) error',
+                      'Connection refused', 'Broken pipe')
+
+    def __init__(self, principal: str, password: str, size: int = 2,
+                 max_age: float = 3600.0, timeout: float = 30.0, command: str = 'kadmin'):
+        self.principal = principal
+        self.password = password
+        self.size = size
+        self.max_age = max_age
+        self.timeout = timeout
+        self.command = command
+
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {'queries': 0, 'spawned': 0, 'respawned': 0, 'fallbacks': 0, 'total_ms': 0.0}
+
+        # sessions belong to the process that spawned them
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        for session in self._idle:
+            session.abandon()
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def _base_command(self) -> List[str]:
+        return [self.command, '-p', self.principal, '-w', self.password]
+
+    def execute(self, query: str) -> Optional[str]:
+        """
+        Run a kadmin query and return its combined output, or None if kadmin
+        could not be reached. The query must not prompt for input.
+        """
+        if '\n' in query or '\r' in query:
+            raise ValueError("kadmin query must be a single line")
+
+        start = time.perf_counter()
+        try:
+            if self.size <= 0:
+                return self._execute_once(query)
+
+            for attempt in range(2):
+                session = self._acquire()
+                if session is None:
+                    self._count('fallbacks')
+                    return self._execute_once(query)
+
+                broken = True
+                try:
+                    output = session.execute(query)
+                    broken = output is None or any(error in output for error in self.SESSION_ERRORS)
+                finally:
+                    if broken:
+                        session.close()
+                        self._count('respawned')
+                    self._release(session, broken)
+
+                if not broken:
+                    return output
+                logger.warning(f"kadmin session failed on '{query.split()[0]}', "
+                               f"{'retrying on a new session' if attempt == 0 else 'giving up'}")
+            return output
+        finally:
+            with self._cond:
+                self._stats['queries'] += 1
+                self._stats['total_ms'] += (time.perf_counter() - start) * 1000
+
+    def _count(self, stat: str):
+        with self._cond:
+            self._stats[stat] += 1
+
+    def _execute_once(self, query: str) -> Optional[str]:
+        try:
+            result = subprocess.run(self._base_command() + ['-q', query],
+                                    capture_output=True, text=True, timeout=self.timeout)
+            return result.stdout + result.stderr
+        except Exception as e:
+            logger.error(f"Error running kadmin query '{query.split()[0]}': {e}")
+            return None
+
+    def _acquire(self) -> Optional[KadminSession]:
+        """
+        Take an idle healthy session, spawn one if under the pool size, or
+        wait for one to be released. Returns None, so the query runs
+        one-shot, if none frees up within the query timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    session = self._idle.pop()
+                    if session.is_alive() and time.monotonic() - session.started_at < self.max_age:
+                        return session
+                    session.close()
+                    self._open -= 1
+
+                if self._open < self.size:
+                    self._open += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"No kadmin session free after {self.timeout}s, running the query one-shot")
+                    return None
+                self._cond.wait(remaining)
+
+        try:
+            session = KadminSession(self._base_command(), self.timeout)
+            self._count('spawned')
+            logger.info(f"Started kadmin session {session.proc.pid} as {self.principal}")
+            return session
+        except Exception as e:
+            logger.warning(f"Could not start a kadmin session, running the query one-shot: {e}")
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return None
+
+    def _release(self, session: KadminSession, broken: bool = False):
+        with self._cond:
+            if broken or session.pid != os.getpid():
+                self._open -= 1
+            else:
+                self._idle.append(session)
+            self._cond.notify()
+
+    def stats(self) -> Dict:
+        """Query counts and the mean latency per query"""
+        with self._cond:
+            stats = dict(self._stats)
+            open_sessions = self._open
+            idle_sessions = len(self._idle)
+        queries = stats['queries']
+        return {
+            'pool_size': self.size,
+            'open_sessions': open_sessions,
+            'idle_sessions': idle_sessions,
+            'queries': queries,
+            'spawned': stats['spawned'],
+            'respawned': stats['respawned'],
+            'fallbacks': stats['fallbacks'],
+            'mean_ms': round(stats['total_ms'] / queries, 2) if queries else 0.0
+        }
+
+    def close(self):
+        """Quit every idle session"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for session in idle:
+            session.close()
+
+
+# The end.
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Private key pool for the Orch service
+Keeps certificate keys generated ahead of the requests that need them
+"""
+
+import os
+import uuid
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from .cert_issuer import CertificateIssuer, KEY_ALGORITHMS
+
+logger = logging.getLogger("key_pool")
+
+class KeyPool:
+    """
+    A directory of ready private keys, so issuing a certificate for a new
+    CN doesn't wait on key generation. A background thread at the lowest
+    CPU priority tops the pool up to size keys of each pooled algorithm
+    whenever one is taken, and every check_interval seconds in case other
+    workers drained it. The configured algorithms are pooled from the
+    start; any other algorithm is pooled once a certificate asks for it.
+
+    Keys are files in a 0700 directory, one subdirectory per algorithm,
+    each written 0600 under a temporary name and renamed into place, so
+    they survive restarts and a crash never leaves a partial key in the
+    pool. Workers share the directory: a key belongs to whoever unlinks
+    its file, and one worker at a time refills, holding an flock()ed file
+    in the pool directory.
+    """
+
+    def __init__(self, pool_dir: Path = Path('/mnt/data/keypool'), size: int = 8,
+                 algorithms: Iterable[str] = ('ecdsa-p256',), check_interval: float = 30.0):
+        for algorithm in algorithms:
+            if algorithm not in KEY_ALGORITHMS:
+                raise ValueError(f"Unknown key algorithm: {algorithm}")
+        self.pool_dir = Path(pool_dir)
+        self.size = max(0, size)
+        self.check_interval = check_interval
+
+        self.pool_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.pool_dir.chmod(0o700)
+        if self.size:
+            for algorithm in algorithms:
+                self._algorithm_dir(algorithm).mkdir(mode=0o700, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'taken': 0, 'missed': 0, 'generated': 0}
+
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """The refill thread didn't come along; the child starts its own on first use"""
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _algorithm_dir(self, algorithm: str) -> Path:
+        return self.pool_dir / algorithm
+
+    @property
+    def algorithms(self) -> List[str]:
+        """Algorithms kept in the pool, by every worker's configuration and demand"""
+        return sorted(path.name for path in self.pool_dir.iterdir()
+                      if path.is_dir() and path.name in KEY_ALGORITHMS)
+
+    def take(self, algorithm: str):
+        """A ready key of the given algorithm, or None if the pool has none"""
+        if self.size == 0 or algorithm not in KEY_ALGORITHMS:
+            return None
+
+        key = None
+        directory = self._algorithm_dir(algorithm)
+        if not directory.exists():
+            # pool this algorithm from now on
+            directory.mkdir(mode=0o700, exist_ok=True)
+        for path in sorted(directory.glob('*.pem')):
+            try:
+                data = path.read_bytes()
+                # whoever unlinks the file owns the key
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            try:
+                key = CertificateIssuer.load_key(data)
+                break
+            except Exception as e:
+                logger.warning(f"Discarding unreadable pooled key {path.name}: {e}")
+
+        self._stats['taken' if key is not None else 'missed'] += 1
+        self.start()
+        self._wake.set()
+        return key
+
+    def count(self, algorithm: str) -> int:
+        directory = self._algorithm_dir(algorithm)
+        return len(list(directory.glob('*.pem'))) if directory.exists() else 0
+
+    def fill(self) -> int:
+        """Generate keys until the pool is full, unless another worker is filling it"""
+        if self.size == 0:
+            return 0
+
+        fd = os.open(self.pool_dir / '.fill.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            generated = 0
+            for algorithm in self.algorithms:
+                directory = self._algorithm_dir(algorithm)
+                made = 0
+                while self.count(algorithm) < self.size and not self._stop.is_set():
+                    key = CertificateIssuer.generate_key(algorithm)
+                    name = uuid.uuid4().hex
+                    tmp = directory / f".{name}.tmp"
+                    try:
+                        CertificateIssuer.write_key(key, tmp, 0o600)
+                        os.replace(tmp, directory / f"{name}.pem")
+                    finally:
+                        tmp.unlink(missing_ok=True)
+                    made += 1
+                    self._stats['generated'] += 1
+
+                if made:
+                    logger.info(f"Generated {made} {algorithm} keys for the key pool")
+                generated += made
+            return generated
+        finally:
+            os.close(fd)
+
+    def start(self):
+        """Start the refill thread in this process, if it isn't running"""
+        if self.size == 0:
+            return None
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._refill, name="key-pool", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _refill(self):
+        try:
+            # Linux nice values apply per thread; leave the CPU to requests
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower key pool thread priority: {e}")
+
+        while not self._stop.is_set():
+            try:
+                self.fill()
+            except Exception as e:
+                logger.error(f"Error filling key pool: {e}")
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+
+    def stats(self) -> Dict:
+        """Keys ready per algorithm, and keys taken from, missing from and generated for the pool by this worker"""
+        return {
+            'size': self.size,
+            'ready': {algorithm: self.count(algorithm) for algorithm in self.algorithms},
+            **self._stats
+        }
+
+
+# The end.
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Liveness cache for the Orch service
+Answers "is this container running" from one bulk container listing
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional, Dict
+
+logger = logging.getLogger("liveness_cache")
+
+class LivenessCache:
+    """Container status snapshot refreshed from a single containers.list(all=True)"""
+
+    def __init__(self, container_client, ttl: float = 5.0):
+        self.container_client = container_client
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._statuses: Dict[str, str] = {}
+        self._refreshed_at = 0.0
+
+        # a refresh may be in flight when gunicorn forks
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Reset the lock in a forked child"""
+        self._lock = threading.Lock()
+
+    def is_running(self, container_id: str) -> bool:
+        """Check if a container is running, refreshing the snapshot if stale"""
+        status = self.get_status(container_id)
+        return status == 'running'
+
+    def get_status(self, container_id: str) -> Optional[str]:
+        """Get the status of a container, or None if it doesn't exist"""
+        if self.ttl <= 0:
+            # caching disabled, fall back to a direct lookup
+            return self._fetch_status(container_id)
+
+        with self._lock:
+            if time.monotonic() - self._refreshed_at > self.ttl:
+                self._refresh_locked()
+            status = self._statuses.get(container_id)
+
+        if status is None:
+            # absent from the snapshot is not proof of death: the container
+            # may have started since the listing, or be named by a short ID
+            # or name, so ask the container API before reporting it gone
+            status = self._fetch_status(container_id)
+        return status
+
+    def refresh(self):
+        """Force a refresh of the snapshot"""
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        try:
+            containers = self.container_client.client.containers.list(all=True)
+        except Exception as e:
+            # keep serving the previous snapshot rather than declaring everything dead
+            logger.error(f"Error refreshing container liveness: {e}")
+            return
+
+        statuses = {}
+        for container in containers:
+            state = container.attrs.get('State')
+            if isinstance(state, dict):
+                state = state.get('Status')
+            statuses[container.id] = state
+
+        self._statuses = statuses
+        self._refreshed_at = time.monotonic()
+        logger.debug(f"Liveness cache refreshed: {len(statuses)} containers")
+
+    def _fetch_status(self, container_id: str) -> Optional[str]:
+        try:
+            return self.container_client.client.containers.get(container_id).status
+        except Exception as e:
+            logger.debug(f"Error checking container status {container_id}: {e}")
+            return None
+
+    def mark(self, container_id: str, status: Optional[str]):
+        """Record a status change seen on the events stream (None for removed)"""
+        with self._lock:
+            if status is None:
+                self._statuses.pop(container_id, None)
+            else:
+                self._statuses[container_id] = status
+
+    def invalidate(self):
+        """Discard the snapshot so the next check refreshes it"""
+        with self._lock:
+            self._refreshed_at = 0.0
+
+
+# The end.
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Resource mapping cache for the Orch service
+In-process copy of resource_mappings, invalidated by a generation counter
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional, Dict, List
+
+from .storage import StorageBackend
+
+logger = logging.getLogger("mapping_cache")
+
+class MappingCache:
+    """
+    Read-through cache of the resource_mappings table. The whole (tiny)
+    table is held in memory and stamped with the mappings generation
+    stored in the database; any worker that changes mappings bumps the
+    generation, and every other worker reloads when it notices.
+    """
+
+    def __init__(self, db_manager: StorageBackend, check_interval: float = 1.0):
+        self.db = db_manager
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._mappings: Optional[Dict[str, Dict]] = None
+        self._generation = None
+        self._checked_at = 0.0
+
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Reset the lock in a forked child"""
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> Optional[int]:
+        """Generation of the currently cached mappings"""
+        return self._generation
+
+    def get(self, uuid: str) -> Optional[Dict]:
+        """Get a resource mapping by UUID"""
+        mappings = self._current()
+        if mappings is None:
+            # cache unavailable, go straight to the database
+            return self.db.get_resource_mapping(uuid)
+        mapping = mappings.get(uuid)
+        return dict(mapping) if mapping else None
+
+    def get_all(self) -> List[Dict]:
+        """Get all resource mappings"""
+        mappings = self._current()
+        if mappings is None:
+            return self.db.get_all_mappings()
+        return [dict(mapping) for mapping in mappings.values()]
+
+    def refresh(self):
+        """Check the generation now rather than waiting for the check interval"""
+        with self._lock:
+            self._checked_at = 0.0
+        self._current()
+
+    def invalidate(self):
+        """Drop the cached mappings so the next access reloads them"""
+        with self._lock:
+            self._mappings = None
+            self._generation = None
+            self._checked_at = 0.0
+
+    def _current(self) -> Optional[Dict[str, Dict]]:
+        """Return the cached mappings, reloading them if the generation moved"""
+        with self._lock:
+            return self._current_locked()
+
+    def _current_locked(self) -> Optional[Dict[str, Dict]]:
+        now = time.monotonic()
+        if self._mappings is not None and now - self._checked_at < self.check_interval:
+            return self._mappings
+
+        if self._mappings is not None:
+            generation = self.db.get_mappings_generation()
+            if generation is None or generation == self._generation:
+                # unchanged, or unreadable - keep serving what we have
+                self._checked_at = now
+                return self._mappings
+
+        try:
+            generation, rows = self.db.load_mappings_snapshot()
+        except Exception as e:
+            logger.error(f"Failed to load resource mappings into cache: {e}")
+            return self._mappings
+
+        # the table is small enough that a full reload is cheaper than
+        # working out which mappings moved, so replace the whole copy
+        self._mappings = {row['uuid']: row for row in rows}
+        self._generation = generation
+        self._checked_at = now
+        logger.debug(f"Mapping cache loaded {len(rows)} mappings at generation {generation}")
+        return self._mappings
+
+
+# The end.
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Resource mapping file watcher for the Orch service
+Re-applies resource_mapping.yaml when it changes, without a restart
+"""
+
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple
+
+from .mapping_cache import MappingCache
+from .resource_manager import ResourceManager
+
+logger = logging.getLogger("mapping_watcher")
+
+class MappingWatcher:
+    """
+    Watches the resource mapping file with inotify (or mtime polling where
+    inotify is unavailable) and syncs only the difference into the
+    database. The sync is a single transaction and bumps the mappings
+    generation, so every worker's mapping cache picks up just the changed
+    entries while requests in flight keep using the mappings they read.
+    """
+
+    # inotify(7) event masks
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_CLOEXEC = os.O_CLOEXEC
+    IN_NONBLOCK = os.O_NONBLOCK
+
+    # the file is watched through its directory so atomic renames are seen
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, resource_manager: ResourceManager, mapping_cache: MappingCache,
+                 mapping_file: str = "/app/resource_mapping.yaml",
+                 poll_interval: float = 2.0, settle_delay: float = 0.2):
+        self.resource_manager = resource_manager
+        self.mapping_cache = mapping_cache
+        self.mapping_file = Path(mapping_file)
+        self.poll_interval = poll_interval
+        self.settle_delay = settle_delay
+
+        self.mode = None
+        self.reloads = 0
+        self._signature = self._file_signature()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a daemon thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mapping-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching"""
+        self._stop.set()
+
+    def reload(self) -> Optional[Dict[str, List[str]]]:
+        """Apply the mapping file to the database and refresh the local cache"""
+        diff = self.resource_manager.sync_resource_mappings(str(self.mapping_file))
+        if diff is None:
+            # keep serving the previous mappings
+            logger.error(f"Resource mapping reload from {self.mapping_file} failed, keeping current mappings")
+            return None
+
+        self.reloads += 1
+        if diff['added'] or diff['changed'] or diff['removed']:
+            logger.info(f"Reloaded resource mappings: added {diff['added']}, "
+                        f"changed {diff['changed']}, removed {diff['removed']}")
+            self.mapping_cache.refresh()
+        return diff
+
+    def _run(self):
+        fd = self._open_inotify()
+        if fd is None:
+            self.mode = 'poll'
+            logger.info(f"Polling {self.mapping_file} for changes every {self.poll_interval}s")
+            self._watch_poll()
+            return
+
+        self.mode = 'inotify'
+        logger.info(f"Watching {self.mapping_file} for changes with inotify")
+        try:
+            self._watch_inotify(fd)
+        finally:
+            os.close(fd)
+
+    def _open_inotify(self) -> Optional[int]:
+        """Set up an inotify watch on the mapping file's directory"""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(self.IN_CLOEXEC | self.IN_NONBLOCK)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+            directory = str(self.mapping_file.parent).encode()
+            if libc.inotify_add_watch(fd, directory, self.WATCH_MASK) < 0:
+                err = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(err, os.strerror(err))
+            return fd
+        except Exception as e:
+            logger.warning(f"inotify unavailable, falling back to polling: {e}")
+            return None
+
+    def _read_events(self, fd: int) -> List[Tuple[int, str]]:
+        """Read every queued inotify event as (mask, name)"""
+        events = []
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+
+            offset = 0
+            while offset + self._EVENT.size <= len(data):
+                _, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                events.append((mask, name))
+
+    def _watch_inotify(self, fd: int):
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+
+                if any(name == self.mapping_file.name for _, name in self._read_events(fd)):
+                    self._reload_if_changed()
+            except Exception as e:
+                logger.error(f"Error watching {self.mapping_file}: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _watch_poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._reload_if_changed()
+            except Exception as e:
+                logger.error(f"Error polling {self.mapping_file}: {e}")
+
+    def _reload_if_changed(self):
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return
+
+        # a file still being written will have moved on after the settle
+        # delay; a partial file must not be applied as a diff
+        time.sleep(self.settle_delay)
+        if self._file_signature() != signature:
+            return
+
+        if self.reload() is not None:
+            self._signature = signature
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        """Identify the current file contents by inode, size and mtime"""
+        try:
+            stat = self.mapping_file.stat()
+            return stat.st_ino, stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+
+# The end.
@@ -0,0 +1,837 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL storage for the Orch service
+Shared database so several orch replicas can hand out the same resources
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple
+from datetime import datetime
+
+import psycopg2
+import psycopg2.pool
+import psycopg2.extras
+
+from .storage import StorageBackend
+
+logger = logging.getLogger("postgres_database")
+
+# timestamps are stored as UTC without a zone, like SQLite's CURRENT_TIMESTAMP
+NOW = "(now() AT TIME ZONE 'utc')"
+
+def _ts(column: str) -> str:
+    """Format a timestamp column the way SQLite returns it"""
+    return f"to_char({column}, 'YYYY-MM-DD HH24:MI:SS')"
+
+class PostgresDatabaseManager(StorageBackend):
+    """
+    Manages a PostgreSQL database for resource tracking. Connections come
+    from a per-process pool, and checkout claims take row-level locks so
+    concurrent replicas serialize on the resource, not on the database.
+    """
+
+    # pg_advisory_xact_lock key serializing schema setup between replicas
+    SCHEMA_LOCK = 0x6f726368
+
+    PARAM = '%s'
+
+    MIGRATIONS = [
+        (1, 'initial schema', [
+            # Resource mappings table - maps UUIDs to actual resources
+            f"""
+            CREATE TABLE IF NOT EXISTS resource_mappings (
+                uuid TEXT PRIMARY KEY,
+                resource_type TEXT NOT NULL,
+                actual_resource_name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT {NOW}
+            )
+            """,
+            # Resource aliases table - tracks multiple UUIDs for same resource
+            """
+            CREATE TABLE IF NOT EXISTS resource_aliases (
+                uuid TEXT PRIMARY KEY,
+                canonical_uuid TEXT NOT NULL REFERENCES resource_mappings(uuid)
+            )
+            """,
+            # Resource checkouts table - tracks who has checked out what
+            f"""
+            CREATE TABLE IF NOT EXISTS resource_checkouts (
+                uuid TEXT NOT NULL REFERENCES resource_mappings(uuid),
+                actual_resource_name TEXT NOT NULL,
+                container_id TEXT NOT NULL,
+                container_ip TEXT NOT NULL,
+                checked_out_at TIMESTAMP DEFAULT {NOW},
+                resource_type TEXT NOT NULL,
+                scale_index INTEGER DEFAULT NULL,
+                PRIMARY KEY (uuid, actual_resource_name)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_container_id ON resource_checkouts(container_id)",
+            "CREATE INDEX IF NOT EXISTS idx_container_ip ON resource_checkouts(container_ip)",
+            "CREATE INDEX IF NOT EXISTS idx_checked_out_at ON resource_checkouts(checked_out_at)",
+            "CREATE INDEX IF NOT EXISTS idx_resource_type ON resource_mappings(resource_type)",
+        ]),
+        (2, 'mappings generation', [
+            # Orch state table - small named counters shared by all replicas
+            """
+            CREATE TABLE IF NOT EXISTS orch_state (
+                key TEXT PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0
+            )
+            """,
+            """
+            INSERT INTO orch_state (key, value) VALUES ('mappings_generation', 0)
+            ON CONFLICT (key) DO NOTHING
+            """,
+        ]),
+        (3, 'checkout leases', [
+            "ALTER TABLE resource_checkouts ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP DEFAULT NULL",
+            "CREATE INDEX IF NOT EXISTS idx_expires_at ON resource_checkouts(expires_at)",
+        ]),
+        (4, 'covering indexes for checkout lookups', [
+            # release_resource: WHERE uuid = %s AND container_id = %s
+            """
+            CREATE INDEX IF NOT EXISTS idx_checkouts_uuid_container
+            ON resource_checkouts(uuid, container_id) INCLUDE (actual_resource_name)
+            """,
+            # get_resource_status: WHERE uuid = %s [AND actual_resource_name = %s]
+            """
+            CREATE INDEX IF NOT EXISTS idx_checkouts_status
+            ON resource_checkouts(uuid, actual_resource_name)
+            INCLUDE (container_id, container_ip, checked_out_at, scale_index, expires_at)
+            """,
+            # get_resource_mapping and the mapping cache: WHERE uuid = %s
+            """
+            CREATE INDEX IF NOT EXISTS idx_mappings_lookup
+            ON resource_mappings(uuid) INCLUDE (resource_type, actual_resource_name, description)
+            """,
+        ]),
+        (5, 'provisioning tasks', [
+            # Provisioning tasks table - progress of the startup provisioning run
+            """
+            CREATE TABLE IF NOT EXISTS provisioning_tasks (
+                seq BIGSERIAL,
+                task TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                depends_on TEXT[] NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL,
+                error TEXT,
+                started_at TIMESTAMP DEFAULT NULL,
+                finished_at TIMESTAMP DEFAULT NULL
+            )
+            """,
+        ]),
+        (6, 'koji host registrations', [
+            # Koji hosts table - workers registered by manage-koji-host.sh
+            f"""
+            CREATE TABLE IF NOT EXISTS koji_hosts (
+                worker_name TEXT PRIMARY KEY,
+                principal TEXT NOT NULL,
+                arch TEXT NOT NULL,
+                registered_at TIMESTAMP DEFAULT {NOW},
+                verified_at TIMESTAMP DEFAULT {NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_koji_hosts_verified_at ON koji_hosts(verified_at)",
+        ]),
+        (7, 'mapping key algorithms', [
+            "ALTER TABLE resource_mappings ADD COLUMN IF NOT EXISTS key_algorithm TEXT DEFAULT NULL",
+            # keep get_resource_mapping and the mapping cache covered
+            "DROP INDEX IF EXISTS idx_mappings_lookup",
+            """
+            CREATE INDEX IF NOT EXISTS idx_mappings_lookup
+            ON resource_mappings(uuid) INCLUDE (resource_type, actual_resource_name, description, key_algorithm)
+            """,
+        ]),
+        (8, 'certificate ledger', [
+            # Certificates table - every certificate the CA issued
+            f"""
+            CREATE TABLE IF NOT EXISTS certificates (
+                serial BIGINT PRIMARY KEY,
+                cn TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                key_algorithm TEXT,
+                not_before TIMESTAMP NOT NULL,
+                not_after TIMESTAMP NOT NULL,
+                status TEXT NOT NULL DEFAULT 'valid',
+                issued_at TIMESTAMP DEFAULT {NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_certificates_cn ON certificates(cn, status)",
+            # the next serial, continuing from the openssl serial file when there is one
+            """
+            INSERT INTO orch_state (key, value) VALUES ('certificate_serial', 0)
+            ON CONFLICT (key) DO NOTHING
+            """,
+        ]),
+        (9, 'drop redundant lookup indexes', [
+            # the primary key already serves get_resource_status and
+            # claim_resource, and resource_mappings is small enough that
+            # its primary key lookup needs no covering index
+            "DROP INDEX IF EXISTS idx_checkouts_status",
+            "DROP INDEX IF EXISTS idx_mappings_lookup",
+        ]),
+    ]
+
+    def __init__(self, database_url: str):
+        self.database_url = database_url
+        self.pool_min = int(os.getenv('ORCH_DB_POOL_MIN', '1'))
+        self.pool_max = int(os.getenv('ORCH_DB_POOL_MAX', '10'))
+
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._inherited_pools = []
+
+        # gunicorn forks workers from a --preload master
+        os.register_at_fork(after_in_child=self._after_fork)
+
+        self.init_database()
+
+    def _after_fork(self):
+        """Abandon the parent's pool in a forked child"""
+        self._pool_lock = threading.Lock()
+        if self._pool is not None:
+            # closing an inherited connection would terminate the parent's
+            # session too, so keep it referenced and never touch it again
+            self._inherited_pools.append(self._pool)
+            self._pool = None
+
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """Get this process's connection pool, creating it on first use"""
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.pool_min, self.pool_max, self.database_url)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block in one transaction on a pooled connection, yielding a cursor"""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            # drop connections the server has closed rather than reusing them
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def close(self):
+        """Close every pooled connection held by this process"""
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+
+    def init_database(self):
+        """Initialize the database by applying any pending schema migrations"""
+        with self._transaction() as cursor:
+            # replicas starting together must not race on the migrations
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (self.SCHEMA_LOCK,))
+            self._apply_migrations(cursor)
+
+        logger.info("Database initialized successfully")
+
+    def get_schema_version(self) -> Optional[int]:
+        """Get the latest applied migration version, or None if it can't be read"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("SELECT MAX(version) FROM schema_migrations")
+                return cursor.fetchone()[0] or 0
+        except Exception as e:
+            logger.error(f"Failed to get schema version: {e}")
+            return None
+
+    def add_resource_mapping(self, uuid: str, resource_type: str, actual_resource_name: str,
+                             description: str = None, key_algorithm: str = None) -> bool:
+        """Add a new resource mapping"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO resource_mappings (uuid, resource_type, actual_resource_name, description, key_algorithm)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (uuid) DO UPDATE SET
+                        resource_type = excluded.resource_type,
+                        actual_resource_name = excluded.actual_resource_name,
+                        description = excluded.description,
+                        key_algorithm = excluded.key_algorithm
+                """, (uuid, resource_type, actual_resource_name, description, key_algorithm))
+                self._bump_mappings_generation(cursor)
+            logger.info(f"Added resource mapping: {uuid} -> {actual_resource_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to add resource mapping {uuid}: {e}")
+            return False
+
+    def sync_resource_mappings(self, mappings: Dict[str, Dict]) -> Optional[Dict[str, List[str]]]:
+        """
+        Make resource_mappings match the given mappings in one transaction
+        Replicas syncing the same file at once take turns on a table lock,
+        and all but the first find nothing left to change.
+        """
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("LOCK TABLE resource_mappings IN SHARE ROW EXCLUSIVE MODE")
+                cursor.execute("""
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                    FROM resource_mappings
+                """)
+                current = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+                wanted = {
+                    uuid: (mapping['resource_type'], mapping['actual_resource_name'], mapping.get('description'),
+                           mapping.get('key_algorithm'))
+                    for uuid, mapping in mappings.items()
+                }
+                added = [uuid for uuid in wanted if uuid not in current]
+                changed = [uuid for uuid in wanted if uuid in current and current[uuid] != wanted[uuid]]
+                removed = [uuid for uuid in current if uuid not in wanted]
+
+                if added:
+                    psycopg2.extras.execute_batch(cursor, """
+                        INSERT INTO resource_mappings (uuid, resource_type, actual_resource_name, description, key_algorithm)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, [(uuid, *wanted[uuid]) for uuid in added])
+
+                if changed:
+                    psycopg2.extras.execute_batch(cursor, """
+                        UPDATE resource_mappings
+                        SET resource_type = %s, actual_resource_name = %s, description = %s, key_algorithm = %s
+                        WHERE uuid = %s
+                    """, [(*wanted[uuid], uuid) for uuid in changed])
+
+                if removed:
+                    # checkouts and aliases of a removed mapping can never be used again
+                    cursor.execute("DELETE FROM resource_checkouts WHERE uuid = ANY(%s)", (removed,))
+                    cursor.execute("DELETE FROM resource_aliases WHERE uuid = ANY(%s) OR canonical_uuid = ANY(%s)",
+                                   (removed, removed))
+                    cursor.execute("DELETE FROM resource_mappings WHERE uuid = ANY(%s)", (removed,))
+
+                if added or changed or removed:
+                    self._bump_mappings_generation(cursor)
+
+            return {'added': added, 'changed': changed, 'removed': removed}
+        except Exception as e:
+            logger.error(f"Failed to sync resource mappings: {e}")
+            return None
+
+    def _bump_mappings_generation(self, cursor):
+        """Advance the mappings generation so every worker's mapping cache reloads"""
+        cursor.execute("""
+            UPDATE orch_state SET value = value + 1 WHERE key = 'mappings_generation'
+        """)
+
+    def get_mappings_generation(self) -> Optional[int]:
+        """Get the current mappings generation, or None if it can't be read"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    SELECT value FROM orch_state WHERE key = 'mappings_generation'
+                """)
+                row = cursor.fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Failed to get mappings generation: {e}")
+            return None
+
+    def load_mappings_snapshot(self) -> Tuple[int, List[Dict]]:
+        """
+        Read the mappings generation and every mapping from one snapshot,
+        so the rows always match the generation.
+        Raises on failure rather than returning an empty list.
+        """
+        with self._transaction() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute("""
+                SELECT value FROM orch_state WHERE key = 'mappings_generation'
+            """)
+            row = cursor.fetchone()
+            generation = row[0] if row else 0
+
+            cursor.execute("""
+                SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                FROM resource_mappings ORDER BY created_at
+            """)
+            return generation, [self._mapping(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _mapping(row) -> Dict:
+        return {
+            'uuid': row[0],
+            'resource_type': row[1],
+            'actual_resource_name': row[2],
+            'description': row[3],
+            'key_algorithm': row[4]
+        }
+
+    def get_resource_mapping(self, uuid: str) -> Optional[Dict]:
+        """Get resource mapping by UUID"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                    FROM resource_mappings WHERE uuid = %s
+                """, (uuid,))
+                row = cursor.fetchone()
+                return self._mapping(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get resource mapping {uuid}: {e}")
+            return None
+
+    def get_all_mappings(self) -> List[Dict]:
+        """Get all resource mappings"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    SELECT uuid, resource_type, actual_resource_name, description, key_algorithm
+                    FROM resource_mappings ORDER BY created_at
+                """)
+                return [self._mapping(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get all mappings: {e}")
+            return []
+
+    def claim_resource(self, uuid: str, container_id: str, container_ip: str,
+                       resource_type: str, actual_resource_name: str, scale_index: int = None,
+                       takeover_from: str = None, lease_ttl: int = None) -> Tuple[bool, Optional[str], bool]:
+        """
+        Atomically claim a resource (uuid, actual_resource_name) for a container.
+        An existing checkout row is locked FOR UPDATE, and a concurrent first
+        claim is settled by the primary key, so only one replica can win.
+        Returns: (claimed, previous_owner, previous_lease_active)
+        """
+        lease = int(lease_ttl) if lease_ttl and lease_ttl > 0 else None
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT container_id, COALESCE(expires_at > {NOW}, false) FROM resource_checkouts
+                    WHERE uuid = %s AND actual_resource_name = %s
+                    FOR UPDATE
+                """, (uuid, actual_resource_name))
+                existing = cursor.fetchone()
+                previous_owner = existing[0] if existing else None
+                lease_active = bool(existing[1]) if existing else False
+
+                # Insert, or take over only from the expected owner
+                cursor.execute(f"""
+                    INSERT INTO resource_checkouts
+                    (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index,
+                     expires_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, {NOW} + %s::integer * interval '1 second')
+                    ON CONFLICT (uuid, actual_resource_name) DO UPDATE SET
+                        container_id = excluded.container_id,
+                        container_ip = excluded.container_ip,
+                        resource_type = excluded.resource_type,
+                        scale_index = excluded.scale_index,
+                        expires_at = excluded.expires_at,
+                        checked_out_at = {NOW}
+                    WHERE resource_checkouts.container_id = %s
+                """, (uuid, actual_resource_name, container_id, container_ip, resource_type, scale_index,
+                      lease, takeover_from))
+                claimed = cursor.rowcount == 1
+
+                if not claimed and existing is None:
+                    # a concurrent first claim committed between our SELECT and
+                    # INSERT; this statement sees its row, so report that owner
+                    cursor.execute(f"""
+                        SELECT container_id, COALESCE(expires_at > {NOW}, false) FROM resource_checkouts
+                        WHERE uuid = %s AND actual_resource_name = %s
+                    """, (uuid, actual_resource_name))
+                    existing = cursor.fetchone()
+                    previous_owner = existing[0] if existing else None
+                    lease_active = bool(existing[1]) if existing else False
+
+            if claimed and previous_owner:
+                logger.info(f"Checked out resource {uuid} ({actual_resource_name}) to container {container_id}, "
+                            f"taken over from {previous_owner}")
+            elif claimed:
+                logger.info(f"Checked out resource {uuid} ({actual_resource_name}) to container {container_id}")
+            else:
+                logger.warning(f"Resource {uuid} ({actual_resource_name}) already checked out to {previous_owner}")
+
+            return claimed, previous_owner, lease_active
+        except Exception as e:
+            logger.error(f"Failed to checkout resource {uuid} ({actual_resource_name}): {e}")
+            return False, None, False
+
+    def release_resource(self, uuid: str, container_id: str) -> bool:
+        """Release a resource from a container using composite key"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    DELETE FROM resource_checkouts
+                    WHERE uuid = %s AND container_id = %s
+                    RETURNING actual_resource_name
+                """, (uuid, container_id))
+                resources = cursor.fetchall()
+
+            if not resources:
+                logger.warning(f"No resources with UUID {uuid} checked out to container {container_id}")
+                return False
+
+            for resource in resources:
+                logger.info(f"Released resource {uuid} ({resource[0]}) from container {container_id}")
+
+            logger.info(f"Released {len(resources)} resource(s) with UUID {uuid} from container {container_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to release resource {uuid} from container {container_id}: {e}")
+            return False
+
+    def get_resource_status(self, uuid: str, actual_resource_name: str = None) -> Optional[Dict]:
+        """Get current status of a resource, optionally for a specific actual_resource_name"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    SELECT uuid, resource_type, actual_resource_name, description
+                    FROM resource_mappings WHERE uuid = %s
+                """, (uuid,))
+                mapping = cursor.fetchone()
+
+                if not mapping:
+                    return None
+
+                columns = f"""
+                    container_id, container_ip, {_ts('checked_out_at')}, scale_index,
+                    actual_resource_name, {_ts('expires_at')}, COALESCE(expires_at > {NOW}, false)
+                """
+                if actual_resource_name:
+                    cursor.execute(f"""
+                        SELECT {columns}
+                        FROM resource_checkouts WHERE uuid = %s AND actual_resource_name = %s
+                    """, (uuid, actual_resource_name))
+                else:
+                    # For backward compatibility, get first checkout if any exist
+                    cursor.execute(f"""
+                        SELECT {columns}
+                        FROM resource_checkouts WHERE uuid = %s LIMIT 1
+                    """, (uuid,))
+                checkout = cursor.fetchone()
+
+            if actual_resource_name:
+                resource_name = actual_resource_name
+            else:
+                resource_name = checkout[4] if checkout else mapping[2]
+
+            return {
+                'uuid': mapping[0],
+                'resource_type': mapping[1],
+                'actual_resource_name': resource_name,
+                'description': mapping[3],
+                'checked_out': checkout is not None,
+                'container_id': checkout[0] if checkout else None,
+                'container_ip': checkout[1] if checkout else None,
+                'checked_out_at': checkout[2] if checkout else None,
+                'scale_index': checkout[3] if checkout else None,
+                'expires_at': checkout[5] if checkout else None,
+                'lease_active': bool(checkout[6]) if checkout else False
+            }
+        except Exception as e:
+            logger.error(f"Failed to get resource status {uuid}: {e}")
+            return None
+
+    def renew_lease(self, uuid: str, container_id: str, lease_ttl: int = None) -> Tuple[int, Optional[str]]:
+        """
+        Extend the lease on every resource with this UUID held by a container
+        A lease_ttl of None or 0 turns the checkouts into non-expiring ones.
+        Returns: (renewed_count, expires_at)
+        """
+        lease = int(lease_ttl) if lease_ttl and lease_ttl > 0 else None
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    UPDATE resource_checkouts SET expires_at = {NOW} + %s::integer * interval '1 second'
+                    WHERE uuid = %s AND container_id = %s
+                    RETURNING {_ts('expires_at')}
+                """, (lease, uuid, container_id))
+                rows = cursor.fetchall()
+
+            expires_at = rows[0][0] if rows else None
+            if rows:
+                logger.debug(f"Renewed lease on {uuid} for container {container_id} until {expires_at}")
+
+            return len(rows), expires_at
+        except Exception as e:
+            logger.error(f"Failed to renew lease on {uuid} for container {container_id}: {e}")
+            return 0, None
+
+    def expire_leases(self) -> int:
+        """Release every checkout whose lease has lapsed (a range scan on idx_expires_at)"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    DELETE FROM resource_checkouts WHERE expires_at <= {NOW}
+                """)
+                expired = cursor.rowcount
+
+            if expired > 0:
+                logger.info(f"Released {expired} checkout(s) with lapsed leases")
+
+            return expired
+        except Exception as e:
+            logger.error(f"Failed to expire leases: {e}")
+            return 0
+
+    def release_container(self, container_id: str) -> int:
+        """Release every resource checked out to a container"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    DELETE FROM resource_checkouts WHERE container_id = %s
+                """, (container_id,))
+                released = cursor.rowcount
+
+            if released > 0:
+                logger.info(f"Released {released} checkout(s) held by container {container_id}")
+
+            return released
+        except Exception as e:
+            logger.error(f"Failed to release checkouts for container {container_id}: {e}")
+            return 0
+
+    def cleanup_dead_containers(self, active_container_ids: List[str], checked_out_before: datetime = None,
+                                batch_size: int = 500) -> int:
+        """
+        Clean up checkouts for containers that no longer exist
+        Same approach as the SQLite backend: diff the distinct owners against
+        the live containers, then delete dead owners in batches as arrays.
+        """
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("SELECT DISTINCT container_id FROM resource_checkouts")
+                owners = {row[0] for row in cursor.fetchall()}
+
+            dead = sorted(owners.difference(active_container_ids))
+            if not dead:
+                return 0
+
+            query = "DELETE FROM resource_checkouts WHERE container_id = ANY(%s)"
+            params = ()
+            if checked_out_before is not None:
+                query += " AND checked_out_at < %s"
+                params = (checked_out_before.replace(microsecond=0),)
+
+            cleaned = 0
+            for start in range(0, len(dead), batch_size):
+                with self._transaction() as cursor:
+                    cursor.execute(query, (dead[start:start + batch_size], *params))
+                    cleaned += cursor.rowcount
+
+            if cleaned > 0:
+                logger.info(f"Cleaned up {cleaned} checkouts for {len(dead)} dead containers")
+
+            return cleaned
+        except Exception as e:
+            logger.error(f"Failed to cleanup dead containers: {e}")
+            return 0
+
+    def start_provisioning_run(self, tasks: List[Dict]) -> bool:
+        """Replace the recorded provisioning tasks with a new run's, all pending"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("DELETE FROM provisioning_tasks")
+                psycopg2.extras.execute_batch(cursor, """
+                    INSERT INTO provisioning_tasks (task, kind, resource, depends_on, state)
+                    VALUES (%s, %s, %s, %s, 'pending')
+                """, [(task['task'], task['kind'], task['resource'], list(task['depends_on']))
+                      for task in tasks])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to start provisioning run: {e}")
+            return False
+
+    def update_provisioning_task(self, task: str, state: str, error: str = None) -> bool:
+        """Record a provisioning task moving to running, done, failed or skipped"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    UPDATE provisioning_tasks SET
+                        state = %(state)s,
+                        error = %(error)s,
+                        started_at = CASE WHEN %(state)s = 'running' THEN {NOW} ELSE started_at END,
+                        finished_at = CASE WHEN %(state)s = 'running' THEN NULL ELSE {NOW} END
+                    WHERE task = %(task)s
+                """, {'state': state, 'error': error, 'task': task})
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to update provisioning task {task}: {e}")
+            return False
+
+    def get_provisioning_tasks(self) -> List[Dict]:
+        """Get every task of the latest provisioning run"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT task, kind, resource, depends_on, state, error,
+                           {_ts('started_at')}, {_ts('finished_at')}
+                    FROM provisioning_tasks ORDER BY seq
+                """)
+                return [
+                    {
+                        'task': row[0],
+                        'kind': row[1],
+                        'resource': row[2],
+                        'depends_on': list(row[3]),
+                        'state': row[4],
+                        'error': row[5],
+                        'started_at': row[6],
+                        'finished_at': row[7]
+                    }
+                    for row in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Failed to get provisioning tasks: {e}")
+            return []
+
+    def record_koji_host(self, worker_name: str, principal: str, arch: str) -> bool:
+        """Record a successful Koji host registration"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO koji_hosts (worker_name, principal, arch) VALUES (%s, %s, %s)
+                    ON CONFLICT (worker_name) DO UPDATE SET
+                        principal = excluded.principal,
+                        arch = excluded.arch,
+                        registered_at = {NOW},
+                        verified_at = {NOW}
+                """, (worker_name, principal, arch))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to record Koji host {worker_name}: {e}")
+            return False
+
+    def get_koji_host(self, worker_name: str) -> Optional[Dict]:
+        """Get the recorded registration of a Koji host"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT worker_name, principal, arch, {_ts('registered_at')}, {_ts('verified_at')}
+                    FROM koji_hosts WHERE worker_name = %s
+                """, (worker_name,))
+                row = cursor.fetchone()
+                return self._koji_host(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get Koji host {worker_name}: {e}")
+            return None
+
+    def get_koji_hosts(self) -> List[Dict]:
+        """Get every recorded Koji host registration, least recently verified first"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    SELECT worker_name, principal, arch, {_ts('registered_at')}, {_ts('verified_at')}
+                    FROM koji_hosts ORDER BY verified_at, worker_name
+                """)
+                return [self._koji_host(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get Koji hosts: {e}")
+            return []
+
+    @staticmethod
+    def _koji_host(row) -> Dict:
+        return {
+            'worker_name': row[0],
+            'principal': row[1],
+            'arch': row[2],
+            'registered_at': row[3],
+            'verified_at': row[4]
+        }
+
+    def mark_koji_host_verified(self, worker_name: str) -> bool:
+        """Note that a Koji host registration was just confirmed"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(f"""
+                    UPDATE koji_hosts SET verified_at = {NOW} WHERE worker_name = %s
+                """, (worker_name,))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to mark Koji host {worker_name} verified: {e}")
+            return False
+
+    def forget_koji_host(self, worker_name: str) -> bool:
+        """Drop a Koji host registration so the next checkout registers it again"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("DELETE FROM koji_hosts WHERE worker_name = %s", (worker_name,))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to forget Koji host {worker_name}: {e}")
+            return False
+
+    def allocate_certificate_serial(self, floor: int = 0) -> Optional[int]:
+        """Atomically take the next certificate serial, no lower than floor, or None on failure"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    UPDATE orch_state SET value = GREATEST(value + 1, %s)
+                    WHERE key = 'certificate_serial' RETURNING value
+                """, (floor,))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Failed to allocate a certificate serial: {e}")
+            return None
+
+    def record_certificate(self, serial: int, cn: str, fingerprint: str, key_algorithm: str,
+                           not_before: str, not_after: str) -> bool:
+        """Add an issued certificate to the ledger, superseding earlier certificates for its CN"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                    UPDATE certificates SET status = 'superseded'
+                    WHERE cn = %s AND status = 'valid' AND serial < %s
+                """, (cn, serial))
+                cursor.execute("""
+                    INSERT INTO certificates (serial, cn, fingerprint, key_algorithm, not_before, not_after)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (serial, cn, fingerprint, key_algorithm, not_before, not_after))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to record certificate {serial:X} for {cn}: {e}")
+            return False
+
+    def get_certificates(self, cn: str = None) -> List[Dict]:
+        """Get ledger entries, optionally for one CN, by serial"""
+        try:
+            with self._transaction() as cursor:
+                query = f"""
+                    SELECT serial, cn, fingerprint, key_algorithm, {_ts('not_before')}, {_ts('not_after')},
+                           status, {_ts('issued_at')}
+                    FROM certificates
+                """
+                if cn is None:
+                    cursor.execute(query + " ORDER BY serial")
+                else:
+                    cursor.execute(query + " WHERE cn = %s ORDER BY serial", (cn,))
+                return [self._certificate(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get certificates: {e}")
+            return []
+
+    @staticmethod
+    def _certificate(row) -> Dict:
+        return {
+            'serial': row[0],
+            'cn': row[1],
+            'fingerprint': row[2],
+            'key_algorithm': row[3],
+            'not_before': row[4],
+            'not_after': row[5],
+            'status': row[6],
+            'issued_at': row[7]
+        }
+
+
+# The end.
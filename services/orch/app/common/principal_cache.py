@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Principal existence cache for the Orch service
+In-process set of the KDC's principals, seeded by a single listprincs
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional, Dict, Set
+
+from .kadmin_pool import KadminPool
+
+logger = logging.getLogger("principal_cache")
+
+class PrincipalCache:
+    """
+    Set of principals known to exist in the KDC. It is seeded from one
+    listprincs, grows as orch creates or finds principals, and is re-read
+    in the background once it is older than the refresh interval.
+
+    Only hits are trusted: a principal missing from the set may still have
+    been created by someone else since the last listprincs, so callers fall
+    back to getprinc for it. Principals are never deleted by orch, so a
+    hit stays true until someone removes it from the KDC by hand; the next
+    refresh then drops it.
+    """
+
+    def __init__(self, kadmin: KadminPool, refresh_interval: float = 300.0):
+        self.kadmin = kadmin
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._principals: Optional[Set[str]] = None
+        self._refreshed_at = 0.0
+        self._attempted_at = 0.0
+        self._refreshing = False
+        self.hits = 0
+        self.misses = 0
+
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Reset the lock in a forked child; a parent's refresh thread didn't come along"""
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.refresh_interval > 0
+
+    def refresh(self) -> bool:
+        """Replace the set with a fresh listprincs"""
+        start = time.perf_counter()
+        output = self.kadmin.execute('listprincs')
+        if output is None:
+            logger.error("Failed to list principals, keeping the cached set")
+            return False
+
+        # listprincs prints one principal per line; anything else is chatter
+        principals = {line.strip() for line in output.splitlines()
+                      if '@' in line and len(line.split()) == 1}
+        if not principals:
+            logger.error(f"listprincs returned no principals, keeping the cached set: {output.strip()[:200]}")
+            return False
+
+        with self._lock:
+            self._principals = principals
+            self._refreshed_at = self._attempted_at = time.monotonic()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Cached {len(principals)} principals in {elapsed_ms:.1f} ms")
+        return True
+
+    def exists(self, principal_name: str) -> bool:
+        """True if the principal is known to exist; False means ask the KDC"""
+        if not self.enabled:
+            return False
+
+        with self._lock:
+            found = self._principals is not None and principal_name in self._principals
+            # a failed refresh waits out another interval before retrying
+            now = time.monotonic()
+            start_refresh = (now - self._attempted_at >= self.refresh_interval and not self._refreshing)
+            if start_refresh:
+                self._refreshing = True
+                self._attempted_at = now
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if start_refresh:
+            self._start_refresh_thread()
+
+        return found
+
+    def start_refresh(self) -> Optional[threading.Thread]:
+        """Refresh in the background unless a refresh is already running"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._refreshing:
+                return None
+            self._refreshing = True
+            self._attempted_at = time.monotonic()
+        return self._start_refresh_thread()
+
+    def _start_refresh_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=self._background_refresh, name="principal-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def add(self, principal_name: str):
+        """Record a principal that was just created or found"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._principals is None:
+                self._principals = set()
+            self._principals.add(principal_name)
+
+    def discard(self, principal_name: str):
+        """Forget a principal the KDC turned out not to have"""
+        with self._lock:
+            if self._principals is not None:
+                self._principals.discard(principal_name)
+
+    def stats(self) -> Dict:
+        """Cache size and hit counts"""
+        with self._lock:
+            size = len(self._principals) if self._principals is not None else 0
+            age = time.monotonic() - self._refreshed_at if self._refreshed_at else None
+            hits, misses = self.hits, self.misses
+        return {
+            'principals': size,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'hits': hits,
+            'misses': misses
+        }
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing principal cache: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+# The end.
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Startup provisioning for the Orch service
+Creates every mapped resource ahead of the first checkout
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, Dict, List, Callable, NamedTuple
+
+from .storage import StorageBackend
+from .resource_manager import ResourceManager
+
+logger = logging.getLogger("provisioner")
+
+class ProvisioningTask(NamedTuple):
+    task: str
+    kind: str
+    resource: str
+    depends_on: List[str]
+    action: Callable[[], bool]
+
+
+class Provisioner:
+    """
+    Walks resource_mappings at startup and creates what checkouts will ask
+    for: the CA before any certificate, each principal before its keytab,
+    and a worker's keytab before its Koji host registration. Independent
+    tasks run in parallel up to the configured limit; a task whose
+    dependency failed is skipped. Progress is recorded in the database so
+    every worker can report it, and the lazy creation on checkout remains
+    the fallback for anything that isn't ready yet.
+
+    Scaled worker resources only get a name once a container with a scale
+    index asks, so they are provisioned for indexes 1..worker_scale when a
+    scale is configured and left to checkout otherwise.
+    """
+
+    def __init__(self, db_manager: StorageBackend, resource_manager: ResourceManager,
+                 parallelism: int = 4, worker_scale: int = 0):
+        self.db = db_manager
+        self.resource_manager = resource_manager
+        self.parallelism = max(1, parallelism)
+        self.worker_scale = worker_scale
+
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def build_graph(self, mappings: List[Dict]) -> Dict[str, ProvisioningTask]:
+        """Build the provisioning tasks for the given mappings, keyed by task name"""
+        rm = self.resource_manager
+        tasks: Dict[str, ProvisioningTask] = {}
+
+        def add(task: str, kind: str, resource: str, depends_on: List[str], action: Callable[[], bool]):
+            if task not in tasks:
+                tasks[task] = ProvisioningTask(task, kind, resource, depends_on, action)
+            return task
+
+        def ca():
+            if not rm.ca_manager:
+                return []
+            return [add('ca', 'ca', rm.ca_manager.ca_cn, [],
+                        lambda: rm.ca_manager.get_ca_certificate() is not None)]
+
+        def principal(name: str) -> str:
+            return add(f"principal:{name}", 'principal', name, [],
+                       lambda: rm.ensure_principal(name))
+
+        def keytab(name: str) -> str:
+            return add(f"keytab:{name}", 'keytab', name, [principal(name)],
+                       lambda: rm.create_keytab(name) is not None)
+
+        for mapping in mappings:
+            resource_type = mapping['resource_type']
+            name = mapping['actual_resource_name']
+
+            if resource_type == 'principal':
+                keytab(name)
+            elif resource_type in ('cert', 'key'):
+                # a cert and a key with the same CN are one certificate
+                add(f"cert:{name}", 'cert', name, ca(),
+                    lambda cn=name, algorithm=mapping.get('key_algorithm'):
+                        rm.create_certificate(cn, algorithm)[1] is not None)
+            elif resource_type == 'worker':
+                for index in range(1, self.worker_scale + 1):
+                    worker_name, principal_name = rm.worker_principal(f"{name}-{index}")
+                    add(f"koji_host:{worker_name}", 'koji_host', worker_name, [keytab(principal_name)],
+                        lambda w=worker_name, p=principal_name: rm.register_koji_host(w, p))
+            else:
+                logger.warning(f"Not provisioning unknown resource type {resource_type} for {name}")
+
+        return tasks
+
+    def run(self) -> Dict[str, int]:
+        """Provision every mapped resource, returning the number of tasks per final state"""
+        with self._run_lock:
+            start = time.perf_counter()
+            tasks = self.build_graph(self.db.get_all_mappings())
+            self.db.start_provisioning_run([
+                {'task': t.task, 'kind': t.kind, 'resource': t.resource, 'depends_on': t.depends_on}
+                for t in tasks.values()
+            ])
+            logger.info(f"Provisioning {len(tasks)} resource tasks with parallelism {self.parallelism}")
+
+            states = self._execute(tasks)
+
+            counts = {}
+            for state in states.values():
+                counts[state] = counts.get(state, 0) + 1
+            elapsed = time.perf_counter() - start
+            logger.info(f"Provisioning finished in {elapsed:.1f}s: {counts}")
+            return counts
+
+    def _execute(self, tasks: Dict[str, ProvisioningTask]) -> Dict[str, str]:
+        """Run tasks as their dependencies complete, returning each task's final state"""
+        states = {name: 'pending' for name in tasks}
+
+        def finish(name: str, state: str, error: str = None):
+            states[name] = state
+            self.db.update_provisioning_task(name, state, error)
+
+        with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='provision') as pool:
+            running = {}
+            while True:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name, task in tasks.items():
+                        if states[name] != 'pending':
+                            continue
+                        failed = [dep for dep in task.depends_on if states[dep] in ('failed', 'skipped')]
+                        if failed:
+                            finish(name, 'skipped', f"dependency {failed[0]} did not complete")
+                            progressed = True
+                        elif all(states[dep] == 'done' for dep in task.depends_on):
+                            states[name] = 'running'
+                            self.db.update_provisioning_task(name, 'running')
+                            running[pool.submit(task.action)] = name
+
+                if not running:
+                    break
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    name = running.pop(future)
+                    try:
+                        if future.result():
+                            finish(name, 'done')
+                        else:
+                            finish(name, 'failed', 'creation failed, see the orch log')
+                    except Exception as e:
+                        logger.error(f"Error provisioning {name}: {e}")
+                        finish(name, 'failed', str(e))
+
+        return states
+
+    def start(self) -> Optional[threading.Thread]:
+        """Run provisioning in a daemon thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+
+        def provision():
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Error in startup provisioning: {e}")
+            finally:
+                # workers open their own kadmin sessions
+                self.resource_manager.kadmin.close()
+
+        self._thread = threading.Thread(target=provision, name="provisioner", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def status(self) -> Dict:
+        """Progress of the latest provisioning run, as recorded in the database"""
+        tasks = self.db.get_provisioning_tasks()
+        counts = {}
+        for task in tasks:
+            counts[task['state']] = counts.get(task['state'], 0) + 1
+
+        if not tasks:
+            state = 'not_started'
+        elif counts.get('pending') or counts.get('running'):
+            state = 'running'
+        elif counts.get('failed') or counts.get('skipped'):
+            state = 'incomplete'
+        else:
+            state = 'complete'
+
+        return {
+            'state': state,
+            'total': len(tasks),
+            'counts': counts,
+            'tasks': tasks
+        }
+
+
+# The end.
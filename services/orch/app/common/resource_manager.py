@@ -5,22 +5,32 @@ Handles resource creation, mapping, and lifecycle management
 """
 
 import os
+import json
+import time
 import yaml
 import logging
+import threading
 import subprocess
-import tempfile
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import quote_plus as urlquote
 
-from .database import DatabaseManager
+from .storage import StorageBackend
+from .kadmin_pool import KadminPool
+from .principal_cache import PrincipalCache
+from .singleflight import Singleflight
+from .container_snapshot import ContainerSnapshot
+from .ca_certificate_manager import OPENSSL_KEY_ALGORITHMS
 
 logger = logging.getLogger("resource_manager")
 
 class ResourceManager:
     """Manages resource creation and lifecycle"""
 
-    def __init__(self, db_manager: DatabaseManager, ca_manager=None):
+    # manage-koji-host.sh's default host arch
+    KOJI_HOST_ARCH = 'x86_64'
+
+    def __init__(self, db_manager: StorageBackend, ca_manager=None):
         self.db = db_manager
         self.ca_manager = ca_manager
 
@@ -29,6 +39,12 @@ class ResourceManager:
         self.kdc_host = os.getenv('KDC_HOST', 'kdc.koji.box')
         self.kadmin_princ = os.getenv('KADMIN_PRINC', f'admin/admin@{self.krb5_realm}')
         self.kadmin_pass = os.getenv('KADMIN_PASS', 'admin_password')
+        self.kadmin = KadminPool(
+            self.kadmin_princ, self.kadmin_pass,
+            size=int(os.getenv('ORCH_KADMIN_POOL_SIZE', '2')),
+            max_age=float(os.getenv('ORCH_KADMIN_SESSION_MAX_AGE', '3600'))
+        )
+        self.principals = PrincipalCache(self.kadmin, float(os.getenv('ORCH_PRINCIPAL_CACHE_REFRESH', '300')))
 
         # Directory configuration
         self.keytabs_dir = Path('/mnt/data/keytabs')
@@ -36,6 +52,9 @@ class ResourceManager:
         self.keytabs_dir.mkdir(parents=True, exist_ok=True)
         self.certs_dir.mkdir(parents=True, exist_ok=True)
 
+        # one builder per resource across threads and gunicorn workers
+        self.singleflight = Singleflight(Path('/mnt/data/locks'))
+
         # Certificate configuration
         self.cert_country = os.getenv('CERT_COUNTRY', 'US')
         self.cert_state = os.getenv('CERT_STATE', 'NC')
@@ -43,47 +62,108 @@ class ResourceManager:
         self.cert_org = os.getenv('CERT_ORG', 'Koji')
         self.cert_org_unit = os.getenv('CERT_ORG_UNIT', 'Koji')
         self.cert_days = int(os.getenv('CERT_DAYS', '365'))
+        self.key_algorithm = os.getenv('ORCH_KEY_ALGORITHM', 'rsa2048')
 
-    def load_resource_mappings(self, mapping_file: str = "/app/resource_mapping.yaml") -> bool:
-        """Load resource mappings from generated YAML file"""
+    def read_resource_mappings(self, mapping_file: str = "/app/resource_mapping.yaml") -> Optional[Dict[str, Dict]]:
+        """Parse the generated YAML file into uuid -> mapping rows"""
         try:
             mapping_path = Path(mapping_file)
             if not mapping_path.exists():
                 logger.error(f"Resource mapping file not found: {mapping_file}")
-                return False
+                return None
 
             with open(mapping_path, 'r') as f:
                 mappings = yaml.safe_load(f)
 
-            loaded_count = 0
+            if not isinstance(mappings, dict):
+                # an empty or half-written file must not wipe every mapping
+                logger.error(f"Resource mapping file {mapping_file} does not contain a mapping")
+                return None
+
+            rows = {}
             for uuid, mapping in mappings.items():
-                if self.db.add_resource_mapping(
-                    uuid=uuid,
-                    resource_type=mapping['type'],
-                    actual_resource_name=mapping['resource'],
-                    description=mapping.get('description', '')
-                ):
-                    loaded_count += 1
-
-            logger.info(f"Loaded {loaded_count} resource mappings")
-            return True
+                key_algorithm = mapping.get('key_algorithm')
+                if key_algorithm is not None and (mapping['type'] not in ('cert', 'key')
+                                                  or key_algorithm not in OPENSSL_KEY_ALGORITHMS):
+                    logger.error(f"Ignoring key_algorithm {key_algorithm} of {mapping['type']} mapping {uuid}")
+                    key_algorithm = None
+                rows[str(uuid)] = {
+                    'resource_type': mapping['type'],
+                    'actual_resource_name': mapping['resource'],
+                    'description': mapping.get('description', ''),
+                    'key_algorithm': key_algorithm
+                }
+
+            # a cert and a key mapping with the same CN are one certificate,
+            # so they can't ask for different key algorithms
+            algorithms = {}
+            for uuid, row in rows.items():
+                if row['key_algorithm'] is not None:
+                    algorithms.setdefault(row['actual_resource_name'], {})[uuid] = row['key_algorithm']
+            for cn, chosen in algorithms.items():
+                if len(set(chosen.values())) > 1:
+                    logger.error(f"Resource mapping file {mapping_file} asks for conflicting key algorithms "
+                                 f"for {cn}: {chosen}")
+                    return None
+
+            return rows
         except Exception as e:
-            logger.error(f"Failed to load resource mappings: {e}")
-            return False
+            logger.error(f"Failed to read resource mappings from {mapping_file}: {e}")
+            return None
+
+    def sync_resource_mappings(self, mapping_file: str = "/app/resource_mapping.yaml") -> Optional[Dict[str, List[str]]]:
+        """
+        Apply the YAML file to the database as a single diff
+        Returns the added, changed and removed uuids, or None on failure
+        """
+        start = time.perf_counter()
+
+        mappings = self.read_resource_mappings(mapping_file)
+        if mappings is None:
+            return None
+
+        diff = self.db.sync_resource_mappings(mappings)
+        if diff is None:
+            return None
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Synced {len(mappings)} resource mappings in {elapsed_ms:.1f} ms: "
+                    f"{len(diff['added'])} added, {len(diff['changed'])} changed, "
+                    f"{len(diff['removed'])} removed")
+        return diff
+
+    def seed_principal_cache(self) -> Optional[threading.Thread]:
+        """
+        Load the principal cache with one listprincs in the background, so
+        an unreachable KDC doesn't hold up startup; until it lands every
+        lookup is a miss and goes to getprinc
+        """
+        if not self.principals.enabled:
+            logger.info("Principal cache disabled")
+            return None
+        return self.principals.start_refresh()
+
+    def load_resource_mappings(self, mapping_file: str = "/app/resource_mapping.yaml") -> bool:
+        """Load resource mappings from generated YAML file"""
+        return self.sync_resource_mappings(mapping_file) is not None
 
     def create_principal(self, principal_name: str) -> bool:
         """Create a Kerberos principal"""
         try:
-            cmd = [
-                'kadmin', '-p', f'{self.kadmin_princ}',
-                '-w', self.kadmin_pass,
-                '-q', f'addprinc -randkey {principal_name}'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                logger.error(f"Failed to create principal {principal_name}: {result.stderr}")
+            output = self.kadmin.execute(f'addprinc -randkey {principal_name}')
+            if output is None:
+                logger.error(f"Failed to create principal {principal_name}: kadmin unavailable")
+                return False
+            if 'already exists' in output:
+                # created by another worker since we looked
+                logger.info(f"Principal {principal_name} already exists")
+                self.principals.add(principal_name)
+                return True
+            if ' created.' not in output:
+                logger.error(f"Failed to create principal {principal_name}: {output.strip()}")
                 return False
             logger.info(f"Created principal {principal_name}")
+            self.principals.add(principal_name)
             return True
         except Exception as e:
             logger.error(f"Error creating principal {principal_name}: {e}")
@@ -92,15 +172,16 @@ class ResourceManager:
     def check_principal_exists(self, principal_name: str) -> bool:
         """Check if a principal exists in the KDC"""
         try:
-            cmd = [
-                'kadmin', '-p', f'{self.kadmin_princ}',
-                '-w', self.kadmin_pass,
-                '-q', f'getprinc {principal_name}'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.stderr and "Principal does not exist" in result.stderr:
+            if self.principals.exists(principal_name):
+                return True
+
+            output = self.kadmin.execute(f'getprinc {principal_name}')
+            if output is None or "Principal does not exist" in output:
+                return False
+            if 'Principal: ' not in output:
                 return False
-            return result.returncode == 0
+            self.principals.add(principal_name)
+            return True
         except Exception as e:
             logger.error(f"Error checking principal {principal_name}: {e}")
             return False
@@ -114,39 +195,64 @@ class ResourceManager:
                 logger.info(f"Keytab already exists: {keytab_path}")
                 return keytab_path
 
-            cmd = [
-                'kadmin', '-p', f'{self.kadmin_princ}',
-                '-w', self.kadmin_pass,
-                '-q', f'ktadd -k {keytab_path} {principal_name}'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode != 0:
-                logger.error(f"Failed to create keytab for {principal_name}: {result.stderr}")
+            return self.singleflight.do(f"keytab:{principal_name}",
+                                        lambda: self._create_keytab(principal_name, keytab_path))
+        except Exception as e:
+            logger.error(f"Error creating keytab for {principal_name}: {e}")
+            return None
+
+    def _create_keytab(self, principal_name: str, keytab_path: Path) -> Optional[Path]:
+        # another worker may have written it while we waited
+        if keytab_path.exists():
+            return keytab_path
+
+        # ktadd appends to an existing file, so write a fresh one and rename
+        # it into place; readers never see a partial keytab
+        tmp_path = keytab_path.with_name(f".{keytab_path.name}.{os.getpid()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            output = self.kadmin.execute(f'ktadd -k {tmp_path} {principal_name}')
+            if output and 'does not exist' in output:
+                # removed from the KDC behind the principal cache's back
+                self.principals.discard(principal_name)
+            if output is None or 'added to keytab' not in output:
+                logger.error(f"Failed to create keytab for {principal_name}: "
+                             f"{output.strip() if output else 'kadmin unavailable'}")
                 return None
 
-            keytab_path.chmod(0o644)
+            tmp_path.chmod(0o644)
+            os.replace(tmp_path, keytab_path)
             logger.info(f"Created keytab for {principal_name} at {keytab_path}")
             return keytab_path
-        except Exception as e:
-            logger.error(f"Error creating keytab for {principal_name}: {e}")
-            return None
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def ensure_principal(self, principal_name: str) -> bool:
+        """Create a principal unless it exists, once across concurrent callers"""
+        if self.principals.exists(principal_name):
+            return True
+        return self.singleflight.do(
+            f"principal:{principal_name}",
+            lambda: self.check_principal_exists(principal_name) or self.create_principal(principal_name)
+        )
 
-    def create_certificate(self, cn: str) -> Tuple[Optional[Path], Optional[Path]]:
-        """Create SSL certificate and private key"""
+    def create_certificate(self, cn: str, key_algorithm: str = None) -> Tuple[Optional[Path], Optional[Path]]:
+        """Create SSL certificate and private key, the key of the mapping's key_algorithm if it has one"""
         try:
             # If CA manager is available, use CA-signed certificates
             if self.ca_manager:
                 logger.info(f"Creating CA-signed certificate for {cn}")
-                return self.ca_manager.create_certificate_signed_by_ca(cn)
+                return self.ca_manager.create_certificate_signed_by_ca(cn, key_algorithm)
             else:
                 # Fallback to self-signed certificates for backward compatibility
                 logger.info(f"Creating self-signed certificate for {cn} (no CA manager)")
-                return self._create_self_signed_certificate(cn)
+                return self.singleflight.do(f"cert:{cn}",
+                                            lambda: self._create_self_signed_certificate(cn, key_algorithm))
         except Exception as e:
             logger.error(f"Error creating certificate for {cn}: {e}")
             return None, None
 
-    def _create_self_signed_certificate(self, cn: str) -> Tuple[Optional[Path], Optional[Path]]:
+    def _create_self_signed_certificate(self, cn: str, key_algorithm: str = None) -> Tuple[Optional[Path], Optional[Path]]:
         """Create self-signed SSL certificate and private key (fallback method)"""
         try:
             safe_cn = urlquote(cn)
@@ -159,7 +265,7 @@ class ResourceManager:
 
             cmd = [
                 'openssl', 'req', '-x509', '-nodes', '-days', str(self.cert_days),
-                '-newkey', 'rsa:2048',
+                '-newkey', *OPENSSL_KEY_ALGORITHMS[key_algorithm or self.key_algorithm],
                 '-keyout', str(key_path),
                 '-out', str(crt_path),
                 '-subj', f"/C={self.cert_country}/ST={self.cert_state}/L={self.cert_location}/O={self.cert_org}/OU={self.cert_org_unit}/CN={cn}"
@@ -196,6 +302,90 @@ class ResourceManager:
             logger.error(f"Error managing Koji host {worker_name}: {e}")
             return False
 
+    def register_koji_host(self, worker_name: str, full_principal_name: str, arch: str = None) -> bool:
+        """
+        Register a Koji host unless a current registration is on record,
+        once across concurrent callers
+        """
+        arch = arch or self.KOJI_HOST_ARCH
+        if self._koji_host_registered(worker_name, full_principal_name, arch):
+            return True
+        return self.singleflight.do(f"koji_host:{worker_name}",
+                                    lambda: self._register_koji_host(worker_name, full_principal_name, arch))
+
+    def _register_koji_host(self, worker_name: str, full_principal_name: str, arch: str) -> bool:
+        # another worker may have registered it while we waited
+        if self._koji_host_registered(worker_name, full_principal_name, arch):
+            return True
+        if not self.manage_koji_host(worker_name, full_principal_name, arch):
+            return False
+        self.db.record_koji_host(worker_name, full_principal_name, arch)
+        return True
+
+    def _koji_host_registered(self, worker_name: str, full_principal_name: str, arch: str) -> bool:
+        host = self.db.get_koji_host(worker_name)
+        return bool(host) and host['principal'] == full_principal_name and host['arch'] == arch
+
+    def verify_koji_host(self, full_principal_name: str) -> Optional[bool]:
+        """
+        Ask the hub whether a principal is registered as a Koji host
+        Returns None if the hub couldn't be asked
+        """
+        try:
+            cmd = ['koji', '--noauth', 'call', '--json-output', 'getUser', full_principal_name]
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            if result.returncode != 0:
+                logger.warning(f"Could not look up Koji host {full_principal_name}: {result.stderr.strip()}")
+                return None
+            user = json.loads(result.stdout)
+            # usertype 1 is a host, as manage-koji-host.sh expects
+            return isinstance(user, dict) and user.get('usertype') == 1
+        except Exception as e:
+            logger.warning(f"Error looking up Koji host {full_principal_name}: {e}")
+            return None
+
+    def reverify_koji_hosts(self) -> Dict[str, int]:
+        """
+        Re-check every recorded Koji host with the hub, least recently
+        verified first. Hosts the hub no longer knows are forgotten, so the
+        next checkout runs manage-koji-host.sh for them again.
+        """
+        counts = {'verified': 0, 'forgotten': 0, 'unknown': 0}
+        for host in self.db.get_koji_hosts():
+            registered = self.verify_koji_host(host['principal'])
+            if registered is None:
+                # hub unreachable; keep the records and try again next round
+                counts['unknown'] += 1
+                break
+            if registered:
+                self.db.mark_koji_host_verified(host['worker_name'])
+                counts['verified'] += 1
+            else:
+                logger.warning(f"Koji host {host['worker_name']} is no longer registered, forgetting it")
+                self.db.forget_koji_host(host['worker_name'])
+                counts['forgotten'] += 1
+        return counts
+
+    def start_koji_host_verification(self, interval: float) -> Optional[threading.Thread]:
+        """Start the periodic re-verification of recorded Koji host registrations"""
+        if interval <= 0:
+            logger.info("Koji host re-verification disabled")
+            return None
+
+        def verify():
+            while True:
+                time.sleep(interval)
+                try:
+                    counts = self.reverify_koji_hosts()
+                    if counts['forgotten'] or counts['unknown']:
+                        logger.info(f"Koji host re-verification: {counts}")
+                except Exception as e:
+                    logger.error(f"Error in Koji host re-verification: {e}")
+
+        thread = threading.Thread(target=verify, name="koji-host-verify", daemon=True)
+        thread.start()
+        return thread
+
     def determine_actual_resource_name(self, uuid: str, container, resource_mapping: Dict, container_client=None) -> str:
         """
         Determine the actual resource name for a given UUID and container.
@@ -203,7 +393,7 @@ class ResourceManager:
 
         Args:
             uuid: The resource UUID
-            container: The requesting container object
+            container: The requesting ContainerSnapshot (or podman container object)
             resource_mapping: The resource mapping dict from database
             container_client: Optional ContainerClient instance for scale index extraction
 
@@ -221,7 +411,9 @@ class ResourceManager:
                     return base_name
 
                 # Get scale index from container using container_client if available
-                if container_client:
+                if isinstance(container, ContainerSnapshot):
+                    scale_index = container.scale_index
+                elif container_client:
                     scale_index = container_client.get_scale_index(container)
                 else:
                     # Fallback to direct extraction if no container_client provided
@@ -273,7 +465,8 @@ class ResourceManager:
             logger.error(f"Error extracting scale index from container {getattr(container, 'id', 'unknown')}: {e}")
             return 0
 
-    def get_or_create_resource(self, resource_type: str, actual_resource_name: str) -> Optional[Path]:
+    def get_or_create_resource(self, resource_type: str, actual_resource_name: str,
+                               key_algorithm: str = None) -> Optional[Path]:
         """Get or create a resource based on type and name"""
         try:
             if resource_type == "principal":
@@ -281,9 +474,9 @@ class ResourceManager:
             elif resource_type == "worker":
                 return self._get_or_create_worker(actual_resource_name)
             elif resource_type == "cert":
-                return self._get_or_create_certificate(actual_resource_name)
+                return self._get_or_create_certificate(actual_resource_name, key_algorithm)
             elif resource_type == "key":
-                return self._get_or_create_private_key(actual_resource_name)
+                return self._get_or_create_private_key(actual_resource_name, key_algorithm)
             else:
                 logger.error(f"Unknown resource type: {resource_type}")
                 return None
@@ -294,25 +487,26 @@ class ResourceManager:
     def _get_or_create_principal(self, principal_name: str) -> Optional[Path]:
         """Get or create a principal keytab"""
         # Ensure principal exists
-        if not self.check_principal_exists(principal_name):
-            if not self.create_principal(principal_name):
-                return None
+        if not self.ensure_principal(principal_name):
+            return None
 
         # Create keytab
         return self.create_keytab(principal_name)
 
+    def worker_principal(self, worker_name: str) -> Tuple[str, str]:
+        """Koji host name and principal for a (scaled) worker resource name"""
+        if not worker_name.startswith('worker/'):
+            worker_name = f"worker/{worker_name}"
+        return worker_name, f"{worker_name}@{self.krb5_realm}"
+
     def _get_or_create_worker(self, worker_name: str, arch: str = None) -> Optional[Path]:
         """Get or create a worker keytab and register host"""
         # Handle scaled resources
-
-        if not worker_name.startswith('worker/'):
-            worker_name = f"worker/{worker_name}"
-        principal_name = f"{worker_name}@{self.krb5_realm}"
+        worker_name, principal_name = self.worker_principal(worker_name)
 
         # Ensure principal exists
-        if not self.check_principal_exists(principal_name):
-            if not self.create_principal(principal_name):
-                return None
+        if not self.ensure_principal(principal_name):
+            return None
 
         # Create keytab
         keytab_path = self.create_keytab(principal_name)
@@ -320,20 +514,20 @@ class ResourceManager:
             return None
 
         # Register as Koji host
-        if not self.manage_koji_host(worker_name, principal_name, arch):
+        if not self.register_koji_host(worker_name, principal_name, arch):
             logger.warning(f"Failed to register Koji host {worker_name}")
             return None
 
         return keytab_path
 
-    def _get_or_create_certificate(self, cn: str) -> Optional[Path]:
+    def _get_or_create_certificate(self, cn: str, key_algorithm: str = None) -> Optional[Path]:
         """Get or create an SSL certificate"""
-        key_path, crt_path = self.create_certificate(cn)
+        key_path, crt_path = self.create_certificate(cn, key_algorithm)
         return crt_path
 
-    def _get_or_create_private_key(self, cn: str) -> Optional[Path]:
+    def _get_or_create_private_key(self, cn: str, key_algorithm: str = None) -> Optional[Path]:
         """Get or create an SSL private key"""
-        key_path, crt_path = self.create_certificate(cn)
+        key_path, crt_path = self.create_certificate(cn, key_algorithm)
         return key_path
 
 
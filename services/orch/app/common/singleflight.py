@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Singleflight for the Orch service
+One builder per resource across threads and gunicorn workers
+"""
+
+import os
+import time
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+from urllib.parse import quote as urlquote
+
+logger = logging.getLogger("singleflight")
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Singleflight:
+    """
+    De-duplicates concurrent creation of the same resource. Within a process,
+    callers that arrive while a build is in flight wait for it and get its
+    result. Across processes, builders of one key serialize on an flock()ed
+    file in the lock directory, so the second one finds the files the first
+    one wrote; the build functions already return existing files without
+    rebuilding them.
+
+    flock() locks belong to the open file, so they are released when the
+    holder exits or crashes, and never leak to a forked child's work.
+    """
+
+    def __init__(self, lock_dir: Path = Path('/mnt/data/locks'), timeout: float = 300.0):
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {'builds': 0, 'shared': 0, 'waited': 0}
+
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """Drop the parent's in-flight calls; their builders didn't come along"""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, build: Callable[[], Any]) -> Any:
+        """Run build() for key unless a build of key is in flight here, then share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self.lock(key):
+                self._count('builds')
+                call.result = build()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    @contextmanager
+    def lock(self, key: str):
+        """Hold the cross-process lock for key"""
+        path = self.lock_dir / f"{urlquote(key, safe='')}.lock"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            self._acquire(fd, key)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _acquire(self, fd: int, key: str):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+
+        self._count('waited')
+        logger.info(f"Waiting for {key} being built by another worker")
+        deadline = time.monotonic() + self.timeout
+        delay = 0.01
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out after {self.timeout}s waiting for {key}")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.25)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict:
+        """Builds run here, callers that shared an in-process build, and waits on other workers"""
+        with self._lock:
+            return dict(self._stats)
+
+
+# The end.
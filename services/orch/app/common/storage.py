@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Storage backend interface for the Orch service
+Resource mappings and checkouts, independent of the database behind them
+"""
+
+import os
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, List, Tuple, Callable, Union
+from datetime import datetime
+
+logger = logging.getLogger("storage")
+
+class StorageBackend(ABC):
+    """
+    Everything the Orch service stores. DatabaseManager keeps it in a local
+    SQLite file; PostgresDatabaseManager keeps it in a shared PostgreSQL
+    database so several orch replicas can hand out the same resources.
+
+    Timestamps are returned as 'YYYY-MM-DD HH:MM:SS' UTC strings by every
+    backend, so API responses don't depend on the backend in use.
+
+    Each backend lists its schema as numbered MIGRATIONS; init_database
+    applies the ones missing from schema_migrations, in order, in one
+    transaction.
+    """
+
+    # (version, name, steps) - a step is an SQL statement or a callable taking a cursor
+    MIGRATIONS: List[Tuple[int, str, List[Union[str, Callable]]]] = []
+
+    # parameter placeholder of the backend's DB-API driver
+    PARAM = '?'
+
+    def _apply_migrations(self, cursor) -> List[int]:
+        """Apply pending migrations with an open cursor, inside the caller's transaction"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        newly_applied = []
+        for version, name, steps in sorted(self.MIGRATIONS, key=lambda migration: migration[0]):
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f"INSERT INTO schema_migrations (version, name) VALUES ({self.PARAM}, {self.PARAM})",
+                           (version, name))
+            logger.info(f"Applied schema migration {version}: {name}")
+            newly_applied.append(version)
+        return newly_applied
+
+    @property
+    def latest_schema_version(self) -> int:
+        """Latest migration version this code knows about"""
+        return max((migration[0] for migration in self.MIGRATIONS), default=0)
+
+    @abstractmethod
+    def init_database(self):
+        """Initialize database with required tables"""
+
+    @abstractmethod
+    def get_schema_version(self) -> Optional[int]:
+        """Get the latest applied migration version, or None if it can't be read"""
+
+    @abstractmethod
+    def close(self):
+        """Release the connection(s) held by this process"""
+
+    @abstractmethod
+    def add_resource_mapping(self, uuid: str, resource_type: str, actual_resource_name: str,
+                             description: str = None, key_algorithm: str = None) -> bool:
+        """Add a new resource mapping"""
+
+    @abstractmethod
+    def sync_resource_mappings(self, mappings: Dict[str, Dict]) -> Optional[Dict[str, List[str]]]:
+        """
+        Make resource_mappings match the given mappings in one transaction
+        Returns: {'added': [...], 'changed': [...], 'removed': [...]} uuids, or None on failure
+        """
+
+    @abstractmethod
+    def get_mappings_generation(self) -> Optional[int]:
+        """Get the current mappings generation, or None if it can't be read"""
+
+    @abstractmethod
+    def load_mappings_snapshot(self) -> Tuple[int, List[Dict]]:
+        """Read the mappings generation and every mapping consistently, raising on failure"""
+
+    @abstractmethod
+    def get_resource_mapping(self, uuid: str) -> Optional[Dict]:
+        """Get resource mapping by UUID"""
+
+    @abstractmethod
+    def get_all_mappings(self) -> List[Dict]:
+        """Get all resource mappings"""
+
+    @abstractmethod
+    def claim_resource(self, uuid: str, container_id: str, container_ip: str,
+                       resource_type: str, actual_resource_name: str, scale_index: int = None,
+                       takeover_from: str = None, lease_ttl: int = None) -> Tuple[bool, Optional[str], bool]:
+        """
+        Atomically claim a resource (uuid, actual_resource_name) for a container
+        Returns: (claimed, previous_owner, previous_lease_active)
+        """
+
+    def checkout_resource(self, uuid: str, container_id: str, container_ip: str,
+                          resource_type: str, actual_resource_name: str, scale_index: int = None) -> bool:
+        """Checkout a resource to a container using composite key (uuid, actual_resource_name)"""
+        claimed, _, _ = self.claim_resource(uuid, container_id, container_ip, resource_type,
+                                            actual_resource_name, scale_index)
+        return claimed
+
+    @abstractmethod
+    def release_resource(self, uuid: str, container_id: str) -> bool:
+        """Release a resource from a container using composite key"""
+
+    @abstractmethod
+    def get_resource_status(self, uuid: str, actual_resource_name: str = None) -> Optional[Dict]:
+        """Get current status of a resource, optionally for a specific actual_resource_name"""
+
+    @abstractmethod
+    def renew_lease(self, uuid: str, container_id: str, lease_ttl: int = None) -> Tuple[int, Optional[str]]:
+        """
+        Extend the lease on every resource with this UUID held by a container
+        Returns: (renewed_count, expires_at)
+        """
+
+    @abstractmethod
+    def expire_leases(self) -> int:
+        """Release every checkout whose lease has lapsed"""
+
+    @abstractmethod
+    def release_container(self, container_id: str) -> int:
+        """Release every resource checked out to a container"""
+
+    @abstractmethod
+    def cleanup_dead_containers(self, active_container_ids: List[str], checked_out_before: datetime = None,
+                                batch_size: int = 500) -> int:
+        """Clean up checkouts for containers that no longer exist"""
+
+    @abstractmethod
+    def start_provisioning_run(self, tasks: List[Dict]) -> bool:
+        """Replace the recorded provisioning tasks with a new run's, all pending"""
+
+    @abstractmethod
+    def update_provisioning_task(self, task: str, state: str, error: str = None) -> bool:
+        """Record a provisioning task moving to running, done, failed or skipped"""
+
+    @abstractmethod
+    def get_provisioning_tasks(self) -> List[Dict]:
+        """Get every task of the latest provisioning run"""
+
+    @abstractmethod
+    def record_koji_host(self, worker_name: str, principal: str, arch: str) -> bool:
+        """Record a successful Koji host registration"""
+
+    @abstractmethod
+    def get_koji_host(self, worker_name: str) -> Optional[Dict]:
+        """Get the recorded registration of a Koji host"""
+
+    @abstractmethod
+    def get_koji_hosts(self) -> List[Dict]:
+        """Get every recorded Koji host registration, least recently verified first"""
+
+    @abstractmethod
+    def mark_koji_host_verified(self, worker_name: str) -> bool:
+        """Note that a Koji host registration was just confirmed"""
+
+    @abstractmethod
+    def forget_koji_host(self, worker_name: str) -> bool:
+        """Drop a Koji host registration so the next checkout registers it again"""
+
+    @abstractmethod
+    def allocate_certificate_serial(self, floor: int = 0) -> Optional[int]:
+        """Atomically take the next certificate serial, no lower than floor, or None on failure"""
+
+    @abstractmethod
+    def record_certificate(self, serial: int, cn: str, fingerprint: str, key_algorithm: str,
+                           not_before: str, not_after: str) -> bool:
+        """Add an issued certificate to the ledger, superseding earlier certificates for its CN"""
+
+    @abstractmethod
+    def get_certificates(self, cn: str = None) -> List[Dict]:
+        """Get ledger entries, optionally for one CN, by serial"""
+
+
+def open_storage(database_url: str = None) -> StorageBackend:
+    """
+    Open the storage backend named by ORCH_DATABASE_URL
+    A postgresql:// URL selects PostgreSQL; a sqlite:/// URL or nothing at
+    all selects the local SQLite database.
+    """
+    if database_url is None:
+        database_url = os.getenv('ORCH_DATABASE_URL', '')
+
+    if database_url.startswith(('postgresql://', 'postgres://')):
+        # psycopg2 is only needed when PostgreSQL is actually configured
+        from .postgres_database import PostgresDatabaseManager
+        logger.info("Using PostgreSQL storage backend")
+        return PostgresDatabaseManager(database_url)
+
+    from .database import DatabaseManager
+    if database_url.startswith('sqlite:///'):
+        return DatabaseManager(database_url[len('sqlite:///'):])
+    if database_url:
+        raise ValueError(f"Unsupported ORCH_DATABASE_URL scheme: {database_url.split(':', 1)[0]}")
+    return DatabaseManager()
+
+
+# The end.
@@ -85,6 +85,7 @@ def get_ca_status():
             'ca_directory': str(ca_manager.ca_dir),
             'certificates_directory': str(ca_manager.certs_dir),
             'status': 'available' if ca_exists else 'not_created',
+            'key_pool': ca_manager.key_pool.stats() if ca_manager.key_pool else None,
             'checked_at': current_app.config.get('TIMESTAMP', None)
         })
 
@@ -92,4 +93,25 @@ def get_ca_status():
         logger.error(f"Unexpected error in get_ca_status: {e}")
         return ErrorHandler.handle_internal_error("Unexpected error during CA status check", e)
 
+@ca_bp.route('/certificates', methods=['GET'])
+def get_ca_certificates():
+    """List certificates issued by the CA - accessible without UUID or checkout"""
+    try:
+        # Validate request method
+        if request.method != 'GET':
+            return ErrorHandler.handle_validation_error('method', request.method, 'Only GET method allowed')
+
+        # Read the certificate ledger
+        certificates = current_app.db_manager.get_certificates(request.args.get('cn'))
+
+        return jsonify({
+            'certificates': certificates,
+            'count': len(certificates),
+            'checked_at': current_app.config.get('TIMESTAMP', None)
+        })
+
+    except Exception as e:
+        logger.error(f"Unexpected error in get_ca_certificates: {e}")
+        return ErrorHandler.handle_internal_error("Unexpected error during CA certificate listing", e)
+
 # The end.
@@ -70,7 +70,7 @@ def api_documentation():
                             'description': 'Resource released successfully'
                         },
                         '400': {
-                            'description': 'Validation error or resource not checked out to this container'
+                            'description': 'Validation error, resource not checked out to this container, or leases are disabled'
                         },
                         '404': {
                             'description': 'Resource not found'
@@ -84,6 +84,34 @@ def api_documentation():
                         'response': '{"message": "Resource released successfully"}'
                     }
                 },
+                'lease': {
+                    'method': 'POST',
+                    'path': '/api/v2/resource/<uuid>/lease',
+                    'description': 'Renew the lease on a resource checked out to the requesting container (leases are enabled with ORCH_LEASE_TTL)',
+                    'parameters': {
+                        'uuid': {
+                            'type': 'string',
+                            'format': 'uuid',
+                            'description': 'Resource UUID',
+                            'required': True
+                        }
+                    },
+                    'responses': {
+                        '200': {
+                            'description': 'Lease renewed, with the new expiry'
+                        },
+                        '400': {
+                            'description': 'Validation error, resource not checked out to this container, or leases are disabled'
+                        },
+                        '500': {
+                            'description': 'Internal server error'
+                        }
+                    },
+                    'example': {
+                        'request': 'POST /api/v2/resource/a1b2c3d4-e5f6-7890-abcd-ef1234567890/lease',
+                        'response': '{"message": "Lease renewed successfully", "expires_at": "2025-01-01 12:05:00", "lease_ttl": 300}'
+                    }
+                },
                 'status': {
                     'method': 'GET',
                     'path': '/api/v2/resource/<uuid>/status',
@@ -182,7 +210,7 @@ def api_documentation():
                     },
                     'example': {
                         'request': 'GET /api/v2/ca/info',
-                        'response': '{"ca_info": {"exists": true, "cert_path": "/mnt/data/ca/ca.crt", "cert_info": "..."}}'
+                        'response': '{"ca_info": {"exists": true, "cert_path": "/mnt/data/ca/ca.crt", "key_path": "/mnt/data/ca/ca.key", "subject": {"dn": "emailAddress=admin@koji.box,CN=koji-box-ca,...", "attributes": {"CN": "koji-box-ca", ...}}, "issuer": {...}, "serial": "5F3A...", "not_before": "2026-10-16 12:00:00", "not_after": "2036-10-14 12:00:00", "signature_algorithm": "sha256WithRSAEncryption", "public_key": {"algorithm": "RSA", "size": 2048}, "fingerprints": {"sha1": "...", "sha256": "..."}, "extensions": [{"oid": "2.5.29.19", "name": "basicConstraints", "critical": true, "value": {"ca": true, "path_length": null}}, ...]}}'
                     }
                 },
                 'status': {
@@ -202,6 +230,31 @@ def api_documentation():
                         'request': 'GET /api/v2/ca/status',
                         'response': '{"ca_exists": true, "status": "available", "ca_directory": "/mnt/data/ca"}'
                     }
+                },
+                'certificates': {
+                    'method': 'GET',
+                    'path': '/api/v2/ca/certificates',
+                    'description': 'List certificates issued by the CA, optionally for one CN - accessible without UUID or checkout',
+                    'authentication': 'None required - public endpoint',
+                    'parameters': {
+                        'cn': {
+                            'type': 'string',
+                            'description': 'Only certificates with this common name',
+                            'required': False
+                        }
+                    },
+                    'responses': {
+                        '200': {
+                            'description': 'Certificate ledger entries by serial'
+                        },
+                        '500': {
+                            'description': 'Internal server error'
+                        }
+                    },
+                    'example': {
+                        'request': 'GET /api/v2/ca/certificates?cn=hub.koji.box',
+                        'response': '{"certificates": [{"serial": 4096, "cn": "hub.koji.box", "fingerprint": "3f5a...", "key_algorithm": "ecdsa-p256", "not_before": "2026-10-16 12:00:00", "not_after": "2027-10-16 12:00:00", "status": "valid", "issued_at": "2026-10-16 12:00:00"}], "count": 1}'
+                    }
                 }
             },
             'status': {
@@ -211,13 +264,30 @@ def api_documentation():
                     'description': 'Health check endpoint',
                     'responses': {
                         '200': {
-                            'description': 'Service is healthy'
+                            'description': 'Service is healthy, including container identification counters'
                         },
                         '500': {
                             'description': 'Service is unhealthy'
                         }
                     }
                 },
+                'provisioning': {
+                    'method': 'GET',
+                    'path': '/api/v2/status/provisioning',
+                    'description': 'Progress of the startup provisioning of every mapped resource',
+                    'responses': {
+                        '200': {
+                            'description': 'Run state (not_started, running, complete or incomplete), task counts per state, and each task with its dependencies'
+                        },
+                        '500': {
+                            'description': 'Internal server error'
+                        }
+                    },
+                    'example': {
+                        'request': 'GET /api/v2/status/provisioning',
+                        'response': '{"state": "running", "total": 12, "counts": {"done": 9, "running": 2, "pending": 1}, "tasks": [{"task": "keytab:hub@KOJI.BOX", "kind": "keytab", "depends_on": ["principal:hub@KOJI.BOX"], "state": "done", ...}]}'
+                    }
+                },
                 'mappings': {
                     'method': 'GET',
                     'path': '/api/v2/status/mappings',
@@ -298,6 +368,16 @@ import requests
 
 response = requests.delete('http://orch-service:5000/api/v2/resource/a1b2c3d4-e5f6-7890-abcd-ef1234567890')
 print(response.json())
+'''
+            },
+            'renew_lease': {
+                'description': 'Renew a resource lease',
+                'curl': 'curl -X POST http://orch-service:5000/api/v2/resource/a1b2c3d4-e5f6-7890-abcd-ef1234567890/lease',
+                'python': '''
+import requests
+
+response = requests.post('http://orch-service:5000/api/v2/resource/a1b2c3d4-e5f6-7890-abcd-ef1234567890/lease')
+print(response.json())
 '''
             },
             'check_status': {
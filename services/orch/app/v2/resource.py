@@ -60,7 +60,7 @@ def checkout_resource(uuid):
                 return ErrorHandler.handle_internal_error(f"Checkout failed: {error_message}")
 
         # Get resource mapping for filename
-        mapping = current_app.db_manager.get_resource_mapping(uuid)
+        mapping = current_app.mapping_cache.get(uuid)
         if not mapping:
             return ErrorHandler.handle_resource_not_found('resource_mapping', uuid)
 
@@ -129,6 +129,62 @@ def release_resource(uuid):
         logger.error(f"Unexpected error in release_resource for {uuid}: {e}")
         return ErrorHandler.handle_internal_error("Unexpected error during resource release", e)
 
+@resource_bp.route('/<uuid>/lease', methods=['POST'])
+def renew_lease(uuid):
+    """Renew the lease on a resource checked out to the requesting container"""
+    try:
+        # Validate request method
+        valid, error_msg = RequestValidator.validate_request_method(request, ['POST'])
+        if not valid:
+            return ErrorHandler.handle_validation_error('method', request.method, error_msg)
+
+        # Validate UUID format
+        valid, error_msg = ResourceValidator.validate_uuid(uuid)
+        if not valid:
+            return ErrorHandler.handle_validation_error('uuid', uuid, error_msg)
+
+        # Validate request headers
+        valid, error_msg = RequestValidator.validate_request_headers(request)
+        if not valid:
+            return ErrorHandler.handle_validation_error('headers', 'remote_addr', error_msg)
+
+        # Get client IP for container identification
+        client_ip = request.remote_addr
+        if client_ip == '127.0.0.1':
+            client_ip = socket.gethostbyname(socket.gethostname())
+
+        # Validate IP address format
+        valid, error_msg = ResourceValidator.validate_ip_address(client_ip)
+        if not valid:
+            return ErrorHandler.handle_validation_error('client_ip', client_ip, error_msg)
+
+        # Get checkout manager
+        checkout_manager = current_app.checkout_manager
+
+        # Renew the lease
+        success, expires_at, error_message = checkout_manager.renew_lease(uuid, client_ip)
+
+        if not success:
+            if 'unable to identify' in error_message.lower():
+                return ErrorHandler.handle_container_error('identification', error_message)
+            elif 'not checked out' in error_message.lower():
+                return ErrorHandler.handle_validation_error('resource', uuid, "Resource not checked out to this container")
+            elif 'leases are disabled' in error_message.lower():
+                return ErrorHandler.handle_validation_error('lease', uuid, error_message)
+            else:
+                return ErrorHandler.handle_internal_error(f"Lease renewal failed: {error_message}")
+
+        return jsonify({
+            'message': 'Lease renewed successfully',
+            'uuid': uuid,
+            'expires_at': expires_at,
+            'lease_ttl': checkout_manager.lease_ttl
+        })
+
+    except Exception as e:
+        logger.error(f"Unexpected error in renew_lease for {uuid}: {e}")
+        return ErrorHandler.handle_internal_error("Unexpected error during lease renewal", e)
+
 @resource_bp.route('/<uuid>/status', methods=['GET'])
 def get_resource_status(uuid):
     """Get status of a resource by UUID"""
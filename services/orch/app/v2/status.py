@@ -37,18 +37,17 @@ def health_check():
         container_client = current_app.container_client
         is_connected = container_client.is_connected()
 
-        # Clean up dead containers
-        checkout_manager = current_app.checkout_manager
-        cleaned = checkout_manager.cleanup_dead_containers()
-
         return jsonify({
             'status': 'healthy',
             'service': 'orch-service',
             'version': '2.0.0',
             'database': 'connected',
+            'schema_version': db_manager.get_schema_version(),
             'container_client': 'connected' if is_connected else 'disconnected',
-            'mappings_loaded': len(mappings),
-            'containers_cleaned': cleaned
+            'container_identification': container_client.get_identification_stats(),
+            'kadmin': current_app.resource_manager.kadmin.stats(),
+            'principal_cache': current_app.resource_manager.principals.stats(),
+            'mappings_loaded': len(mappings)
         })
 
     except Exception as e:
@@ -59,12 +58,21 @@ def health_check():
             'error': str(e)
         }), 500
 
+@status_bp.route('/provisioning')
+def get_provisioning_status():
+    """Get progress of the startup provisioning run"""
+    try:
+        return jsonify(current_app.provisioner.status())
+
+    except Exception as e:
+        logger.error(f"Error in get_provisioning_status: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @status_bp.route('/mappings')
 def get_all_mappings():
     """Get all resource mappings"""
     try:
-        db_manager = current_app.db_manager
-        mappings = db_manager.get_all_mappings()
+        mappings = current_app.mapping_cache.get_all()
         return jsonify({'mappings': mappings})
 
     except Exception as e:
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Gunicorn configuration for the Orch service
+The app is built once in the master and forked into the workers
+"""
+
+import os
+
+# the master only forks the workers, so leave the background threads to them
+os.environ['ORCH_POST_FORK_SERVICES'] = 'true'
+
+bind = '0.0.0.0:5000'
+workers = 4
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Threads don't survive the fork; start each worker's own background threads"""
+    from app import start_shared_services, start_worker_services
+    app = worker.app.wsgi()
+    start_shared_services(app)
+    start_worker_services(app)
+
+
+# The end.
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Orch service CACertificateManager
+Compares certificate issuance throughput across key algorithms
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.ca_certificate_manager import CACertificateManager, OPENSSL_KEY_ALGORITHMS
+
+ALGORITHMS = list(OPENSSL_KEY_ALGORITHMS)
+
+
+def bench(name: str, ca: CACertificateManager, algorithm: str, iterations: int) -> float:
+    """Issue certificates for new CNs and print the throughput"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        key_path, crt_path = ca.create_certificate_signed_by_ca(f"{name}-{algorithm}-{i}.koji.box", algorithm)
+        assert crt_path is not None, f"issuing a {algorithm} certificate failed"
+    elapsed = time.perf_counter() - start
+    per_second = iterations / elapsed
+    print(f"  {algorithm:<12} {elapsed / iterations * 1000:10.2f} ms/cert {per_second:10.1f} certs/s")
+    return per_second
+
+
+def main():
+    # per-certificate INFO logging would dominate the timings
+    logging.disable(logging.INFO)
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the pool refills in the background, so measure generation inline
+        os.environ['ORCH_KEY_POOL_SIZE'] = '0'
+        ca = CACertificateManager(Path(tmp) / 'native')
+        ca.get_ca_certificate()
+
+        if ca.issuer:
+            print(f"In-process issuance, key generated per certificate ({iterations} certificates each)")
+            for algorithm in ALGORITHMS:
+                bench('native', ca, algorithm, iterations)
+
+            os.environ['ORCH_KEY_POOL_SIZE'] = str(iterations)
+            os.environ['ORCH_KEY_POOL_ALGORITHMS'] = ','.join(ALGORITHMS)
+            pooled = CACertificateManager(Path(tmp) / 'pooled')
+            pooled.get_ca_certificate()
+            pooled.key_pool.fill()
+            # no refilling while measuring
+            pooled.key_pool.start = lambda: None
+            print(f"In-process issuance, key taken from a full pool ({iterations} certificates each)")
+            for algorithm in ALGORITHMS:
+                bench('pooled', pooled, algorithm, iterations)
+
+        openssl_iterations = max(1, iterations // 5)
+        ca.issuer = None
+        print(f"openssl CLI issuance ({openssl_iterations} certificates each)")
+        for algorithm in ALGORITHMS:
+            bench('openssl', ca, algorithm, openssl_iterations)
+
+
+if __name__ == "__main__":
+    main()
+
+# The end.
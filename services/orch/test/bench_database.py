@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Orch service DatabaseManager
+Compares per-operation latency against a connection-per-operation baseline
+"""
+
+import sys
+import time
+import logging
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.database import DatabaseManager
+
+UUID = '00000000-0000-0000-0000-000000000001'
+
+
+def bench(name: str, operation: Callable[[int], None], iterations: int) -> float:
+    """Run an operation repeatedly and print the mean latency in microseconds"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        operation(i)
+    mean_us = (time.perf_counter() - start) / iterations * 1e6
+    print(f"  {name:<40} {mean_us:10.1f} us/op")
+    return mean_us
+
+
+def baseline_get_mapping(db_path: Path, uuid: str):
+    """The pre-pooling access pattern: a fresh connection per call"""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT uuid, resource_type, actual_resource_name, description
+            FROM resource_mappings WHERE uuid = ?
+        """, (uuid,))
+        return cursor.fetchone()
+
+
+def baseline_checkout_release(db_path: Path, i: int):
+    """The pre-pooling checkout and release: two connections, rollback journal"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            INSERT INTO resource_checkouts
+            (uuid, actual_resource_name, container_id, container_ip, resource_type)
+            VALUES (?, ?, ?, ?, ?)
+        """, (UUID, f"res-{i}", f"container-{i}", '172.20.0.2', 'principal'))
+        conn.commit()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            DELETE FROM resource_checkouts WHERE uuid = ? AND container_id = ?
+        """, (UUID, f"container-{i}"))
+        conn.commit()
+
+
+def baseline_cleanup(db_path: Path, active_container_ids):
+    """The pre-set-based cleanup: one NOT IN placeholder per live container"""
+    with sqlite3.connect(db_path) as conn:
+        placeholders = ','.join('?' * len(active_container_ids))
+        cursor = conn.execute(f"""
+            DELETE FROM resource_checkouts
+            WHERE container_id NOT IN ({placeholders})
+        """, active_container_ids)
+        conn.commit()
+        return cursor.rowcount
+
+
+def temp_table_cleanup(db_path: Path, active_container_ids):
+    """The live containers loaded into an indexed temp table and anti-joined"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            CREATE TEMP TABLE live_containers (container_id TEXT PRIMARY KEY) WITHOUT ROWID
+        """)
+        conn.executemany("INSERT OR IGNORE INTO live_containers VALUES (?)",
+                         [(container_id,) for container_id in active_container_ids])
+        cursor = conn.execute("""
+            DELETE FROM resource_checkouts
+            WHERE container_id NOT IN (SELECT container_id FROM live_containers)
+        """)
+        conn.commit()
+        return cursor.rowcount
+
+
+def seed_checkouts(db_path: Path, checkouts: int, containers: int):
+    """Fill resource_checkouts with checkouts spread over containers"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM resource_checkouts")
+        conn.executemany("""
+            INSERT INTO resource_checkouts
+            (uuid, actual_resource_name, container_id, container_ip, resource_type)
+            VALUES (?, ?, ?, '172.20.0.2', 'principal')
+        """, [(UUID, f"res-{n}", f"container-{n % containers}") for n in range(checkouts)])
+        conn.commit()
+
+
+def bench_cleanup(name: str, db_path: Path, cleanup: Callable[[], int], checkouts: int, containers: int):
+    """Time one cleanup pass over freshly seeded checkouts"""
+    seed_checkouts(db_path, checkouts, containers)
+    start = time.perf_counter()
+    try:
+        cleaned = cleanup()
+        result = f"{cleaned} cleaned"
+    except sqlite3.Error as e:
+        result = f"failed: {e}"
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"  {name:<40} {elapsed_ms:10.1f} ms  ({result})")
+
+
+def main():
+    # per-operation INFO logging would dominate the timings
+    logging.disable(logging.INFO)
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    mapping_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # baseline runs against a default rollback-journal database
+        baseline_path = Path(tmp) / 'baseline.db'
+        DatabaseManager(baseline_path).close()
+        with sqlite3.connect(baseline_path) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("""
+                INSERT INTO resource_mappings (uuid, resource_type, actual_resource_name)
+                VALUES (?, 'principal', 'bench@KOJI.BOX')
+            """, (UUID,))
+
+        db = DatabaseManager(Path(tmp) / 'pooled.db')
+        db.add_resource_mapping(UUID, 'principal', 'bench@KOJI.BOX')
+
+        print(f"DatabaseManager benchmark ({iterations} iterations)")
+
+        print("get_resource_mapping")
+        before = bench("connection per operation", lambda i: baseline_get_mapping(baseline_path, UUID), iterations)
+        after = bench("persistent WAL connection", lambda i: db.get_resource_mapping(UUID), iterations)
+        print(f"  speedup: {before / after:.1f}x")
+
+        print("checkout_resource + release_resource")
+        before = bench("connection per operation", lambda i: baseline_checkout_release(baseline_path, i), iterations)
+
+        def pooled_checkout_release(i):
+            db.checkout_resource(UUID, f"container-{i}", '172.20.0.2', 'principal', f"res-{i}")
+            db.release_resource(UUID, f"container-{i}")
+
+        after = bench("persistent WAL connection", pooled_checkout_release, iterations)
+        print(f"  speedup: {before / after:.1f}x")
+
+        print(f"load {mapping_count} resource mappings")
+        mappings = {
+            f"00000000-0000-0000-0001-{n:012d}": {
+                'resource_type': 'principal',
+                'actual_resource_name': f"bench-{n}@KOJI.BOX",
+                'description': ''
+            }
+            for n in range(mapping_count)
+        }
+
+        def per_row_load(i):
+            for uuid, mapping in mappings.items():
+                db.add_resource_mapping(uuid, mapping['resource_type'],
+                                        mapping['actual_resource_name'], mapping['description'])
+
+        before = bench("add_resource_mapping per row", per_row_load, 5)
+
+        bulk_db = DatabaseManager(Path(tmp) / 'bulk.db')
+        bench("sync_resource_mappings (initial)", lambda i: bulk_db.sync_resource_mappings(mappings), 1)
+        after = bench("sync_resource_mappings (unchanged)", lambda i: bulk_db.sync_resource_mappings(mappings), 5)
+        print(f"  speedup: {before / after:.1f}x")
+
+        bulk_db.close()
+
+        checkouts = 10000
+        containers = checkouts // 2
+        cleanup_path = Path(tmp) / 'cleanup.db'
+        cleanup_db = DatabaseManager(cleanup_path)
+        cleanup_db.add_resource_mapping(UUID, 'principal', 'bench@KOJI.BOX')
+
+        for live in (containers // 2, 0, 40000):
+            live_ids = [f"container-{n}" for n in range(live)]
+            print(f"cleanup_dead_containers ({checkouts} checkouts, {containers} owners, {live} live containers)")
+            bench_cleanup("NOT IN placeholder list", cleanup_path,
+                          lambda: baseline_cleanup(cleanup_path, live_ids), checkouts, containers)
+            bench_cleanup("temp table anti-join", cleanup_path,
+                          lambda: temp_table_cleanup(cleanup_path, live_ids), checkouts, containers)
+            bench_cleanup("distinct owners, batched", cleanup_path,
+                          lambda: cleanup_db.cleanup_dead_containers(live_ids), checkouts, containers)
+
+        cleanup_db.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
+
+# The end.
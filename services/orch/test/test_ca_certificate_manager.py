@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+CA certificate manager tests for the Orch service
+Issues certificates in-process and checks them against the openssl CA profile,
+and exercises the openssl CLI fallback used when cryptography is missing
+"""
+
+import sys
+import json
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common import ca_certificate_manager
+from app.common.database import DatabaseManager
+from app.common.ca_certificate_manager import CACertificateManager
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    from app.common.cert_issuer import CertificateIssuer
+except ImportError:
+    # only the openssl fallback tests can run
+    x509 = hashes = serialization = ec = ed25519 = rsa = CertificateIssuer = None
+
+needs_openssl = pytest.mark.skipif(shutil.which('openssl') is None, reason="openssl is not installed")
+
+
+@pytest.fixture
+def ca(tmp_path):
+    pytest.importorskip('cryptography')
+    manager = CACertificateManager(tmp_path)
+    assert manager.get_ca_certificate() == manager.ca_cert_path
+    return manager
+
+
+@pytest.fixture
+def ledger_ca(tmp_path):
+    pytest.importorskip('cryptography')
+    db = DatabaseManager(str(tmp_path / 'orch.db'))
+    manager = CACertificateManager(tmp_path, db)
+    assert manager.get_ca_certificate() == manager.ca_cert_path
+    yield manager
+    db.close()
+
+
+@pytest.fixture
+def openssl_ca(tmp_path, monkeypatch):
+    """A CA manager built as if cryptography were not installed"""
+    if shutil.which('openssl') is None:
+        pytest.skip("openssl is not installed")
+    monkeypatch.setattr(ca_certificate_manager, 'CertificateIssuer', None)
+    db = DatabaseManager(str(tmp_path / 'orch.db'))
+    manager = CACertificateManager(tmp_path, db)
+    assert manager.issuer is None and manager.key_pool is None
+    assert manager.get_ca_certificate() == manager.ca_cert_path
+    yield manager
+    db.close()
+
+
+def _openssl(*args: str) -> str:
+    result = subprocess.run(['openssl', *args], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def _extensions(cert: "x509.Certificate"):
+    return {ext.oid.dotted_string: (ext.critical, ext.value) for ext in cert.extensions}
+
+
+def _load(path: Path) -> "x509.Certificate":
+    return x509.load_pem_x509_certificate(path.read_bytes())
+
+
+def test_ca_certificate(ca):
+    cert = _load(ca.ca_cert_path)
+    assert cert.subject == cert.issuer
+    assert cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value == 'koji-box-ca'
+    assert cert.extensions.get_extension_for_class(x509.BasicConstraints).value.ca
+    assert ca.ca_key_path.stat().st_mode & 0o777 == 0o600
+
+
+@needs_openssl
+def test_issued_certificate_verifies(ca):
+    key_path, crt_path = ca.create_certificate_signed_by_ca('hub.koji.box')
+    assert key_path.exists() and crt_path.exists()
+
+    result = subprocess.run(['openssl', 'verify', '-CAfile', str(ca.ca_cert_path), str(crt_path)],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    # the key and certificate belong together
+    key_pub = subprocess.run(['openssl', 'pkey', '-in', str(key_path), '-pubout'],
+                             capture_output=True, text=True).stdout
+    crt_pub = subprocess.run(['openssl', 'x509', '-in', str(crt_path), '-pubkey', '-noout'],
+                             capture_output=True, text=True).stdout
+    assert key_pub and key_pub == crt_pub
+
+    # the openssl CA database is kept up to date
+    cert = _load(crt_path)
+    assert cert.serial_number == 0x1000
+    assert (ca.ca_dir / 'serial').read_text() == '1001\n'
+    index = (ca.ca_dir / 'index.txt').read_text().split('\t')
+    assert index[0] == 'V' and index[3] == '1000'
+    assert index[5] == '/C=US/ST=NC/O=Koji Box/OU=Certificate Authority/CN=hub.koji.box\n'
+    assert (ca.ca_dir / '1000.pem').read_bytes() == crt_path.read_bytes()
+
+
+@needs_openssl
+def test_matches_openssl_profile(ca, monkeypatch):
+    _, native_path = ca.create_certificate_signed_by_ca('hub.koji.box', 'rsa2048')
+    monkeypatch.setattr(ca, 'issuer', None)
+    _, openssl_path = ca.create_certificate_signed_by_ca('web.koji.box', 'rsa2048')
+
+    native, openssl = _load(native_path), _load(openssl_path)
+    assert openssl.serial_number == native.serial_number + 1
+    assert native.subject.rfc4514_string().replace('hub', 'web') == openssl.subject.rfc4514_string()
+
+    native_ext, openssl_ext = _extensions(native), _extensions(openssl)
+    assert native_ext.keys() == openssl_ext.keys()
+    for oid in native_ext:
+        if oid != x509.ExtensionOID.SUBJECT_KEY_IDENTIFIER.dotted_string:
+            assert native_ext[oid] == openssl_ext[oid], oid
+
+
+@pytest.mark.parametrize('algorithm, key_type, key_encipherment', [
+    ('ecdsa-p256', lambda: ec.EllipticCurvePrivateKey, False),
+    ('ed25519', lambda: ed25519.Ed25519PrivateKey, False),
+    ('rsa3072', lambda: rsa.RSAPrivateKey, True),
+])
+def test_mixed_key_algorithms(ca, algorithm, key_type, key_encipherment):
+    key_type = key_type()
+    key_path, crt_path = ca.create_certificate_signed_by_ca('hub.koji.box', algorithm)
+    key = serialization.load_pem_private_key(key_path.read_bytes(), password=None)
+    assert isinstance(key, key_type)
+
+    cert = _load(crt_path)
+    assert cert.public_key() == key.public_key()
+    cert.verify_directly_issued_by(_load(ca.ca_cert_path))
+    assert cert.extensions.get_extension_for_class(x509.KeyUsage).value.key_encipherment == key_encipherment
+
+
+def test_unknown_key_algorithm(ca):
+    assert ca.create_certificate_signed_by_ca('hub.koji.box', 'dsa1024') == (None, None)
+
+
+def test_concurrent_issuance_gets_distinct_serials(ca):
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(
+        ca.create_certificate_signed_by_ca(f"builder-{n}.koji.box"))) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    serials = {_load(crt).serial_number for _, crt in results}
+    assert len(serials) == 8
+    assert len((ca.ca_dir / 'index.txt').read_text().splitlines()) == 8
+
+
+def test_ledger_records_issuance(ledger_ca):
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(
+        ledger_ca.create_certificate_signed_by_ca(f"builder-{n}.koji.box"))) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    certs = {_load(crt).serial_number: _load(crt) for _, crt in results}
+    assert sorted(certs) == list(range(0x1000, 0x1008))
+
+    ledger = ledger_ca.db_manager.get_certificates()
+    assert [entry['serial'] for entry in ledger] == sorted(certs)
+    for entry in ledger:
+        cert = certs[entry['serial']]
+        assert entry['cn'] == cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
+        assert entry['fingerprint'] == cert.fingerprint(hashes.SHA256()).hex()
+        assert entry['key_algorithm'] == 'rsa2048' and entry['status'] == 'valid'
+        assert entry['not_after'] == cert.not_valid_after_utc.strftime('%Y-%m-%d %H:%M:%S')
+
+    # the openssl CA database is left alone
+    assert (ledger_ca.ca_dir / 'index.txt').read_text() == ''
+    assert (ledger_ca.ca_dir / 'serial').read_text() == '1000\n'
+
+
+def test_mismatched_key_algorithm_is_reissued(ledger_ca):
+    key_path, crt_path = ledger_ca.create_certificate_signed_by_ca('hub.koji.box')
+    first = _load(crt_path)
+    assert isinstance(first.public_key(), rsa.RSAPublicKey)
+
+    # without an explicit algorithm the existing certificate stands
+    assert ledger_ca.create_certificate_signed_by_ca('hub.koji.box', 'rsa2048') == (key_path, crt_path)
+    assert _load(crt_path).serial_number == first.serial_number
+
+    # a mapping asking for another algorithm gets a new certificate
+    assert ledger_ca.create_certificate_signed_by_ca('hub.koji.box', 'ed25519') == (key_path, crt_path)
+    second = _load(crt_path)
+    assert isinstance(second.public_key(), ed25519.Ed25519PublicKey)
+    assert second.serial_number == first.serial_number + 1
+    assert ledger_ca.create_certificate_signed_by_ca('hub.koji.box') == (key_path, crt_path)
+    assert _load(crt_path).serial_number == second.serial_number
+
+    ledger = ledger_ca.db_manager.get_certificates('hub.koji.box')
+    assert [(entry['key_algorithm'], entry['status']) for entry in ledger] == \
+        [('rsa2048', 'superseded'), ('ed25519', 'valid')]
+
+
+def test_ledger_continues_from_serial_file(tmp_path):
+    pytest.importorskip('cryptography')
+    ca = CACertificateManager(tmp_path)
+    ca.get_ca_certificate()
+    ca.create_certificate_signed_by_ca('hub.koji.box')
+
+    db = DatabaseManager(str(tmp_path / 'orch.db'))
+    try:
+        ledger_ca = CACertificateManager(tmp_path, db)
+        _, crt_path = ledger_ca.create_certificate_signed_by_ca('web.koji.box')
+        assert _load(crt_path).serial_number == 0x1001
+    finally:
+        db.close()
+
+
+def test_unrecorded_certificate_is_not_published(ledger_ca, monkeypatch):
+    monkeypatch.setattr(ledger_ca.db_manager, 'record_certificate', lambda *args: False)
+    assert ledger_ca.create_certificate_signed_by_ca('hub.koji.box') == (None, None)
+    assert list(ledger_ca.certs_dir.iterdir()) == []
+
+
+@needs_openssl
+def test_ledger_records_openssl_issuance(ledger_ca, monkeypatch):
+    _, native_path = ledger_ca.create_certificate_signed_by_ca('hub.koji.box')
+    monkeypatch.setattr(ledger_ca, 'issuer', None)
+    _, openssl_path = ledger_ca.create_certificate_signed_by_ca('web.koji.box', 'rsa2048')
+
+    openssl = _load(openssl_path)
+    assert openssl.serial_number == _load(native_path).serial_number + 1
+    entry = ledger_ca.db_manager.get_certificates('web.koji.box')[0]
+    assert entry['serial'] == openssl.serial_number
+    assert entry['fingerprint'] == openssl.fingerprint(hashes.SHA256()).hex()
+    assert entry['not_before'] == openssl.not_valid_before_utc.strftime('%Y-%m-%d %H:%M:%S')
+    assert entry['key_algorithm'] == 'rsa2048'
+
+
+def test_ca_info(ca, monkeypatch):
+    monkeypatch.setattr(subprocess, 'run', None)  # no openssl
+    info = ca.get_ca_info()
+    cert = _load(ca.ca_cert_path)
+
+    assert info['exists'] and info['cert_path'] == str(ca.ca_cert_path)
+    assert info['subject']['attributes']['CN'] == 'koji-box-ca'
+    assert info['subject']['attributes']['emailAddress'] == 'admin@koji.box'
+    assert info['issuer'] == info['subject']
+    assert info['serial'] == f"{cert.serial_number:X}"
+    assert info['not_after'] == cert.not_valid_after_utc.strftime('%Y-%m-%d %H:%M:%S')
+    assert info['fingerprints']['sha256'] == cert.fingerprint(hashes.SHA256()).hex()
+    assert info['public_key'] == {'algorithm': 'RSA', 'size': 2048}
+
+    extensions = {ext['name']: ext for ext in info['extensions']}
+    assert extensions['basicConstraints']['critical']
+    assert extensions['basicConstraints']['value'] == {'ca': True, 'path_length': None}
+    assert extensions['keyUsage']['value'] == ['digital_signature', 'key_cert_sign', 'crl_sign']
+    assert extensions['subjectKeyIdentifier']['value'] == \
+        extensions['authorityKeyIdentifier']['value']['key_identifier']
+    json.dumps(info)
+
+
+def test_ca_info_is_cached_until_replaced(ca, monkeypatch):
+    first = ca.get_ca_info()
+    describe = CertificateIssuer.describe
+    calls = []
+    monkeypatch.setattr(CertificateIssuer, 'describe', lambda cert: calls.append(cert) or describe(cert))
+    second = ca.get_ca_info()
+    assert second == first and second is not first and calls == []
+
+    # annotating a result doesn't leak into later ones
+    second['annotated'] = True
+    second['subject']['attributes']['CN'] = 'changed'
+    assert ca.get_ca_info() == first
+
+    ca.ca_cert_path.unlink()
+    ca.ca_key_path.unlink()
+    assert ca.get_ca_info() == {'exists': False}
+    ca.get_ca_certificate()
+    assert ca.get_ca_info()['serial'] == f"{_load(ca.ca_cert_path).serial_number:X}" != first['serial']
+    assert len(calls) == 1
+
+
+def test_ca_is_reloaded_when_replaced(ca):
+    ca.create_certificate_signed_by_ca('hub.koji.box')
+    first = ca.issuer.load_ca()[1]
+
+    ca.ca_cert_path.unlink()
+    ca.ca_key_path.unlink()
+    ca.get_ca_certificate()
+    _, crt_path = ca.create_certificate_signed_by_ca('web.koji.box')
+
+    assert ca.issuer.load_ca()[1] != first
+    assert _load(crt_path).issuer == ca.issuer.load_ca()[1].subject
+
+
+def test_openssl_fallback_issues_certificates(openssl_ca):
+    key_path, crt_path = openssl_ca.create_certificate_signed_by_ca('hub.koji.box', 'rsa2048')
+    assert key_path.exists() and crt_path.exists()
+    _openssl('verify', '-CAfile', str(openssl_ca.ca_cert_path), str(crt_path))
+
+    key_pub = _openssl('pkey', '-in', str(key_path), '-pubout')
+    assert key_pub == _openssl('x509', '-in', str(crt_path), '-pubkey', '-noout')
+
+    entry = openssl_ca.db_manager.get_certificates('hub.koji.box')[0]
+    serial = _openssl('x509', '-in', str(crt_path), '-noout', '-serial').strip().split('=', 1)[1]
+    assert entry['serial'] == int(serial, 16) == 0x1000
+    assert entry['key_algorithm'] == 'rsa2048'
+
+
+def test_openssl_fallback_ca_info(openssl_ca):
+    info = openssl_ca.get_ca_info()
+    assert info['exists'] and info['cert_path'] == str(openssl_ca.ca_cert_path)
+    assert 'CN = koji-box-ca' in info['cert_info'] or 'CN=koji-box-ca' in info['cert_info']
+
+
+# The end.
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Checkout manager tests for the Orch service
+Runs checkouts against SQLite with a stand-in container client
+"""
+
+import sys
+from types import SimpleNamespace
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.database import DatabaseManager
+from app.common.checkout_manager import CheckoutManager
+from app.common.container_snapshot import ContainerSnapshot
+from app.common.liveness_cache import LivenessCache
+
+UUID = '00000000-0000-0000-0000-000000000001'
+
+
+class FakeIndex:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def emit(self, action, container_id):
+        for callback in self.listeners:
+            callback(action, container_id)
+
+
+class FakeContainerClient:
+    """Stands in for ContainerClient with a fixed IP to container table"""
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.index = FakeIndex()
+        self.liveness = None
+
+    def get_container_by_ip(self, request_ip):
+        return self.containers.get(request_ip)
+
+    def is_container_running(self, container_id):
+        if self.liveness is not None:
+            return self.liveness.is_running(container_id)
+        return any(snapshot.id == container_id for snapshot in self.containers.values())
+
+
+class FakeContainersAPI:
+    """The podman containers API over the same table, for a real LivenessCache"""
+
+    def __init__(self, containers):
+        self.containers = containers
+
+    def list(self, all=False):
+        return [SimpleNamespace(id=snapshot.id, attrs={'State': {'Status': snapshot.status}})
+                for snapshot in self.containers.values()]
+
+    def get(self, container_id):
+        for snapshot in self.containers.values():
+            if snapshot.id == container_id:
+                return SimpleNamespace(id=snapshot.id, status=snapshot.status)
+        raise KeyError(f"no such container: {container_id}")
+
+
+class FakeResourceManager:
+    def determine_actual_resource_name(self, uuid, container, resource_mapping, container_client):
+        return resource_mapping['actual_resource_name']
+
+    def get_or_create_resource(self, resource_type, actual_resource_name, key_algorithm=None):
+        return Path('/mnt/data') / actual_resource_name
+
+
+@pytest.fixture
+def db(tmp_path):
+    storage = DatabaseManager(str(tmp_path / 'orch.db'))
+    storage.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', 'hub')
+    return storage
+
+
+@pytest.fixture
+def containers():
+    return FakeContainerClient({
+        '172.20.0.2': ContainerSnapshot('container-a', 'koji-hub', 'running', ips=['172.20.0.2']),
+        '172.20.0.3': ContainerSnapshot('container-b', 'koji-web', 'running', ips=['172.20.0.3']),
+    })
+
+
+def _manager(db, containers, monkeypatch, lease_ttl):
+    monkeypatch.setenv('ORCH_LEASE_TTL', str(lease_ttl))
+    return CheckoutManager(db, resource_manager=None, container_client=containers)
+
+
+def test_checkout_refuses_takeover_from_owner_newer_than_liveness_snapshot(db, containers, monkeypatch):
+    manager = _manager(db, containers, monkeypatch, lease_ttl=0)
+    manager.resource_manager = FakeResourceManager()
+    containers.client = SimpleNamespace(containers=FakeContainersAPI(containers.containers))
+    containers.liveness = LivenessCache(containers, ttl=60)
+
+    # container-b starts, and claims the resource, after the snapshot was taken
+    web = containers.containers.pop('172.20.0.3')
+    containers.liveness.refresh()
+    containers.containers['172.20.0.3'] = web
+    db.claim_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX')
+
+    success, resource_path, error = manager.checkout_resource(UUID, '172.20.0.2')
+    assert not success and 'already checked out' in error
+    assert db.get_resource_status(UUID)['container_id'] == 'container-b'
+
+    # once it is really gone the takeover goes ahead
+    del containers.containers['172.20.0.3']
+    success, resource_path, error = manager.checkout_resource(UUID, '172.20.0.2')
+    assert success and resource_path == Path('/mnt/data/hub@KOJI.BOX')
+    assert db.get_resource_status(UUID)['container_id'] == 'container-a'
+
+
+def test_renew_lease(db, containers, monkeypatch):
+    manager = _manager(db, containers, monkeypatch, lease_ttl=60)
+    db.claim_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX', lease_ttl=60)
+
+    success, expires_at, error = manager.renew_lease(UUID, '172.20.0.2')
+    assert success and expires_at and error is None
+
+    success, expires_at, error = manager.renew_lease(UUID, '172.20.0.3')
+    assert not success and 'not checked out' in error
+
+    success, expires_at, error = manager.renew_lease(UUID, '172.20.0.9')
+    assert not success and 'Unable to identify' in error
+
+
+def test_renew_lease_with_leases_disabled(db, containers, monkeypatch):
+    manager = _manager(db, containers, monkeypatch, lease_ttl=0)
+    db.claim_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX', lease_ttl=60)
+
+    success, expires_at, error = manager.renew_lease(UUID, '172.20.0.2')
+    assert not success and expires_at is None
+    assert 'Leases are disabled' in error
+
+
+def test_container_events_release_checkouts(db, containers):
+    manager = CheckoutManager(db, resource_manager=None, container_client=containers)
+    db.checkout_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX')
+
+    # workers that don't run the shared services leave events alone
+    containers.index.emit('die', 'container-a')
+    assert db.get_resource_status(UUID)['checked_out']
+
+    manager.release_on_container_events()
+
+    # only die and remove release the owner's checkouts
+    for action in ('kill', 'stop', 'resync'):
+        containers.index.emit(action, 'container-a' if action != 'resync' else None)
+        assert db.get_resource_status(UUID)['container_id'] == 'container-a'
+
+    containers.index.emit('die', 'container-b')
+    assert db.get_resource_status(UUID)['checked_out']
+
+    containers.index.emit('die', 'container-a')
+    assert not db.get_resource_status(UUID)['checked_out']
+
+    db.checkout_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX')
+    containers.index.emit('remove', 'container-b')
+    assert not db.get_resource_status(UUID)['checked_out']
+
+
+# The end.
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Container client tests for the Orch service
+Drives the client and its container index against an in-memory Podman
+"""
+
+import sys
+import time
+import queue
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.database import DatabaseManager
+from app.common.container_client import ContainerClient
+
+
+class FakeContainer:
+    """A container as the Podman API returns it, counting inspect calls"""
+
+    def __init__(self, id, name, ips=(), status='running', labels=None, inspect_delay=0.0):
+        self.id = id
+        self.name = name
+        self.ips = list(ips)
+        self.status = status
+        self.labels = dict(labels or {})
+        self.inspect_delay = inspect_delay
+        self.inspections = 0
+
+    @property
+    def attrs(self):
+        return {'Id': self.id, 'State': {'Status': self.status}}
+
+    def inspect(self):
+        self.inspections += 1
+        if self.inspect_delay:
+            time.sleep(self.inspect_delay)
+        return {
+            'Id': self.id,
+            'Name': f"/{self.name}",
+            'State': {'Status': self.status},
+            'Config': {'Labels': self.labels, 'Env': ['SECRET=hunter2']},
+            'NetworkSettings': {'Networks': {f"net{n}": {'IPAddress': ip} for n, ip in enumerate(self.ips)}},
+        }
+
+
+class FakeContainers:
+    def __init__(self):
+        self.by_id = {}
+        self.list_calls = 0
+
+    def add(self, container):
+        self.by_id[container.id] = container
+        return container
+
+    def list(self, all=False):
+        self.list_calls += 1
+        return [c for c in self.by_id.values() if all or c.status == 'running']
+
+    def get(self, container_id):
+        if container_id not in self.by_id:
+            raise KeyError(f"no such container: {container_id}")
+        return self.by_id[container_id]
+
+
+class FakeEvents:
+    """An events stream fed from a queue; None ends the stream"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def list(self, since=None, decode=True, filters=None):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            yield event
+
+
+class FakePodman:
+    def __init__(self):
+        self.containers = FakeContainers()
+        self.events = FakeEvents()
+
+    def ping(self):
+        return True
+
+
+def container_event(action, container_id):
+    return {'Type': 'container', 'Action': action, 'Actor': {'ID': container_id, 'Attributes': {}}}
+
+
+def network_event(action, container_id):
+    return {'Type': 'network', 'Action': action, 'Actor': {'ID': 'net0', 'Attributes': {'container': container_id}}}
+
+
+@pytest.fixture
+def podman():
+    return FakePodman()
+
+
+@pytest.fixture
+def client(podman, tmp_path, monkeypatch):
+    """A ContainerClient whose index only syncs when a test asks it to"""
+    monkeypatch.setenv('ORCH_LIVENESS_TTL', '5')
+    monkeypatch.setenv('ORCH_NEGATIVE_TTL', '10')
+    client = ContainerClient(socket_path=str(tmp_path / 'missing.sock'))
+    client.client = podman
+
+    # the watcher thread idles instead of following the events stream
+    stop = threading.Event()
+    monkeypatch.setattr(client.index, '_watch', stop.wait)
+    client.index.start()
+    yield client
+    stop.set()
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.01)
+
+
+def test_index_resync_and_lookup(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['10.1.0.5'], labels={'orch.client.ip': '192.168.5.5'}))
+    podman.containers.add(FakeContainer('c' * 64, 'koji-db', ['172.21.0.9'], status='exited'))
+
+    assert not client.index.is_ready()
+    assert client.index.resync() == 2
+    assert client.index.is_ready()
+
+    # exact, same /24 and label matches; stopped containers are not indexed
+    assert client.index.lookup('172.20.0.2').id == hub.id
+    assert client.index.lookup('172.20.0.77').id == hub.id
+    assert client.index.lookup('192.168.5.5').name == 'koji-web'
+    assert client.index.lookup('172.21.0.9') is None
+
+    # once synced, identification doesn't list or inspect containers
+    list_calls = podman.containers.list_calls
+    inspections = hub.inspections
+    assert client.get_container_by_ip('172.20.0.2').id == hub.id
+    assert podman.containers.list_calls == list_calls and hub.inspections == inspections
+
+
+def test_index_follows_container_events(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    client.index.resync()
+
+    # a new container is inspected and indexed on start
+    web = podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['172.30.0.3']))
+    client.index.handle_event(container_event('start', web.id))
+    assert client.index.lookup('172.30.0.3').id == web.id
+
+    # network changes re-inspect the container
+    web.ips = ['172.31.0.4']
+    client.index.handle_event(network_event('connect', web.id))
+    assert client.index.lookup('172.30.0.3') is None
+    assert client.index.lookup('172.31.0.4').id == web.id
+
+    # a signal alone doesn't take a container out of the index
+    client.index.handle_event(container_event('kill', hub.id))
+    assert client.index.lookup('172.20.0.2').id == hub.id
+
+    # it goes once the container dies
+    hub.status = 'exited'
+    client.index.handle_event(container_event('die', hub.id))
+    assert client.index.lookup('172.20.0.2') is None
+
+    client.index.handle_event(container_event('remove', web.id))
+    assert client.index.entries() == []
+
+
+def test_index_watcher_resyncs_and_applies_events(podman, tmp_path):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    client = ContainerClient(socket_path=str(tmp_path / 'missing.sock'))
+    client.client = podman
+    client.index.reconnect_delay = 0.05
+    resyncs = []
+    client.index.add_listener(lambda action, container_id: action == 'resync' and resyncs.append(action))
+
+    client.index.start()
+    _wait_for(client.index.is_ready)
+    assert client.index.lookup('172.20.0.2').id == hub.id
+
+    web = podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['172.30.0.3']))
+    podman.events.queue.put(container_event('start', web.id))
+    _wait_for(lambda: client.index.lookup('172.30.0.3') is not None)
+
+    # a dropped stream is followed by a full resync, catching missed events
+    db = podman.containers.add(FakeContainer('c' * 64, 'koji-db', ['172.40.0.4']))
+    podman.events.queue.put(None)
+    _wait_for(lambda: len(resyncs) >= 2 and client.index.lookup('172.40.0.4') is not None)
+    assert client.index.lookup('172.40.0.4').id == db.id
+
+
+def test_snapshot_all_inspects_in_parallel(client, podman):
+    containers = [podman.containers.add(FakeContainer(f"{n:064x}", f"koji-builder-{n}", [f"172.20.{n}.2"],
+                                                      inspect_delay=0.1)) for n in range(8)]
+    client.scan_workers = 8
+
+    start = time.monotonic()
+    snapshots = client.snapshot_all()
+    assert time.monotonic() - start < 0.5
+    # in listing order, whatever order the inspections finished in
+    assert [snapshot.id for snapshot in snapshots] == [container.id for container in containers]
+
+
+def test_snapshot_all_skips_failures_and_stops_at_ip(client, podman):
+    podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    broken = podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['172.20.0.3']))
+    broken.inspect = lambda: 1 / 0
+    podman.containers.add(FakeContainer('c' * 64, 'koji-db', ['172.20.0.4']))
+    client.scan_workers = 4
+
+    assert [snapshot.name for snapshot in client.snapshot_all()] == ['koji-hub', 'koji-db']
+    assert [snapshot.name for snapshot in client.snapshot_all(stop_at_ip='172.20.0.4')] == ['koji-db']
+
+
+def test_snapshot_all_deadline(client, podman):
+    podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['172.20.0.3'], inspect_delay=1.0))
+    client.scan_workers = 4
+
+    start = time.monotonic()
+    assert [snapshot.name for snapshot in client.snapshot_all(timeout=0.2)] == ['koji-hub']
+    assert time.monotonic() - start < 0.9
+
+
+def test_cold_path_identification_scans_containers(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['10.1.0.5'], labels={'orch.ip': '192.168.5.5'}))
+
+    # until the index has synced, identification scans the container API
+    assert not client.index.is_ready()
+    assert client.get_container_by_ip('172.20.0.2').id == hub.id
+    assert client.get_container_by_ip('172.20.0.99').id == hub.id
+    assert client.identify_container_by_ip('192.168.5.5') == ('b' * 64, None)
+
+    # each scan inspects every container once, whichever pass matches
+    assert hub.inspections == 3
+
+
+def test_liveness_is_served_from_one_listing(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub'))
+    podman.containers.add(FakeContainer('b' * 64, 'koji-web', status='exited'))
+    client.liveness.ttl = 0.2
+
+    list_calls = podman.containers.list_calls
+    assert client.is_container_running(hub.id)
+    assert not client.is_container_running('b' * 64)
+    assert not client.is_container_running('f' * 64)
+    assert podman.containers.list_calls == list_calls + 1
+
+    # stale until the TTL runs out, then listed again
+    hub.status = 'exited'
+    assert client.is_container_running(hub.id)
+    time.sleep(0.25)
+    assert not client.is_container_running(hub.id)
+    assert podman.containers.list_calls == list_calls + 2
+
+
+def test_liveness_follows_container_events(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    client.index.resync()
+    assert client.is_container_running(hub.id)
+    list_calls = podman.containers.list_calls
+
+    # a non-fatal signal leaves the container running
+    client.index.handle_event(container_event('kill', hub.id))
+    assert client.is_container_running(hub.id)
+
+    hub.status = 'exited'
+    client.index.handle_event(container_event('die', hub.id))
+    assert client.liveness.get_status(hub.id) == 'exited'
+
+    hub.status = 'running'
+    client.index.handle_event(container_event('start', hub.id))
+    assert client.is_container_running(hub.id)
+
+    del podman.containers.by_id[hub.id]
+    client.index.handle_event(container_event('remove', hub.id))
+    assert client.liveness.get_status(hub.id) is None
+    assert podman.containers.list_calls == list_calls
+
+    # a resync may have missed events, so the next check lists again
+    client.index.resync()
+    client.liveness.get_status(hub.id)
+    assert podman.containers.list_calls == list_calls + 2
+
+
+def test_liveness_checks_containers_missing_from_the_snapshot(client, podman):
+    podman.containers.add(FakeContainer('a' * 64, 'koji-hub'))
+    assert client.is_container_running('a' * 64)
+    list_calls = podman.containers.list_calls
+
+    # started after the listing, and still within the TTL
+    web = podman.containers.add(FakeContainer('b' * 64, 'koji-web'))
+    assert client.is_container_running(web.id)
+
+    # named some other way than by the full ID the listing uses
+    podman.containers.by_id['koji-web'] = web
+    assert client.is_container_running('koji-web')
+
+    assert not client.is_container_running('f' * 64)
+    assert podman.containers.list_calls == list_calls
+
+
+def test_liveness_without_cache(client, podman):
+    hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub'))
+    client.liveness.ttl = 0
+
+    assert client.is_container_running(hub.id)
+    hub.status = 'paused'
+    assert not client.is_container_running(hub.id)
+    assert not client.is_container_running('f' * 64)
+
+
+def test_negative_cache_expires(client, podman):
+    podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+    client.negative_ttl = 0.2
+
+    list_calls = podman.containers.list_calls
+    assert client.get_container_by_ip('10.9.9.9') is None
+    assert client.get_container_by_ip('10.9.9.9') is None
+    assert podman.containers.list_calls == list_calls + 1
+
+    time.sleep(0.25)
+    assert client.get_container_by_ip('10.9.9.9') is None
+    assert podman.containers.list_calls == list_calls + 2
+
+    stats = client.get_identification_stats()
+    assert stats['identify_misses'] == 2 and stats['negative_cache_hits'] == 1
+    assert stats['negative_cache_size'] == 1
+
+
+def test_negative_cache_cleared_by_new_containers(client, podman):
+    client.index.resync()
+    assert client.get_container_by_ip('10.9.9.9') is None
+
+    web = podman.containers.add(FakeContainer('b' * 64, 'koji-web', ['10.9.9.9']))
+    client.index.handle_event(container_event('start', web.id))
+    assert client.get_container_by_ip('10.9.9.9').id == web.id
+
+    # a die can't make an unknown IP known, so it leaves the cache alone
+    assert client.get_container_by_ip('10.8.8.8') is None
+    client.index.handle_event(container_event('die', web.id))
+    assert client.get_identification_stats()['negative_cache_size'] == 1
+
+
+def test_negative_cache_prunes_expired_entries(client):
+    client.negative_ttl = 60
+    expired = time.monotonic() - 1
+    client._unknown_ips = {f"10.0.{n // 256}.{n % 256}": expired for n in range(1024)}
+
+    client._record_miss('10.9.9.9')
+    assert list(client._unknown_ips) == ['10.9.9.9']
+
+    client.negative_ttl = 0
+    client.clear_negative_cache()
+    client._record_miss('10.9.9.9')
+    assert client.get_identification_stats()['negative_cache_size'] == 0
+
+
+def test_cleanup_skips_when_containers_cannot_be_listed(client, podman, tmp_path):
+    db = DatabaseManager(str(tmp_path / 'orch.db'))
+    try:
+        db.add_resource_mapping('uuid-1', 'principal', 'hub@KOJI.BOX', '')
+        db.add_resource_mapping('uuid-2', 'principal', 'web@KOJI.BOX', '')
+        hub = podman.containers.add(FakeContainer('a' * 64, 'koji-hub', ['172.20.0.2']))
+        db.claim_resource('uuid-1', hub.id, '172.20.0.2', 'principal', 'hub@KOJI.BOX')
+        db.claim_resource('uuid-2', 'b' * 64, '172.20.0.3', 'principal', 'web@KOJI.BOX')
+
+        # an unreachable daemon is not the same as no containers
+        podman.containers.list = lambda all=False: 1 / 0
+        assert client.cleanup_dead_containers(db) == 0
+        assert db.get_resource_status('uuid-1')['checked_out'] and db.get_resource_status('uuid-2')['checked_out']
+
+        # only checkouts older than the listing are cleaned
+        del podman.containers.list
+        time.sleep(1.1)
+        assert client.cleanup_dead_containers(db) == 1
+        assert db.get_resource_status('uuid-1')['checked_out'] and not db.get_resource_status('uuid-2')['checked_out']
+    finally:
+        db.close()
+
+
+# The end.
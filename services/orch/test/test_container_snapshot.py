@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Container snapshot tests for the Orch service
+Builds snapshots from Docker and Podman style inspect output
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.container_snapshot import ContainerSnapshot
+
+PODMAN_INSPECT = {
+    'Id': 'a' * 64,
+    'Name': 'koji-worker-3',
+    'State': {'Status': 'running'},
+    'Config': {
+        'Labels': {'orch.client.ip': '192.168.5.5', 'com.docker.compose.container-number': '7'},
+        'Env': ['PATH=/usr/bin', 'KOJI_PASSWORD=secret'],
+    },
+    'NetworkSettings': {'Networks': {
+        'koji': {'IPAddress': '172.20.0.2'},
+        'storage': {'IPAddress': '172.21.0.2'},
+        'none': {'IPAddress': ''},
+    }},
+}
+
+
+def test_from_inspect():
+    snapshot = ContainerSnapshot.from_inspect(PODMAN_INSPECT)
+    assert snapshot.id == 'a' * 64
+    assert snapshot.name == 'koji-worker-3'
+    assert snapshot.status == 'running' and snapshot.running
+    assert snapshot.ips == ('172.20.0.2', '172.21.0.2')
+    assert snapshot.label_ips == ('192.168.5.5',)
+    assert snapshot.labels['orch.client.ip'] == '192.168.5.5'
+    # the name wins over the compose container number
+    assert snapshot.scale_index == 3
+
+
+def test_from_inspect_docker_style():
+    inspect = {
+        'Name': '/koji-builder',
+        'State': {'Status': 'exited'},
+        'Labels': {'orch.ip': '10.0.0.9', 'orch.scale.index': '2'},
+        'NetworkSettings': {'Networks': None},
+    }
+    snapshot = ContainerSnapshot.from_inspect(inspect, container_id='b' * 64)
+    assert snapshot.id == 'b' * 64 and snapshot.name == 'koji-builder'
+    assert not snapshot.running
+    assert snapshot.ips == () and snapshot.label_ips == ('10.0.0.9',)
+    assert snapshot.scale_index == 2
+
+
+@pytest.mark.parametrize('name, inspect, scale_index', [
+    ('koji-builder', {'Config': {'Labels': {'scale_index': '4'}}}, 4),
+    ('koji-builder', {'Config': {'Env': ['SCALE_INDEX=5']}}, 5),
+    ('koji_builder_6', {}, 6),
+    ('koji-builder', {}, None),
+    ('koji-builder', {'Config': {'Labels': {'scale_index': 'many'}}}, None),
+])
+def test_scale_index(name, inspect, scale_index):
+    snapshot = ContainerSnapshot.from_inspect({**inspect, 'Name': name, 'State': {'Status': 'running'}}, 'c' * 64)
+    assert snapshot.scale_index == scale_index
+
+
+def test_to_info_excludes_environment():
+    snapshot = ContainerSnapshot.from_inspect(PODMAN_INSPECT)
+    info = snapshot.to_info()
+    assert info == {
+        'id': 'a' * 64,
+        'name': 'koji-worker-3',
+        'status': 'running',
+        'labels': PODMAN_INSPECT['Config']['Labels'],
+        'networks': PODMAN_INSPECT['NetworkSettings']['Networks'],
+    }
+    assert 'secret' not in repr(info)
+
+    # a plain copy, not a view into the snapshot
+    info['labels']['orch.client.ip'] = '10.9.9.9'
+    assert snapshot.labels['orch.client.ip'] == '192.168.5.5'
+
+
+def test_snapshot_is_immutable():
+    snapshot = ContainerSnapshot.from_inspect(PODMAN_INSPECT)
+    with pytest.raises(AttributeError):
+        snapshot.status = 'exited'
+    with pytest.raises(AttributeError):
+        del snapshot.name
+    with pytest.raises(TypeError):
+        snapshot.labels['orch.client.ip'] = '10.9.9.9'
+
+
+# The end.
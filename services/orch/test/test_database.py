@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Storage backend tests for the Orch service
+Runs the same checks against SQLite and a throwaway PostgreSQL instance
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import subprocess
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.storage import open_storage
+from app.common.database import DatabaseManager
+
+UUID = '00000000-0000-0000-0000-000000000001'
+OTHER_UUID = '00000000-0000-0000-0000-000000000002'
+
+ORCH_TABLES = ['resource_checkouts', 'resource_aliases', 'resource_mappings', 'orch_state',
+               'provisioning_tasks', 'koji_hosts', 'certificates', 'schema_migrations']
+
+
+@pytest.fixture(scope='session')
+def postgres_url(tmp_path_factory):
+    """
+    PostgreSQL to test against: ORCH_TEST_POSTGRES_URL if set, otherwise a
+    throwaway server started with initdb/pg_ctl on a private unix socket
+    """
+    # ORCH_TEST_REQUIRE_POSTGRES turns a missing PostgreSQL into a failure,
+    # so CI can't pass on the SQLite half of the parametrization alone
+    missing = pytest.fail if os.getenv('ORCH_TEST_REQUIRE_POSTGRES') else pytest.skip
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        missing("psycopg2 is not installed")
+
+    url = os.getenv('ORCH_TEST_POSTGRES_URL')
+    if url:
+        yield url
+        return
+
+    initdb, pg_ctl = shutil.which('initdb'), shutil.which('pg_ctl')
+    if not (initdb and pg_ctl):
+        missing("no ORCH_TEST_POSTGRES_URL and no local PostgreSQL binaries")
+
+    data_dir = tmp_path_factory.mktemp('pgdata')
+    socket_dir = tmp_path_factory.mktemp('pgsocket')
+    subprocess.run([initdb, '-D', str(data_dir), '-U', 'orch', '--auth=trust', '-E', 'UTF8'],
+                   check=True, capture_output=True)
+    subprocess.run([pg_ctl, '-D', str(data_dir), '-l', str(data_dir / 'server.log'), '-w',
+                    '-o', f"-k {socket_dir} -c listen_addresses='' -p 5499", 'start'],
+                   check=True, capture_output=True)
+    try:
+        yield f"postgresql://orch@/postgres?host={socket_dir}&port=5499"
+    finally:
+        subprocess.run([pg_ctl, '-D', str(data_dir), '-m', 'immediate', 'stop'], capture_output=True)
+
+
+def _drop_postgres_tables(url: str):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(ORCH_TABLES)} CASCADE")
+    finally:
+        conn.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db(request, tmp_path):
+    """A freshly initialized storage backend"""
+    if request.param == 'sqlite':
+        storage = open_storage(f"sqlite:///{tmp_path / 'orch.db'}")
+        yield storage
+        storage.close()
+        return
+
+    url = request.getfixturevalue('postgres_url')
+    _drop_postgres_tables(url)
+    storage = open_storage(url)
+    yield storage
+    storage.close()
+    _drop_postgres_tables(url)
+
+
+def test_add_and_get_mapping(db):
+    generation = db.get_mappings_generation()
+    assert db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', 'hub')
+    assert db.get_resource_mapping(UUID) == {
+        'uuid': UUID,
+        'resource_type': 'principal',
+        'actual_resource_name': 'hub@KOJI.BOX',
+        'description': 'hub',
+        'key_algorithm': None
+    }
+    assert db.get_resource_mapping(OTHER_UUID) is None
+    assert db.get_mappings_generation() == generation + 1
+
+
+def test_sync_resource_mappings_applies_diff(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', '')
+    db.add_resource_mapping(OTHER_UUID, 'cert', 'hub.koji.box', '')
+    db.checkout_resource(OTHER_UUID, 'container-a', '172.20.0.2', 'cert', 'hub.koji.box')
+
+    wanted = {
+        UUID: {'resource_type': 'principal', 'actual_resource_name': 'web@KOJI.BOX', 'description': ''},
+        'new-uuid': {'resource_type': 'cert', 'actual_resource_name': 'web.koji.box', 'description': ''},
+    }
+    assert db.sync_resource_mappings(wanted) == {
+        'added': ['new-uuid'], 'changed': [UUID], 'removed': [OTHER_UUID]
+    }
+    assert db.get_resource_mapping(UUID)['actual_resource_name'] == 'web@KOJI.BOX'
+    assert db.get_resource_status(OTHER_UUID) is None
+
+    generation = db.get_mappings_generation()
+    assert db.sync_resource_mappings(wanted) == {'added': [], 'changed': [], 'removed': []}
+    assert db.get_mappings_generation() == generation
+
+    snapshot_generation, mappings = db.load_mappings_snapshot()
+    assert snapshot_generation == generation
+    assert {mapping['uuid'] for mapping in mappings} == {UUID, 'new-uuid'}
+
+
+def test_mapping_key_algorithm(db):
+    wanted = {
+        UUID: {'resource_type': 'cert', 'actual_resource_name': 'hub.koji.box', 'description': ''},
+    }
+    db.sync_resource_mappings(wanted)
+    assert db.get_resource_mapping(UUID)['key_algorithm'] is None
+
+    wanted[UUID]['key_algorithm'] = 'ed25519'
+    assert db.sync_resource_mappings(wanted)['changed'] == [UUID]
+    assert db.get_resource_mapping(UUID)['key_algorithm'] == 'ed25519'
+    assert db.get_all_mappings()[0]['key_algorithm'] == 'ed25519'
+    assert db.load_mappings_snapshot()[1][0]['key_algorithm'] == 'ed25519'
+
+
+def test_claim_conflict_and_takeover(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX')
+
+    assert db.claim_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX') == \
+        (True, None, False)
+    assert db.claim_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX') == \
+        (False, 'container-a', False)
+
+    # takeover only succeeds from the owner the caller found dead
+    assert db.claim_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX',
+                             takeover_from='container-x')[0] is False
+    assert db.claim_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX',
+                             takeover_from='container-a') == (True, 'container-a', False)
+
+    status = db.get_resource_status(UUID, 'hub@KOJI.BOX')
+    assert status['checked_out'] and status['container_id'] == 'container-b'
+    assert len(status['checked_out_at']) == len('YYYY-MM-DD HH:MM:SS')
+
+
+def test_concurrent_claims_have_one_winner(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX')
+    results = []
+    barrier = threading.Barrier(8)
+
+    def claim(n):
+        barrier.wait()
+        claimed, owner, _ = db.claim_resource(UUID, f"container-{n}", '172.20.0.2', 'principal', 'hub@KOJI.BOX')
+        results.append((claimed, owner))
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [claimed for claimed, _ in results].count(True) == 1
+
+    # every loser is told who won, even one that raced the first insert
+    winner = db.get_resource_status(UUID)['container_id']
+    assert all(owner == winner for claimed, owner in results if not claimed)
+
+
+def test_release(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX')
+    db.add_resource_mapping(OTHER_UUID, 'cert', 'hub.koji.box')
+    db.checkout_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX')
+    db.checkout_resource(OTHER_UUID, 'container-a', '172.20.0.2', 'cert', 'hub.koji.box')
+
+    assert not db.release_resource(UUID, 'container-b')
+    assert db.release_resource(UUID, 'container-a')
+    assert not db.get_resource_status(UUID)['checked_out']
+
+    assert db.release_container('container-a') == 1
+    assert not db.get_resource_status(OTHER_UUID)['checked_out']
+
+
+def test_leases(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX')
+    assert db.claim_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX', lease_ttl=1)[0]
+
+    claimed, owner, lease_active = db.claim_resource(UUID, 'container-b', '172.20.0.3', 'principal', 'hub@KOJI.BOX')
+    assert (claimed, owner, lease_active) == (False, 'container-a', True)
+    assert db.get_resource_status(UUID)['lease_active']
+
+    assert db.renew_lease(UUID, 'container-b', 1) == (0, None)
+    renewed, expires_at = db.renew_lease(UUID, 'container-a', 1)
+    assert renewed == 1 and expires_at == db.get_resource_status(UUID)['expires_at']
+
+    time.sleep(2.1)
+    assert not db.get_resource_status(UUID)['lease_active']
+    assert db.expire_leases() == 1
+    assert not db.get_resource_status(UUID)['checked_out']
+
+
+def test_cleanup_dead_containers(db):
+    db.add_resource_mapping(UUID, 'worker', 'worker')
+    for n in range(1200):
+        db.checkout_resource(UUID, f"container-{n % 600}", '172.20.0.2', 'worker', f"worker-{n}")
+
+    # nothing checked out before the cutoff is eligible
+    past = datetime.utcnow() - timedelta(hours=1)
+    assert db.cleanup_dead_containers([], checked_out_before=past) == 0
+
+    live = [f"container-{n}" for n in range(0, 600, 2)]
+    assert db.cleanup_dead_containers(live, batch_size=100) == 600
+    assert db.get_resource_status(UUID, 'worker-1')['checked_out'] is False
+    assert db.get_resource_status(UUID, 'worker-2')['checked_out'] is True
+
+    # zero live containers releases everything
+    assert db.cleanup_dead_containers([]) == 600
+
+
+def test_migrations_are_idempotent(db):
+    assert db.get_schema_version() == db.latest_schema_version
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX')
+
+    db.init_database()
+    assert db.get_schema_version() == db.latest_schema_version
+    assert db.get_resource_mapping(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+
+
+def test_legacy_sqlite_database_is_migrated(tmp_path):
+    # schema as created before schema_migrations, including the lease column
+    path = tmp_path / 'orch.db'
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE resource_mappings (uuid TEXT PRIMARY KEY, resource_type TEXT NOT NULL,
+            actual_resource_name TEXT NOT NULL, description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE resource_checkouts (uuid TEXT NOT NULL, actual_resource_name TEXT NOT NULL,
+            container_id TEXT NOT NULL, container_ip TEXT NOT NULL,
+            checked_out_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, resource_type TEXT NOT NULL,
+            scale_index INTEGER DEFAULT NULL, expires_at TIMESTAMP DEFAULT NULL,
+            PRIMARY KEY (uuid, actual_resource_name));
+        INSERT INTO resource_mappings (uuid, resource_type, actual_resource_name)
+            VALUES ('00000000-0000-0000-0000-000000000001', 'principal', 'hub@KOJI.BOX');
+    """)
+    conn.close()
+
+    db = DatabaseManager(str(path))
+    try:
+        assert db.get_schema_version() == db.latest_schema_version
+        assert db.get_resource_mapping(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+        assert db.claim_resource(UUID, 'container-a', '172.20.0.2', 'principal', 'hub@KOJI.BOX',
+                                 lease_ttl=60)[0]
+        assert db.get_resource_status(UUID)['lease_active']
+    finally:
+        db.close()
+
+
+def _query_plans(db: DatabaseManager, call):
+    """EXPLAIN QUERY PLAN every resource_checkouts SELECT/DELETE issued by call()"""
+    statements = []
+    conn = db._connect()
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+
+    plans = []
+    for statement in statements:
+        if 'resource_checkouts' in statement and statement.lstrip().startswith(('SELECT', 'DELETE')):
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+            plans.append(' / '.join(row[-1] for row in rows))
+    assert plans
+    return plans
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    storage = DatabaseManager(str(tmp_path / 'orch.db'))
+    storage.add_resource_mapping(UUID, 'worker', 'worker')
+    for n in range(50):
+        storage.checkout_resource(UUID, f"container-{n % 10}", '172.20.0.2', 'worker', f"worker-{n}")
+    yield storage
+    storage.close()
+
+
+def test_release_uses_covering_index(sqlite_db):
+    plans = _query_plans(sqlite_db, lambda: sqlite_db.release_resource(UUID, 'container-3'))
+    for plan in plans:
+        assert 'idx_checkouts_uuid_container' in plan
+        assert 'SCAN resource_checkouts' not in plan
+    assert any('COVERING INDEX idx_checkouts_uuid_container' in plan for plan in plans)
+
+
+def test_status_needs_no_extra_index(sqlite_db):
+    indexes = {row[0] for row in sqlite_db._connect().execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_checkouts_status' not in indexes
+    assert 'idx_mappings_lookup' not in indexes
+
+    # a uuid lookup is an index search on a prefix of the primary key
+    plans = _query_plans(sqlite_db, lambda: sqlite_db.get_resource_status(UUID))
+    for plan in plans:
+        assert plan.startswith('SEARCH resource_checkouts')
+        assert 'SCAN resource_checkouts' not in plan
+
+    # a full primary key lookup is a single-row search either way
+    plans = _query_plans(sqlite_db, lambda: sqlite_db.get_resource_status(UUID, 'worker-7'))
+    for plan in plans:
+        assert plan.startswith('SEARCH resource_checkouts')
+
+
+def test_provisioning_tasks(db):
+    assert db.get_provisioning_tasks() == []
+    assert db.start_provisioning_run([
+        {'task': 'principal:hub@KOJI.BOX', 'kind': 'principal', 'resource': 'hub@KOJI.BOX', 'depends_on': []},
+        {'task': 'keytab:hub@KOJI.BOX', 'kind': 'keytab', 'resource': 'hub@KOJI.BOX',
+         'depends_on': ['principal:hub@KOJI.BOX']},
+    ])
+    assert db.update_provisioning_task('principal:hub@KOJI.BOX', 'running')
+    assert db.update_provisioning_task('principal:hub@KOJI.BOX', 'done')
+    assert db.update_provisioning_task('keytab:hub@KOJI.BOX', 'failed', 'ktadd failed')
+    assert not db.update_provisioning_task('cert:hub.koji.box', 'done')
+
+    principal, keytab = db.get_provisioning_tasks()
+    assert principal['state'] == 'done' and principal['started_at'] and principal['finished_at']
+    assert keytab['depends_on'] == ['principal:hub@KOJI.BOX']
+    assert (keytab['state'], keytab['error'], keytab['started_at']) == ('failed', 'ktadd failed', None)
+
+    # a new run replaces the previous one
+    assert db.start_provisioning_run([])
+    assert db.get_provisioning_tasks() == []
+
+
+def test_koji_hosts(db):
+    assert db.get_koji_host('worker/koji-worker-1') is None
+    assert db.record_koji_host('worker/koji-worker-1', 'worker/koji-worker-1@KOJI.BOX', 'x86_64')
+    assert db.record_koji_host('worker/koji-worker-2', 'worker/koji-worker-2@KOJI.BOX', 'x86_64')
+
+    host = db.get_koji_host('worker/koji-worker-1')
+    assert (host['principal'], host['arch']) == ('worker/koji-worker-1@KOJI.BOX', 'x86_64')
+    assert len(host['verified_at']) == len('YYYY-MM-DD HH:MM:SS')
+
+    # re-registering with another arch replaces the record
+    assert db.record_koji_host('worker/koji-worker-1', 'worker/koji-worker-1@KOJI.BOX', 'aarch64')
+    assert db.get_koji_host('worker/koji-worker-1')['arch'] == 'aarch64'
+
+    assert db.mark_koji_host_verified('worker/koji-worker-2')
+    assert not db.mark_koji_host_verified('worker/koji-worker-3')
+    assert {host['worker_name'] for host in db.get_koji_hosts()} == \
+        {'worker/koji-worker-1', 'worker/koji-worker-2'}
+
+    assert db.forget_koji_host('worker/koji-worker-1')
+    assert not db.forget_koji_host('worker/koji-worker-1')
+    assert [host['worker_name'] for host in db.get_koji_hosts()] == ['worker/koji-worker-2']
+
+
+def test_certificate_serials(db):
+    # continues from the openssl serial file, then counts up
+    assert db.allocate_certificate_serial(0x1000) == 0x1000
+    assert db.allocate_certificate_serial(0x1000) == 0x1001
+    assert db.allocate_certificate_serial() == 0x1002
+    assert db.allocate_certificate_serial(0x2000) == 0x2000
+
+
+def test_certificate_serials_across_threads(db):
+    serials = []
+    threads = [threading.Thread(target=lambda: serials.extend(
+        db.allocate_certificate_serial(0x1000) for _ in range(10))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(serials) == list(range(0x1000, 0x1000 + 40))
+
+
+def test_certificate_ledger(db):
+    assert db.get_certificates() == []
+    assert db.record_certificate(0x1000, 'hub.koji.box', 'aa' * 32, 'ecdsa-p256',
+                                 '2026-10-16 12:00:00', '2027-10-16 12:00:00')
+    assert db.record_certificate(0x1001, 'web.koji.box', 'bb' * 32, 'rsa2048',
+                                 '2026-10-16 12:00:00', '2027-10-16 12:00:00')
+    # reissuing hub supersedes its earlier certificate
+    assert db.record_certificate(0x1002, 'hub.koji.box', 'cc' * 32, 'ed25519',
+                                 '2026-10-17 12:00:00', '2027-10-17 12:00:00')
+    # a serial is only ever recorded once
+    assert not db.record_certificate(0x1002, 'db.koji.box', 'dd' * 32, None,
+                                     '2026-10-17 12:00:00', '2027-10-17 12:00:00')
+
+    hub = db.get_certificates('hub.koji.box')
+    assert [(cert['serial'], cert['status']) for cert in hub] == [(0x1000, 'superseded'), (0x1002, 'valid')]
+    assert hub[1]['fingerprint'] == 'cc' * 32 and hub[1]['key_algorithm'] == 'ed25519'
+    assert (hub[1]['not_before'], hub[1]['not_after']) == ('2026-10-17 12:00:00', '2027-10-17 12:00:00')
+    assert len(hub[1]['issued_at']) == len('YYYY-MM-DD HH:MM:SS')
+
+    assert [cert['cn'] for cert in db.get_certificates()] == ['hub.koji.box', 'web.koji.box', 'hub.koji.box']
+
+
+# The end.
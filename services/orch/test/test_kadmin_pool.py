@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Kadmin session pool and principal cache tests for the Orch service
+Drives both against a stand-in kadmin that speaks the same prompt protocol
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.kadmin_pool import KadminPool
+from app.common.principal_cache import PrincipalCache
+
+# answers the handful of queries orch issues the way MIT kadmin does; one
+# principal per line in the state file, so every process sees the same KDC
+FAKE_KADMIN = '''#!{python}
+import os, sys
+args = sys.argv[1:]
+state = {state!r}
+if args[args.index('-w') + 1] != 'secret':
+    print("kadmin: Password incorrect while initializing kadmin interface", file=sys.stderr)
+    sys.exit(1)
+print(f"Authenticating as principal {{args[args.index('-p') + 1]}} with password.", flush=True)
+
+def principals():
+    return set(open(state).read().split()) if os.path.exists(state) else set()
+
+def run(line):
+    words = line.split()
+    if not words:
+        return
+    if words[0] == 'quit':
+        sys.exit(0)
+    if words[0] == 'crash':
+        os._exit(3)
+    if words[0] == 'pid':
+        print(os.getpid())
+    elif words[0] == 'listprincs':
+        with open(state + '.listed', 'a') as f:
+            f.write('listed\\n')
+        for principal in sorted(principals()):
+            print(principal)
+    elif words[0] == 'getprinc':
+        if words[1] in principals():
+            print(f"Principal: {{words[1]}}")
+        else:
+            print(f'get_principal: Principal does not exist while retrieving "{{words[1]}}".', file=sys.stderr)
+    elif words[0] == 'addprinc':
+        if words[-1] in principals():
+            print("add_principal: Principal or policy already exists while creating", file=sys.stderr)
+        else:
+            with open(state, 'a') as f:
+                f.write(words[-1] + '\\n')
+            print(f'Principal "{{words[-1]}}" created.')
+    else:
+        print(f'kadmin: Unknown request "{{words[0]}}".  Type "?" for a request list.', file=sys.stderr)
+
+if '-q' in args:
+    run(args[args.index('-q') + 1])
+    sys.exit(0)
+while True:
+    sys.stdout.write("kadmin:  ")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        break
+    run(line)
+'''
+
+
+@pytest.fixture
+def fake_kadmin(tmp_path):
+    script = tmp_path / 'kadmin'
+    script.write_text(FAKE_KADMIN.format(python=sys.executable, state=str(tmp_path / 'principals')))
+    script.chmod(0o755)
+    return str(script)
+
+
+def _listprincs_calls(fake_kadmin: str) -> int:
+    listed = Path(fake_kadmin).parent / 'principals.listed'
+    return len(listed.read_text().split()) if listed.exists() else 0
+
+
+@pytest.fixture
+def pool(fake_kadmin):
+    pool = KadminPool('admin/admin@KOJI.BOX', 'secret', size=2, command=fake_kadmin, timeout=5)
+    yield pool
+    pool.close()
+
+
+def test_queries_reuse_one_session(pool):
+    assert 'does not exist' in pool.execute('getprinc hub@KOJI.BOX')
+    assert 'Principal "hub@KOJI.BOX" created.' in pool.execute('addprinc -randkey hub@KOJI.BOX')
+    assert 'Principal: hub@KOJI.BOX' in pool.execute('getprinc hub@KOJI.BOX')
+    assert 'already exists' in pool.execute('addprinc -randkey hub@KOJI.BOX')
+
+    pids = {pool.execute('pid').strip() for _ in range(5)}
+    assert len(pids) == 1
+    assert pool.stats()['spawned'] == 1
+
+
+def test_dead_session_is_replaced(pool):
+    first_pid = pool.execute('pid').strip()
+    os.kill(int(first_pid), signal.SIGKILL)
+    time.sleep(0.2)
+
+    second_pid = pool.execute('pid').strip()
+    assert second_pid not in ('', first_pid)
+
+    # a query that kills its session is retried once, then given up on
+    assert pool.execute('crash') is None
+    assert pool.stats()['respawned'] == 2
+    assert pool.execute('pid').strip() not in ('', second_pid)
+
+
+def test_aged_session_is_replaced(pool):
+    first_pid = pool.execute('pid').strip()
+    pool.max_age = 0
+    assert pool.execute('pid').strip() != first_pid
+
+
+def test_concurrent_queries_stay_within_pool_size(pool):
+    results = []
+    barrier = threading.Barrier(6)
+
+    def query(n):
+        barrier.wait()
+        pool.execute(f'addprinc -randkey worker/{n}@KOJI.BOX')
+        results.append(pool.execute(f'getprinc worker/{n}@KOJI.BOX'))
+
+    threads = [threading.Thread(target=query, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all('Principal: worker/' in output for output in results)
+    assert pool.stats()['spawned'] <= 2
+
+
+def test_session_error_releases_its_slot(pool, monkeypatch):
+    from app.common.kadmin_pool import KadminSession
+
+    original = KadminSession.execute
+
+    def explode(self, query):
+        if query is None:
+            return original(self, query)
+        raise OSError("terminal went away")
+
+    monkeypatch.setattr(KadminSession, 'execute', explode)
+    for _ in range(pool.size + 1):
+        with pytest.raises(OSError):
+            pool.execute('getprinc hub@KOJI.BOX')
+    monkeypatch.setattr(KadminSession, 'execute', original)
+
+    assert pool.stats()['open_sessions'] == 0
+    assert 'does not exist' in pool.execute('getprinc hub@KOJI.BOX')
+
+
+def test_exhausted_pool_falls_back_after_timeout(fake_kadmin):
+    pool = KadminPool('admin/admin@KOJI.BOX', 'secret', size=1, command=fake_kadmin, timeout=0.5)
+    try:
+        held = pool._acquire()
+        assert held is not None
+        assert 'does not exist' in pool.execute('getprinc hub@KOJI.BOX')
+        assert pool.stats()['fallbacks'] == 1
+        pool._release(held)
+    finally:
+        pool.close()
+
+
+def test_failed_login_falls_back_to_one_shot(fake_kadmin):
+    pool = KadminPool('admin/admin@KOJI.BOX', 'wrong', size=2, command=fake_kadmin, timeout=5)
+    assert 'Password incorrect' in pool.execute('getprinc hub@KOJI.BOX')
+    assert pool.stats()['fallbacks'] == 1
+
+
+def test_pool_size_zero_runs_one_shot(fake_kadmin):
+    pool = KadminPool('admin/admin@KOJI.BOX', 'secret', size=0, command=fake_kadmin, timeout=5)
+    assert 'created.' in pool.execute('addprinc -randkey hub@KOJI.BOX')
+    assert 'Principal: hub@KOJI.BOX' in pool.execute('getprinc hub@KOJI.BOX')
+    assert pool.stats()['spawned'] == 0
+
+
+def test_multiline_query_is_rejected(pool):
+    with pytest.raises(ValueError):
+        pool.execute('getprinc hub@KOJI.BOX\ndelprinc -force hub@KOJI.BOX')
+
+
+def test_principal_cache_seeds_from_listprincs(pool, fake_kadmin):
+    pool.execute('addprinc -randkey hub@KOJI.BOX')
+    pool.execute('addprinc -randkey web@KOJI.BOX')
+
+    cache = PrincipalCache(pool, refresh_interval=300)
+    assert cache.refresh()
+    assert cache.exists('hub@KOJI.BOX') and cache.exists('web@KOJI.BOX')
+    assert not cache.exists('worker/1@KOJI.BOX')
+
+    cache.add('worker/1@KOJI.BOX')
+    assert cache.exists('worker/1@KOJI.BOX')
+    cache.discard('hub@KOJI.BOX')
+    assert not cache.exists('hub@KOJI.BOX')
+
+    assert _listprincs_calls(fake_kadmin) == 1
+    assert cache.stats()['principals'] == 2
+
+
+def test_principal_cache_refreshes_in_background(pool, fake_kadmin):
+    cache = PrincipalCache(pool, refresh_interval=0.2)
+    pool.execute('addprinc -randkey hub@KOJI.BOX')
+    assert cache.refresh()
+
+    pool.execute('addprinc -randkey web@KOJI.BOX')
+    assert not cache.exists('web@KOJI.BOX')
+    time.sleep(0.3)
+
+    # the stale lookup answers from memory and starts a refresh
+    assert not cache.exists('web@KOJI.BOX')
+    deadline = time.monotonic() + 5
+    while not cache.exists('web@KOJI.BOX') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert cache.exists('web@KOJI.BOX')
+
+
+def test_principal_cache_seeds_in_background(pool, fake_kadmin):
+    pool.execute('addprinc -randkey hub@KOJI.BOX')
+
+    cache = PrincipalCache(pool, refresh_interval=300)
+    thread = cache.start_refresh()
+    assert thread is not None
+    thread.join(timeout=5)
+
+    assert cache.exists('hub@KOJI.BOX')
+    # a finished seed doesn't block the next refresh
+    cache.start_refresh().join(timeout=5)
+    assert PrincipalCache(pool, refresh_interval=0).start_refresh() is None
+
+
+def test_principal_cache_keeps_set_when_listprincs_fails(fake_kadmin):
+    pool = KadminPool('admin/admin@KOJI.BOX', 'wrong', size=1, command=fake_kadmin, timeout=5)
+    cache = PrincipalCache(pool)
+    cache.add('hub@KOJI.BOX')
+    assert not cache.refresh()
+    assert cache.exists('hub@KOJI.BOX')
+
+
+# The end.
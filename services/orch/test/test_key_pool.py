@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Key pool tests for the Orch service
+Filling, draining and sharing the pool of pre-generated keys
+"""
+
+import sys
+import time
+import threading
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.key_pool import KeyPool
+from app.common.ca_certificate_manager import CACertificateManager
+
+
+def test_fill_writes_private_keys(tmp_path):
+    pool = KeyPool(tmp_path / 'keypool', size=3, algorithms=['rsa2048'])
+    assert pool.fill() == 3
+    assert pool.fill() == 0
+
+    assert (tmp_path / 'keypool').stat().st_mode & 0o777 == 0o700
+    keys = list((tmp_path / 'keypool' / 'rsa2048').glob('*.pem'))
+    assert len(keys) == 3
+    assert all(path.stat().st_mode & 0o777 == 0o600 for path in keys)
+
+
+def test_take_drains_and_refills(tmp_path):
+    pool = KeyPool(tmp_path / 'keypool', size=2, algorithms=['rsa2048'])
+    pool.fill()
+
+    key = pool.take('rsa2048')
+    assert key is not None and key.key_size == 2048
+    assert pool.count('rsa2048') == 1
+
+    # an algorithm that isn't pooled yet misses, then is pooled too
+    assert pool.take('ed25519') is None
+
+    # taking wakes the refill thread
+    deadline = time.monotonic() + 10
+    while (pool.count('rsa2048') < 2 or pool.count('ed25519') < 2) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    pool.stop()
+    assert pool.stats()['ready'] == {'ed25519': 2, 'rsa2048': 2}
+    assert pool.stats()['taken'] == 1 and pool.stats()['missed'] == 1
+
+
+def test_each_key_is_taken_once(tmp_path):
+    pool = KeyPool(tmp_path / 'keypool', size=6, algorithms=['rsa2048'])
+    pool.fill()
+    pool.start = lambda: None  # no refills
+
+    taken = []
+    threads = [threading.Thread(target=lambda: taken.append(pool.take('rsa2048'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    keys = [key for key in taken if key is not None]
+    assert len(keys) == 6
+    assert len({key.public_key().public_numbers().n for key in keys}) == 6
+
+
+def _fill(pool_dir, results):
+    results.put(KeyPool(Path(pool_dir), size=2, algorithms=['rsa2048']).fill())
+
+
+def test_one_worker_fills_at_a_time(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_fill, args=(str(tmp_path / 'keypool'), results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    assert sum(results.get(timeout=1) for _ in workers) == 2
+
+
+def test_unknown_algorithm(tmp_path):
+    with pytest.raises(ValueError):
+        KeyPool(tmp_path / 'keypool', algorithms=['dsa1024'])
+
+
+def test_issuance_uses_pooled_key(tmp_path, monkeypatch):
+    monkeypatch.setenv('ORCH_KEY_POOL_SIZE', '1')
+    ca = CACertificateManager(tmp_path)
+    ca.get_ca_certificate()
+    ca.key_pool.fill()
+    pooled = next((tmp_path / 'keypool' / 'rsa2048').glob('*.pem')).read_bytes()
+
+    key_path, _ = ca.create_certificate_signed_by_ca('hub.koji.box')
+    ca.key_pool.stop()
+    assert key_path.read_bytes() == pooled
+
+
+# The end.
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Resource mapping cache and watcher tests for the Orch service
+Reloads mappings from SQLite and from a mapping file in a temporary directory
+"""
+
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.database import DatabaseManager
+from app.common.mapping_cache import MappingCache
+from app.common.mapping_watcher import MappingWatcher
+from app.common.resource_manager import ResourceManager
+
+UUID = '00000000-0000-0000-0000-000000000001'
+OTHER_UUID = '00000000-0000-0000-0000-000000000002'
+
+MAPPINGS = f"""
+{UUID}:
+  type: principal
+  resource: hub@KOJI.BOX
+  description: hub
+"""
+
+
+class CountingStorage:
+    """Passes through to a storage backend, counting full mapping loads"""
+
+    def __init__(self, db):
+        self.db = db
+        self.loads = 0
+
+    def load_mappings_snapshot(self):
+        self.loads += 1
+        return self.db.load_mappings_snapshot()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+@pytest.fixture
+def db(tmp_path):
+    storage = DatabaseManager(str(tmp_path / 'orch.db'))
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def resource_manager(db):
+    # only the mapping file parsing and sync are exercised
+    manager = object.__new__(ResourceManager)
+    manager.db = db
+    return manager
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.02)
+
+
+def test_cache_reloads_when_generation_moves(db):
+    storage = CountingStorage(db)
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', 'hub')
+    cache = MappingCache(storage, check_interval=0.1)
+
+    assert cache.get(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+    assert cache.get(OTHER_UUID) is None
+    assert cache.generation == db.get_mappings_generation()
+    assert storage.loads == 1
+
+    # unchanged generation: the cached copy keeps serving
+    time.sleep(0.15)
+    assert [mapping['uuid'] for mapping in cache.get_all()] == [UUID]
+    assert storage.loads == 1
+
+    # another worker changes the mappings; seen after the check interval
+    db.add_resource_mapping(OTHER_UUID, 'cert', 'web.koji.box', 'web')
+    assert cache.get(OTHER_UUID) is None
+    time.sleep(0.15)
+    assert cache.get(OTHER_UUID)['resource_type'] == 'cert'
+    assert cache.generation == db.get_mappings_generation()
+    assert storage.loads == 2
+
+    # refresh() checks straight away
+    db.sync_resource_mappings({UUID: {'resource_type': 'principal', 'actual_resource_name': 'hub@KOJI.BOX',
+                                      'description': 'hub'}})
+    cache.refresh()
+    assert cache.get(OTHER_UUID) is None
+
+
+def test_cache_returns_copies(db):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', 'hub')
+    cache = MappingCache(db)
+
+    cache.get(UUID)['actual_resource_name'] = 'web@KOJI.BOX'
+    cache.get_all()[0]['description'] = 'changed'
+    assert cache.get(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+    assert cache.get(UUID)['description'] == 'hub'
+
+
+def test_cache_keeps_serving_when_reload_fails(db, monkeypatch):
+    db.add_resource_mapping(UUID, 'principal', 'hub@KOJI.BOX', 'hub')
+    cache = MappingCache(db, check_interval=0)
+    assert cache.get(UUID)
+
+    db.add_resource_mapping(OTHER_UUID, 'cert', 'web.koji.box', 'web')
+    monkeypatch.setattr(db, 'load_mappings_snapshot', lambda: 1 / 0)
+    assert cache.get(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+    assert cache.get(OTHER_UUID) is None
+
+
+@pytest.mark.parametrize('mode', ['inotify', 'poll'])
+def test_watcher_applies_file_changes(db, resource_manager, tmp_path, monkeypatch, mode):
+    mapping_file = tmp_path / 'resource_mapping.yaml'
+    mapping_file.write_text(MAPPINGS)
+    assert resource_manager.load_resource_mappings(str(mapping_file))
+    cache = MappingCache(db)
+    assert cache.get(UUID)
+
+    if mode == 'poll':
+        monkeypatch.setattr(MappingWatcher, '_open_inotify', lambda self: None)
+    watcher = MappingWatcher(resource_manager, cache, str(mapping_file), poll_interval=0.05, settle_delay=0.05)
+    watcher.start()
+    try:
+        _wait_for(lambda: watcher.mode is not None)
+        assert watcher.mode == mode
+
+        # replaced atomically, as envsubst plus a rename would
+        staged = tmp_path / 'resource_mapping.yaml.new'
+        staged.write_text(MAPPINGS + f"{OTHER_UUID}:\n  type: cert\n  resource: web.koji.box\n")
+        os.replace(staged, mapping_file)
+
+        _wait_for(lambda: cache.get(OTHER_UUID) is not None)
+        assert cache.get(OTHER_UUID)['actual_resource_name'] == 'web.koji.box'
+        assert watcher.reloads == 1
+    finally:
+        watcher.stop()
+
+
+def test_watcher_waits_for_the_file_to_settle(db, resource_manager, tmp_path):
+    mapping_file = tmp_path / 'resource_mapping.yaml'
+    mapping_file.write_text(MAPPINGS)
+    resource_manager.load_resource_mappings(str(mapping_file))
+    watcher = MappingWatcher(resource_manager, MappingCache(db), str(mapping_file), settle_delay=0.2)
+
+    # a file that changes again during the settle delay isn't applied yet
+    with open(mapping_file, 'a') as f:
+        f.write(f"{OTHER_UUID}:\n")
+        f.flush()
+
+        def finish_writing():
+            time.sleep(0.05)
+            f.write("  type: cert\n  resource: web.koji.box\n")
+            f.flush()
+
+        writer = threading.Thread(target=finish_writing)
+        writer.start()
+        watcher._reload_if_changed()
+        writer.join()
+    assert watcher.reloads == 0
+
+    # once it holds still it is applied
+    watcher._reload_if_changed()
+    assert watcher.reloads == 1
+    assert db.get_resource_mapping(OTHER_UUID)['resource_type'] == 'cert'
+
+
+def test_conflicting_key_algorithms_are_rejected(db, resource_manager, tmp_path):
+    mapping_file = tmp_path / 'resource_mapping.yaml'
+    mapping_file.write_text(MAPPINGS + f"""
+{OTHER_UUID}:
+  type: cert
+  resource: hub.koji.box
+  key_algorithm: ecdsa-p256
+00000000-0000-0000-0000-000000000003:
+  type: key
+  resource: hub.koji.box
+""")
+    assert resource_manager.load_resource_mappings(str(mapping_file))
+    assert db.get_resource_mapping(OTHER_UUID)['key_algorithm'] == 'ecdsa-p256'
+
+    # the cert and key of one CN can't ask for different algorithms
+    mapping_file.write_text(mapping_file.read_text() + "  key_algorithm: ed25519\n")
+    assert resource_manager.read_resource_mappings(str(mapping_file)) is None
+    assert not resource_manager.load_resource_mappings(str(mapping_file))
+    assert db.get_resource_mapping('00000000-0000-0000-0000-000000000003')['key_algorithm'] is None
+
+
+def test_watcher_keeps_mappings_on_a_bad_file(db, resource_manager, tmp_path):
+    mapping_file = tmp_path / 'resource_mapping.yaml'
+    mapping_file.write_text(MAPPINGS)
+    resource_manager.load_resource_mappings(str(mapping_file))
+    watcher = MappingWatcher(resource_manager, MappingCache(db), str(mapping_file), settle_delay=0)
+
+    mapping_file.write_text("")
+    watcher._reload_if_changed()
+    assert watcher.reloads == 0
+    assert db.get_resource_mapping(UUID)['actual_resource_name'] == 'hub@KOJI.BOX'
+
+
+# The end.
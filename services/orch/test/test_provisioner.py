@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Startup provisioning tests for the Orch service
+Runs the dependency graph against a recording resource manager
+"""
+
+import sys
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.database import DatabaseManager
+from app.common.provisioner import Provisioner
+
+
+class RecordingResourceManager:
+    """Stands in for ResourceManager, logging when each creation starts and ends"""
+
+    krb5_realm = 'KOJI.BOX'
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.events = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self.ca_manager = type('CA', (), {'ca_cn': 'koji-box-ca',
+                                          'get_ca_certificate': lambda _: Path('/tmp/ca.crt') if self._work('ca', 'ca') else None})()
+        self.kadmin = type('Kadmin', (), {'close': lambda _: None})()
+
+    def _work(self, kind, name):
+        with self._lock:
+            self.events.append(('start', f"{kind}:{name}"))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self._lock:
+            self.active -= 1
+            self.events.append(('end', f"{kind}:{name}"))
+        return name not in self.fail
+
+    def worker_principal(self, worker_name):
+        return f"worker/{worker_name}", f"worker/{worker_name}@{self.krb5_realm}"
+
+    def ensure_principal(self, name):
+        return self._work('principal', name)
+
+    def create_keytab(self, name):
+        return Path(f"/tmp/{name}.keytab") if self._work('keytab', name) else None
+
+    def create_certificate(self, cn, key_algorithm=None):
+        ok = self._work('cert', cn)
+        return (Path(f"/tmp/{cn}.key"), Path(f"/tmp/{cn}.crt")) if ok else (None, None)
+
+    def register_koji_host(self, worker_name, principal_name, arch=None):
+        return self._work('koji_host', worker_name)
+
+
+@pytest.fixture
+def db(tmp_path):
+    storage = DatabaseManager(str(tmp_path / 'orch.db'))
+    storage.add_resource_mapping('hub-keytab', 'principal', 'hub@KOJI.BOX')
+    storage.add_resource_mapping('web-keytab', 'principal', 'web@KOJI.BOX')
+    storage.add_resource_mapping('hub-cert', 'cert', 'hub.koji.box')
+    storage.add_resource_mapping('hub-key', 'key', 'hub.koji.box')
+    storage.add_resource_mapping('web-cert', 'cert', 'web.koji.box')
+    storage.add_resource_mapping('worker-keytab', 'worker', 'koji-worker')
+    yield storage
+    storage.close()
+
+
+def _order(events, task):
+    return events.index(('start', task)), events.index(('end', task))
+
+
+def test_graph_orders_dependencies(db):
+    rm = RecordingResourceManager()
+    provisioner = Provisioner(db, rm, parallelism=4, worker_scale=2)
+    assert provisioner.run() == {'done': 13}
+
+    events = rm.events
+    for cert in ('cert:hub.koji.box', 'cert:web.koji.box'):
+        assert _order(events, 'ca:ca')[1] < _order(events, cert)[0]
+    for name in ('hub@KOJI.BOX', 'web@KOJI.BOX', 'worker/koji-worker-1@KOJI.BOX'):
+        assert _order(events, f"principal:{name}")[1] < _order(events, f"keytab:{name}")[0]
+    assert _order(events, 'keytab:worker/koji-worker-2@KOJI.BOX')[1] < \
+        _order(events, 'koji_host:worker/koji-worker-2')[0]
+
+    # the shared CN is built once, and independent tasks overlapped
+    assert events.count(('start', 'cert:hub.koji.box')) == 1
+    assert 1 < rm.max_active <= 4
+
+    status = provisioner.status()
+    assert status['state'] == 'complete' and status['counts'] == {'done': 13}
+    assert {'task': 'keytab:hub@KOJI.BOX', 'depends_on': ['principal:hub@KOJI.BOX']}.items() <= \
+        next(t for t in status['tasks'] if t['task'] == 'keytab:hub@KOJI.BOX').items()
+
+
+def test_failure_skips_dependents(db):
+    rm = RecordingResourceManager(fail={'ca', 'hub@KOJI.BOX'})
+    provisioner = Provisioner(db, rm, parallelism=2)
+    assert provisioner.run() == {'failed': 2, 'skipped': 3, 'done': 2}
+
+    tasks = {t['task']: t for t in provisioner.status()['tasks']}
+    assert tasks['keytab:hub@KOJI.BOX']['state'] == 'skipped'
+    assert tasks['cert:web.koji.box']['error'] == 'dependency ca did not complete'
+    assert tasks['keytab:web@KOJI.BOX']['state'] == 'done'
+    assert provisioner.status()['state'] == 'incomplete'
+    assert ('start', 'cert:hub.koji.box') not in rm.events
+
+
+def test_status_before_any_run(db):
+    assert Provisioner(db, RecordingResourceManager()).status()['state'] == 'not_started'
+
+
+# The end.
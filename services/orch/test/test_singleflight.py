@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Singleflight tests for the Orch service
+Concurrent builders of one resource, in threads and in forked workers
+"""
+
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.common.singleflight import Singleflight
+
+
+def _build_once(target: Path, builds: Path):
+    """Build target unless it exists, the way the resource creators do"""
+    if target.exists():
+        return str(target)
+    with open(builds, 'a') as f:
+        f.write(f"{os.getpid()}\n")
+    time.sleep(0.2)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp.write_text('built')
+    os.replace(tmp, target)
+    return str(target)
+
+
+def test_concurrent_callers_share_one_build(tmp_path):
+    flight = Singleflight(tmp_path / 'locks')
+    calls = []
+    results = []
+    barrier = threading.Barrier(8)
+
+    def build():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'hub.koji.box.crt'
+
+    def caller():
+        barrier.wait()
+        results.append(flight.do('cert:hub.koji.box', build))
+
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['hub.koji.box.crt'] * 8
+    assert flight.stats() == {'builds': 1, 'shared': 7, 'waited': 0}
+
+
+def test_different_keys_build_in_parallel(tmp_path):
+    flight = Singleflight(tmp_path / 'locks')
+    start = time.monotonic()
+    threads = [threading.Thread(target=flight.do, args=(f"cert:{n}", lambda: time.sleep(0.2)))
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start < 0.6
+
+
+def test_build_error_reaches_every_caller(tmp_path):
+    flight = Singleflight(tmp_path / 'locks')
+    errors = []
+    started = threading.Event()
+
+    def build():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("openssl failed")
+
+    def follower():
+        started.wait()
+        try:
+            flight.do('cert:hub.koji.box', build)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        flight.do('cert:hub.koji.box', build)
+    thread.join()
+    assert len(errors) == 1
+
+    # the failure isn't cached
+    assert flight.do('cert:hub.koji.box', lambda: 'ok') == 'ok'
+
+
+def _worker(lock_dir, target, builds, barrier, results):
+    flight = Singleflight(Path(lock_dir))
+    barrier.wait()
+    results.put(flight.do('keytab:hub@KOJI.BOX', lambda: _build_once(Path(target), Path(builds))))
+
+
+def test_workers_wait_on_a_single_builder(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(4)
+    results = ctx.Queue()
+    target, builds = tmp_path / 'hub.keytab', tmp_path / 'builds'
+    workers = [ctx.Process(target=_worker, args=(str(tmp_path / 'locks'), str(target), str(builds),
+                                                 barrier, results))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode == 0
+
+    assert [results.get(timeout=1) for _ in workers] == [str(target)] * 4
+    assert len(builds.read_text().split()) == 1
+
+
+def test_lock_wait_times_out(tmp_path):
+    holder = Singleflight(tmp_path / 'locks')
+    waiter = Singleflight(tmp_path / 'locks', timeout=0.2)
+    with holder.lock('ca:database'):
+        # a second instance stands in for another worker's lock
+        with pytest.raises(TimeoutError):
+            with waiter.lock('ca:database'):
+                pass
+    with waiter.lock('ca:database'):
+        pass
+
+
+# The end.